@@ -0,0 +1,757 @@
+"""
+AWS Cost Explorer 数据获取模块
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionClosedError, EndpointConnectionError, ReadTimeoutError
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Tuple
+
+from aws_credentials import CredentialCache
+from config import (
+    SUPPORTED_COST_METRICS,
+    FETCH_ACCOUNT_TIMEOUT,
+    ASSUME_ROLE_CACHE_PATH,
+    ASSUME_ROLE_DURATION,
+    ASSUME_ROLE_SESSION_NAME,
+    ASSUME_ROLE_REFRESH_MARGIN,
+    STS_REGION
+)
+from cost_cache import GROUP_KEY_SEPARATOR
+from rate_limiter import AdaptiveRateLimiter
+
+# 默认使用的成本指标
+DEFAULT_METRIC = 'UnblendedCost'
+
+# GetCostAndUsage 支持的指标
+SUPPORTED_METRICS = SUPPORTED_COST_METRICS
+
+# Cost Explorer 限流时返回的错误码
+THROTTLING_ERROR_CODES = (
+    'LimitExceededException', 'ThrottlingException', 'Throttling',
+    'TooManyRequestsException', 'RequestLimitExceeded'
+)
+
+# 可以直接重试的网络错误
+TRANSIENT_ERRORS = (ConnectionClosedError, EndpointConnectionError, ReadTimeoutError)
+
+# 单次请求的连接和读取超时（秒）：botocore 默认60秒，配置了单账号超时时不超过该超时
+REQUEST_TIMEOUT = min(60.0, FETCH_ACCOUNT_TIMEOUT) if FETCH_ACCOUNT_TIMEOUT > 0 else 60.0
+
+
+def create_client(access_key_id: str = None, secret_access_key: str = None, region: str = 'us-east-1',
+                  session=None, max_pool_connections: int = 10, session_token: str = None):
+    """
+    创建 Cost Explorer 客户端（访问密钥为空时使用默认凭证链）
+
+    重试由 AWSCostExplorer._get_cost_and_usage 统一处理（与限流器联动），关闭 botocore 自带的重试；
+    连接和读取超时为 REQUEST_TIMEOUT，单次请求不会超过单账号超时
+
+    Args:
+        access_key_id: AWS访问密钥ID
+        secret_access_key: AWS秘密访问密钥
+        region: AWS区域
+        session: 可选，boto3 会话（默认使用 boto3 的默认会话）
+        max_pool_connections: 连接池最大连接数
+        session_token: 可选，临时凭证的会话令牌
+    """
+    config = Config(
+        retries={'mode': 'standard', 'max_attempts': 1}, max_pool_connections=max_pool_connections,
+        connect_timeout=REQUEST_TIMEOUT, read_timeout=REQUEST_TIMEOUT
+    )
+    client_kwargs = {'region_name': region, 'config': config}
+    if access_key_id and secret_access_key:
+        client_kwargs['aws_access_key_id'] = access_key_id
+        client_kwargs['aws_secret_access_key'] = secret_access_key
+        if session_token:
+            client_kwargs['aws_session_token'] = session_token
+    if session is not None:
+        return session.client('ce', **client_kwargs)
+    return boto3.client('ce', **client_kwargs)
+
+
+def default_credential_cache() -> CredentialCache:
+    """按配置（ASSUME_ROLE_*）创建临时凭证缓存"""
+    return CredentialCache(
+        ASSUME_ROLE_CACHE_PATH, ASSUME_ROLE_DURATION, ASSUME_ROLE_SESSION_NAME, ASSUME_ROLE_REFRESH_MARGIN, STS_REGION
+    )
+
+
+class ClientCache:
+    def __init__(self, max_pool_connections: int = 10, max_clients: int = 0, credential_cache: CredentialCache = None):
+        """
+        按 凭证 × 区域 缓存 Cost Explorer 客户端（线程安全）
+
+        所有客户端共享一个 boto3 会话，服务模型、端点数据和默认凭证链只加载一次，
+        客户端在锁内创建（boto3 默认会话在多个线程中同时创建客户端不是线程安全的）；
+        访问同一端点的客户端共享一个连接池（请求按各自的凭证签名，连接本身与凭证无关），
+        几百个账号也只建立 max_pool_connections 个TLS连接。
+
+        Args:
+            max_pool_connections: 共享连接池的最大连接数，应与并发获取的线程数一致
+            max_clients: 最多缓存的客户端数，超出时淘汰最久未使用的客户端（正在使用的客户端不受影响），
+                0 表示不限制。单次运行每个账号只查询一次，设置为并发数即可避免同时持有所有账号的客户端
+            credential_cache: 可选，配置了 role_arn 的账号使用的临时凭证缓存（默认按配置创建）
+        """
+        self.max_pool_connections = max_pool_connections
+        self.max_clients = max_clients
+        self.credential_cache = credential_cache if credential_cache is not None else default_credential_cache()
+        self._session = None
+        self._clients = OrderedDict()
+        # 角色客户端当前使用的临时凭证（凭证更新后重新创建客户端）
+        self._role_credentials = {}
+        self._http_sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, access_key_id: str = None, secret_access_key: str = None, region: str = 'us-east-1',
+            role_arn: str = None, external_id: str = None):
+        """
+        获取客户端，不存在时创建
+
+        配置了 role_arn 时使用该角色的临时凭证（忽略访问密钥），按角色缓存客户端，临时凭证更新后重新创建。
+        AssumeRole 在锁外调用，各账号的 STS 请求在各自的获取线程中与其他账号的成本查询并发进行。
+        """
+        credentials = session_token = None
+        if role_arn:
+            credentials = self.credential_cache.get(role_arn, external_id)
+            access_key_id, secret_access_key = credentials.access_key_id, credentials.secret_access_key
+            session_token = credentials.session_token
+        key = self._key(access_key_id, secret_access_key, region, role_arn, external_id)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None and self._role_credentials.get(key) is credentials:
+                self._clients.move_to_end(key)
+                return client
+            if self._session is None:
+                self._session = boto3.session.Session()
+            client = create_client(access_key_id, secret_access_key, region, self._session,
+                                   self.max_pool_connections, session_token)
+            self._share_connection_pool(client)
+            self._clients[key] = client
+            self._clients.move_to_end(key)
+            if role_arn:
+                self._role_credentials[key] = credentials
+            if self.max_clients and len(self._clients) > self.max_clients:
+                evicted, _ = self._clients.popitem(last=False)
+                self._role_credentials.pop(evicted, None)
+            return client
+
+    @staticmethod
+    def _key(access_key_id: str, secret_access_key: str, region: str, role_arn: str = None,
+             external_id: str = None) -> tuple:
+        """客户端的缓存键：配置了角色时为 (角色ARN, 外部ID, 区域)，否则为 (访问密钥ID, 秘密访问密钥, 区域)"""
+        if role_arn:
+            return role_arn, external_id or '', region
+        return access_key_id, secret_access_key, region
+
+    def _share_connection_pool(self, client):
+        """让访问同一端点的客户端使用第一个客户端的连接池"""
+        endpoint = getattr(client, '_endpoint', None)
+        if endpoint is None or not hasattr(endpoint, 'http_session'):
+            return
+        shared = self._http_sessions.setdefault(endpoint.host, endpoint.http_session)
+        if shared is not endpoint.http_session:
+            # 新客户端的连接池还没有建立任何连接，直接关闭
+            endpoint.http_session.close()
+            endpoint.http_session = shared
+
+    def retain(self, accounts: List[dict]) -> int:
+        """
+        只保留账号配置中仍在使用的客户端（重新加载账号配置后调用，释放已删除账号或已轮换凭证的客户端）
+
+        连接池由所有客户端共享，释放客户端时不关闭连接。
+
+        Args:
+            accounts: AWS_ACCOUNTS 格式的账号配置列表
+
+        Returns:
+            释放的客户端数量
+        """
+        keys = {
+            self._key(
+                account.get('access_key_id'), account.get('secret_access_key'), account.get('region', 'us-east-1'),
+                account.get('role_arn'), account.get('external_id')
+            )
+            for account in accounts
+        }
+        with self._lock:
+            stale = [key for key in self._clients if key not in keys]
+            for key in stale:
+                del self._clients[key]
+                self._role_credentials.pop(key, None)
+        return len(stale)
+
+    def close(self):
+        """关闭共享的连接池并清空缓存"""
+        with self._lock:
+            for http_session in self._http_sessions.values():
+                http_session.close()
+            self._http_sessions.clear()
+            self._clients.clear()
+            self._role_credentials.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._clients)
+
+
+class AWSCostExplorer:
+    def __init__(self, access_key_id: str = None, secret_access_key: str = None, region: str = 'us-east-1',
+                 cache=None, cache_key: str = None, metrics: List[str] = None,
+                 rate_limiter: AdaptiveRateLimiter = None, max_retries: int = 8,
+                 backoff_base: float = 1.0, backoff_max: float = 30.0, client_cache: ClientCache = None,
+                 monthly_from_daily: bool = False, reconcile_tolerance: float = None, role_arn: str = None,
+                 external_id: str = None, deadline: float = None):
+        """
+        初始化AWS Cost Explorer客户端
+
+        Args:
+            access_key_id: AWS访问密钥ID（为空时使用默认凭证链）
+            secret_access_key: AWS秘密访问密钥
+            region: AWS区域
+            cache: 可选，CostCache 实例，用于缓存已结算周期的数据
+            cache_key: 缓存中区分账号的键（默认使用访问密钥ID或角色ARN）
+            metrics: 每次请求同时获取的指标列表，第一个为主指标（用于总计和变化），默认 ['UnblendedCost']
+            rate_limiter: 可选，多个实例共享的限流器（默认每个实例单独限流）
+            max_retries: 限流或服务端错误时的最大重试次数
+            backoff_base: 第一次重试的最大等待时间（秒），之后按指数增长
+            backoff_max: 单次重试等待时间上限（秒）
+            client_cache: 可选，ClientCache 实例，复用已创建的客户端（默认每个实例新建客户端）
+            monthly_from_daily: 月粒度周期未缓存但该月每一天都已缓存时，由日数据的月累计得到该月成本
+            reconcile_tolerance: 可选，由日数据得到的月份用一次不按服务分组的请求核对主指标总计，
+                                 差额超过该比例（且超过0.01）时改为从API获取该月明细；None 表示不核对
+            role_arn: 可选，通过 STS AssumeRole 扮演该角色访问账号（代替访问密钥）
+            external_id: 可选，角色信任策略要求的外部ID
+            deadline: 可选，截止时间（time.monotonic()），超过后不再发起请求或重试，直接抛出 TimeoutError
+        """
+        metrics = list(dict.fromkeys(metrics or [DEFAULT_METRIC]))
+        unsupported = [metric for metric in metrics if metric not in SUPPORTED_METRICS]
+        if unsupported:
+            raise ValueError(f"不支持的成本指标: {', '.join(unsupported)}")
+        if client_cache is not None:
+            self.client = client_cache.get(access_key_id, secret_access_key, region, role_arn, external_id)
+        elif role_arn:
+            credentials = default_credential_cache().get(role_arn, external_id)
+            self.client = create_client(
+                credentials.access_key_id, credentials.secret_access_key, region,
+                session_token=credentials.session_token
+            )
+        else:
+            self.client = create_client(access_key_id, secret_access_key, region)
+        self.metrics = metrics
+        self.metric = metrics[0]
+        self.cache = cache
+        self.cache_key = cache_key or access_key_id or role_arn or 'default'
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.monthly_from_daily = monthly_from_daily
+        self.reconcile_tolerance = reconcile_tolerance
+        self.deadline = deadline
+        # 本实例的请求和重试次数（用于按账号统计）
+        self.api_calls = 0
+        self.retries = 0
+        # 关联账号ID到账号名称的映射（整合账单模式下由API返回）
+        self.linked_account_names = {}
+
+    @staticmethod
+    def _group_definition(key: str) -> Dict[str, str]:
+        """
+        将分组名称转换为 GroupBy 定义，'TAG:<标签键>' 表示按成本分配标签分组，其余为维度
+        """
+        if key.startswith('TAG:'):
+            return {'Type': 'TAG', 'Key': key[4:]}
+        return {'Type': 'DIMENSION', 'Key': key}
+
+    @staticmethod
+    def _filter_expression(filters: Dict[str, List[str]]) -> dict:
+        """
+        将 {维度: [值]} 转换为 Filter 表达式（多个维度之间为 And）
+        """
+        expressions = [{'Dimensions': {'Key': key, 'Values': list(values)}} for key, values in filters.items()]
+        return expressions[0] if len(expressions) == 1 else {'And': expressions}
+
+    def _get_cost_and_usage(self, request: dict) -> dict:
+        """
+        经过限流器调用 GetCostAndUsage，限流、服务端错误和网络错误时按指数退避重试
+
+        Args:
+            request: GetCostAndUsage 请求参数
+
+        Returns:
+            API响应
+
+        Raises:
+            超过最大重试次数或不可重试的错误时抛出原始异常；超过截止时间时抛出 TimeoutError
+        """
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            self._check_deadline()
+            self.api_calls += 1
+            try:
+                response = self.client.get_cost_and_usage(**request)
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code', '')
+                throttled = code in THROTTLING_ERROR_CODES
+                if not throttled and e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) < 500:
+                    raise
+                if throttled:
+                    self.rate_limiter.on_throttle()
+                if attempt == self.max_retries:
+                    raise
+                reason = '请求被限流' if throttled else '服务端错误'
+                print(f"  {self.cache_key}: Cost Explorer {reason} ({code})，第 {attempt + 1} 次重试")
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"  {self.cache_key}: Cost Explorer 网络错误 ({str(e)})，第 {attempt + 1} 次重试")
+            else:
+                self.rate_limiter.on_success()
+                return response
+            # 剩余时间不足以重试时放弃，退避等待不超过剩余时间
+            self._check_deadline()
+            backoff_max = self.backoff_max
+            if self.deadline is not None:
+                backoff_max = min(backoff_max, self.deadline - time.monotonic())
+            self.retries += 1
+            self.rate_limiter.backoff(attempt, self.backoff_base, backoff_max)
+
+    def _check_deadline(self):
+        """
+        超过截止时间时抛出 TimeoutError（线程池无法强制终止线程，超时的账号由此停止后续请求）
+        """
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise TimeoutError(f"{self.cache_key}: 已超过单账号超时，停止请求 Cost Explorer")
+
+    def iter_cost_and_usage(self, start_date: str, end_date: str, granularity: str, group_by: List[str] = None,
+                            filters: Dict[str, List[str]] = None) -> Iterator[Tuple[str, Tuple[str, ...], Dict[str, float]]]:
+        """
+        逐页流式返回 GetCostAndUsage 的分组结果
+
+        每次只持有一页响应，调用方边读取边汇总，适合按使用类型、区域、标签等高基数维度分组的查询。
+        self.metrics 中的所有指标在同一个请求中获取，不增加请求次数。
+
+        Args:
+            start_date: 开始日期（YYYY-MM-DD，包含）
+            end_date: 结束日期（YYYY-MM-DD，不包含）
+            granularity: 'DAILY' 或 'MONTHLY'
+            group_by: 分组列表（最多2个），例如 ['SERVICE']、['LINKED_ACCOUNT', 'SERVICE']、['SERVICE', 'TAG:Team']
+            filters: 可选，按维度过滤 {维度: [值]}，例如 {'SERVICE': ['Amazon Elastic Compute Cloud - Compute']}
+
+        Yields:
+            (周期开始日期, 分组键元组, {指标名: 金额})，包含 self.metrics 中的所有指标
+        """
+        group_by = group_by or ['SERVICE']
+        request = {
+            'TimePeriod': {'Start': start_date, 'End': end_date},
+            'Granularity': granularity,
+            'Metrics': list(self.metrics),
+            'GroupBy': [self._group_definition(key) for key in group_by]
+        }
+        if filters:
+            request['Filter'] = self._filter_expression(filters)
+
+        while True:
+            response = self._get_cost_and_usage(request)
+
+            # 按关联账号分组时，响应中包含账号ID对应的账号名称
+            for attribute in response.get('DimensionValueAttributes', []):
+                name = attribute.get('Attributes', {}).get('description')
+                if name:
+                    self.linked_account_names[attribute['Value']] = name
+
+            for result in response.get('ResultsByTime', []):
+                period = result['TimePeriod']['Start']
+                for group in result.get('Groups', []):
+                    metrics = {
+                        metric: float(value['Amount'])
+                        for metric, value in group['Metrics'].items()
+                    }
+                    yield period, tuple(group['Keys']), metrics
+
+            next_token = response.get('NextPageToken')
+            if not next_token:
+                break
+            request['NextPageToken'] = next_token
+
+    @staticmethod
+    def _split_periods(start: datetime, end: datetime, granularity: str) -> List[Tuple[datetime, datetime]]:
+        """
+        将时间段拆分为连续的日或月周期
+
+        Returns:
+            [(周期开始, 周期结束)]，周期结束不包含
+        """
+        periods = []
+        current = start
+        while current < end:
+            if granularity == 'MONTHLY':
+                if current.month == 12:
+                    next_start = datetime(current.year + 1, 1, 1)
+                else:
+                    next_start = datetime(current.year, current.month + 1, 1)
+            else:
+                next_start = current + timedelta(days=1)
+            periods.append((current, next_start))
+            current = next_start
+        return periods
+
+    def cache_account(self, group_by: List[str], filters: Dict[str, List[str]] = None) -> str:
+        """
+        缓存中使用的账号键，按服务分组时为 cache_key，其他分组为 "<cache_key>@<分组1>+<分组2>"，
+        有过滤条件时再追加 "?<维度>=<值1>,<值2>"
+        """
+        if group_by == ['SERVICE'] and not filters:
+            return self.cache_key
+        cache_account = f"{self.cache_key}@{'+'.join(group_by)}"
+        for key, values in sorted((filters or {}).items()):
+            cache_account += f"?{key}={','.join(values)}"
+        return cache_account
+
+    def iter_period_rows(self, start: datetime, end: datetime, granularity: str = 'DAILY', group_by: List[str] = None,
+                         filters: Dict[str, List[str]] = None) -> Iterator[Tuple[str, Tuple[str, ...], Dict[str, float]]]:
+        """
+        流式返回一段连续时间内每个周期的分组成本
+
+        已结算且已缓存的周期直接从本地缓存读取，其余周期合并成一次分页请求流式获取，
+        已结算的周期在读取完成后写入缓存。每个指标分别缓存，只有所有指标都已缓存的周期才从缓存读取。
+        启用 monthly_from_daily 时，未缓存的月份如果每一天都已缓存，使用日数据的月累计（可选先与API月总计核对）。
+
+        Args:
+            start: 开始日期（包含，月粒度时为月份第一天）
+            end: 结束日期（不包含）
+            granularity: 'DAILY' 或 'MONTHLY'
+            group_by: 分组列表，默认 ['SERVICE']
+            filters: 可选，按维度过滤 {维度: [值]}（不同的过滤条件分别缓存）
+
+        Yields:
+            (周期开始日期, 分组键元组, {指标名: 金额})，按周期顺序，包含 self.metrics 中的所有指标
+        """
+        group_by = group_by or ['SERVICE']
+        cache_account = self.cache_account(group_by, filters)
+        start = datetime(start.year, start.month, start.day)
+        end = datetime(end.year, end.month, end.day)
+
+        missing = []
+        # 由日数据汇总、等待与API月总计核对的月份 {周期开始日期: (周期开始, 周期结束, 分组成本)}
+        from_daily = {}
+        for period_start, period_end in self._split_periods(start, end, granularity):
+            period = period_start.strftime('%Y-%m-%d')
+            if self.cache is not None and self.cache.is_finalized(period_end):
+                cached = self._get_cached_period(cache_account, granularity, period)
+                if cached is None and granularity == 'MONTHLY' and self.monthly_from_daily:
+                    cached = self._get_cached_period(cache_account, granularity, period, from_daily=True)
+                    if cached is not None and self.reconcile_tolerance is not None:
+                        from_daily[period] = (period_start, period_end, cached)
+                        continue
+                if cached is not None:
+                    for key, metrics in cached.items():
+                        yield period, tuple(key.split(GROUP_KEY_SEPARATOR)), metrics
+                    continue
+            missing.append((period_start, period_end))
+
+        if from_daily:
+            mismatched = self._reconcile_months(from_daily, group_by, filters)
+            for period, (period_start, period_end, cached) in from_daily.items():
+                if period in mismatched:
+                    missing.append((period_start, period_end))
+                    continue
+                for key, metrics in cached.items():
+                    yield period, tuple(key.split(GROUP_KEY_SEPARATOR)), metrics
+            missing.sort()
+
+        if not missing:
+            return
+
+        # 需要写入缓存的已结算周期（包括没有费用的周期）
+        to_store = {
+            period_start.strftime('%Y-%m-%d'): {metric: {} for metric in self.metrics}
+            for period_start, period_end in missing
+            if self.cache is not None and self.cache.is_finalized(period_end)
+        }
+        missing_periods = {period_start.strftime('%Y-%m-%d') for period_start, _ in missing}
+
+        # 只请求覆盖所有缺失周期的最小连续区间
+        rows = self.iter_cost_and_usage(
+            missing[0][0].strftime('%Y-%m-%d'),
+            missing[-1][1].strftime('%Y-%m-%d'),
+            granularity,
+            group_by,
+            filters
+        )
+        for period, keys, metrics in rows:
+            # 区间内已从缓存返回的周期不再重复返回
+            if period not in missing_periods:
+                continue
+            if period in to_store:
+                key = GROUP_KEY_SEPARATOR.join(keys)
+                for metric, costs in to_store[period].items():
+                    costs[key] = costs.get(key, 0.0) + metrics.get(metric, 0.0)
+            yield period, keys, metrics
+
+        # 只缓存已经结算完成的周期，未结算的数据下次仍从API获取
+        for period, metric_costs in to_store.items():
+            for metric, costs in metric_costs.items():
+                self.cache.put(cache_account, granularity, period, metric, costs)
+        if group_by[0] == 'LINKED_ACCOUNT' and self.cache is not None and self.linked_account_names:
+            self.cache.put_account_names(self.linked_account_names)
+
+    def _get_cached_period(self, cache_account: str, granularity: str, period: str,
+                           from_daily: bool = False) -> Dict[str, Dict[str, float]]:
+        """
+        从缓存读取某个周期所有指标的数据
+
+        Args:
+            from_daily: 读取日数据的月累计（period 为月份第一天）
+
+        Returns:
+            {分组键: {指标名: 金额}}；任一指标未缓存（月累计不完整）时返回None
+        """
+        rows = {}
+        for metric in self.metrics:
+            if from_daily:
+                cached = self.cache.get_month_from_daily(cache_account, period, metric)
+            else:
+                cached = self.cache.get(cache_account, granularity, period, metric)
+            if cached is None:
+                return None
+            for key, amount in cached.items():
+                rows.setdefault(key, {})[metric] = amount
+        # 某个指标没有记录的分组按0补齐，与API返回的结构一致
+        for metrics in rows.values():
+            for metric in self.metrics:
+                metrics.setdefault(metric, 0.0)
+        return rows
+
+    def _reconcile_months(self, months: Dict[str, tuple], group_by: List[str],
+                          filters: Dict[str, List[str]] = None) -> List[str]:
+        """
+        用一次不按服务分组的月粒度请求核对由日数据汇总的月份（只请求主指标，响应很小）
+
+        按 group_by 中服务之外的分组（例如整合账单模式的关联账号）分别比较总计。
+
+        Args:
+            months: {周期开始日期: (周期开始, 周期结束, {分组键: {指标名: 金额}})}
+            group_by: 分组列表，最后一项为服务
+            filters: 可选，与明细查询相同的过滤条件
+
+        Returns:
+            总计不一致的周期开始日期列表
+        """
+        expected = {}
+        for period, (_, _, cached) in months.items():
+            totals = expected.setdefault(period, {})
+            for key, metrics in cached.items():
+                prefix = tuple(key.split(GROUP_KEY_SEPARATOR))[:-1]
+                totals[prefix] = totals.get(prefix, 0.0) + metrics[self.metric]
+
+        bounds = sorted(period_bounds[:2] for period_bounds in months.values())
+        request = {
+            'TimePeriod': {'Start': bounds[0][0].strftime('%Y-%m-%d'), 'End': bounds[-1][1].strftime('%Y-%m-%d')},
+            'Granularity': 'MONTHLY',
+            'Metrics': [self.metric]
+        }
+        if len(group_by) > 1:
+            request['GroupBy'] = [self._group_definition(key) for key in group_by[:-1]]
+        if filters:
+            request['Filter'] = self._filter_expression(filters)
+
+        actual = {}
+        while True:
+            response = self._get_cost_and_usage(request)
+            for result in response.get('ResultsByTime', []):
+                totals = actual.setdefault(result['TimePeriod']['Start'], {})
+                if 'GroupBy' not in request:
+                    totals[()] = float(result.get('Total', {}).get(self.metric, {}).get('Amount', 0.0))
+                for group in result.get('Groups', []):
+                    prefix = tuple(group['Keys'])
+                    totals[prefix] = totals.get(prefix, 0.0) + float(group['Metrics'][self.metric]['Amount'])
+            next_token = response.get('NextPageToken')
+            if not next_token:
+                break
+            request['NextPageToken'] = next_token
+
+        mismatched = []
+        for period, totals in expected.items():
+            api_totals = actual.get(period, {})
+            for prefix in set(totals) | set(api_totals):
+                cached_total = totals.get(prefix, 0.0)
+                api_total = api_totals.get(prefix, 0.0)
+                if abs(cached_total - api_total) > max(0.01, abs(api_total) * self.reconcile_tolerance):
+                    label = f" {'/'.join(prefix)}" if prefix else ''
+                    print(f"  {self.cache_key}: {period[:7]}{label} 日数据汇总 ${cached_total:,.2f} 与API月总计 "
+                          f"${api_total:,.2f} 不一致，改为从API获取该月明细")
+                    mismatched.append(period)
+                    break
+        return mismatched
+
+    def get_costs_by_period(self, start: datetime, end: datetime, granularity: str = 'DAILY') -> Dict[str, Dict[str, float]]:
+        """
+        获取一段连续时间内每个周期按服务分组的成本
+
+        Args:
+            start: 开始日期（包含，月粒度时为月份第一天）
+            end: 结束日期（不包含）
+            granularity: 'DAILY' 或 'MONTHLY'
+
+        Returns:
+            {周期开始日期(YYYY-MM-DD): {服务名: 成本}}，按日期排序，没有费用的周期为空字典
+        """
+        start = datetime(start.year, start.month, start.day)
+        end = datetime(end.year, end.month, end.day)
+        result = {
+            period_start.strftime('%Y-%m-%d'): {}
+            for period_start, _ in self._split_periods(start, end, granularity)
+        }
+        for period, keys, metrics in self.iter_period_rows(start, end, granularity):
+            costs = result[period]
+            costs[keys[0]] = costs.get(keys[0], 0.0) + metrics[self.metric]
+        return result
+
+    def get_linked_account_costs_by_period(self, start: datetime, end: datetime,
+                                           granularity: str = 'DAILY') -> Dict[str, Dict[str, Dict[str, float]]]:
+        """
+        整合账单模式：通过付款账号获取每个周期按关联账号和服务分组的成本
+
+        Args:
+            start: 开始日期（包含，月粒度时为月份第一天）
+            end: 结束日期（不包含）
+            granularity: 'DAILY' 或 'MONTHLY'
+
+        Returns:
+            {周期开始日期(YYYY-MM-DD): {关联账号ID: {服务名: 成本}}}，按日期排序
+        """
+        start = datetime(start.year, start.month, start.day)
+        end = datetime(end.year, end.month, end.day)
+        result = {
+            period_start.strftime('%Y-%m-%d'): {}
+            for period_start, _ in self._split_periods(start, end, granularity)
+        }
+        for period, (account_id, service), metrics in self.iter_period_rows(
+                start, end, granularity, ['LINKED_ACCOUNT', 'SERVICE']):
+            costs = result[period].setdefault(account_id, {})
+            costs[service] = costs.get(service, 0.0) + metrics[self.metric]
+        self.load_cached_account_names()
+        return result
+
+    def load_cached_account_names(self):
+        """
+        从本地缓存补全关联账号名称（周期全部来自缓存时API不会返回名称）
+        """
+        if self.cache is not None:
+            for account_id, name in self.cache.get_account_names().items():
+                self.linked_account_names.setdefault(account_id, name)
+
+    def get_daily_range_costs(self, start_date: datetime, end_date: datetime) -> Dict[str, Dict[str, float]]:
+        """
+        获取连续多天每天按服务分组的成本
+
+        Args:
+            start_date: 开始日期（包含）
+            end_date: 结束日期（包含）
+
+        Returns:
+            {日期(YYYY-MM-DD): {服务名: 成本}}
+        """
+        end = datetime(end_date.year, end_date.month, end_date.day) + timedelta(days=1)
+        return self.get_costs_by_period(start_date, end, 'DAILY')
+
+    def get_daily_costs(self, date: datetime) -> Tuple[Dict[str, float], float]:
+        """
+        获取某一天按服务分组的成本
+
+        Args:
+            date: 日期
+
+        Returns:
+            (服务成本字典, 总成本)
+        """
+        costs = self.get_daily_range_costs(date, date)[date.strftime('%Y-%m-%d')]
+        return costs, sum(costs.values())
+
+    def get_monthly_costs(self, year: int, month: int) -> Tuple[Dict[str, float], float]:
+        """
+        获取某个月按服务分组的成本
+
+        Args:
+            year: 年份
+            month: 月份
+
+        Returns:
+            (服务成本字典, 总成本)
+        """
+        start = datetime(year, month, 1)
+        costs = self.get_costs_by_period(start, start + timedelta(days=1), 'MONTHLY')[start.strftime('%Y-%m-%d')]
+        return costs, sum(costs.values())
+
+    def get_comparison_data(self, yesterday: datetime, day_before: datetime) -> Tuple[Dict[str, float], Dict[str, float], float, float]:
+        """
+        获取两天的对比数据
+
+        Args:
+            yesterday: 较新的日期
+            day_before: 较旧的日期
+
+        Returns:
+            (较新日期的服务成本, 较旧日期的服务成本, 较新日期总成本, 较旧日期总成本)
+        """
+        # 两天合并为一次范围请求
+        days = self.get_daily_range_costs(min(yesterday, day_before), max(yesterday, day_before))
+        yesterday_costs = days[yesterday.strftime('%Y-%m-%d')]
+        day_before_costs = days[day_before.strftime('%Y-%m-%d')]
+        return yesterday_costs, day_before_costs, sum(yesterday_costs.values()), sum(day_before_costs.values())
+
+    def get_monthly_comparison_data(self, year: int, month: int, previous_year: int, previous_month: int) -> Tuple[Dict[str, float], Dict[str, float], float, float]:
+        """
+        获取两个月的对比数据
+
+        Args:
+            year: 较新月份的年份
+            month: 较新的月份
+            previous_year: 较旧月份的年份
+            previous_month: 较旧的月份
+
+        Returns:
+            (较新月份的服务成本, 较旧月份的服务成本, 较新月份总成本, 较旧月份总成本)
+        """
+        # 两个月合并为一次范围请求
+        month_start = datetime(year, month, 1)
+        previous_start = datetime(previous_year, previous_month, 1)
+        months = self.get_costs_by_period(
+            min(month_start, previous_start),
+            max(month_start, previous_start) + timedelta(days=1),
+            'MONTHLY'
+        )
+        month_costs = months[month_start.strftime('%Y-%m-%d')]
+        previous_costs = months[previous_start.strftime('%Y-%m-%d')]
+        return month_costs, previous_costs, sum(month_costs.values()), sum(previous_costs.values())
+
+    def get_linked_account_comparison_data(self, newer: datetime, older: datetime,
+                                           granularity: str = 'DAILY') -> Dict[str, Tuple[Dict[str, float], Dict[str, float], float, float]]:
+        """
+        整合账单模式：一次查询获取所有关联账号两个周期的对比数据
+
+        Args:
+            newer: 较新的周期（日期，或月粒度时为月份第一天）
+            older: 较旧的周期
+            granularity: 'DAILY' 或 'MONTHLY'
+
+        Returns:
+            {关联账号ID: (较新周期的服务成本, 较旧周期的服务成本, 较新周期总成本, 较旧周期总成本)}
+        """
+        end = max(newer, older) + timedelta(days=1)
+        periods = self.get_linked_account_costs_by_period(min(newer, older), end, granularity)
+        newer_accounts = periods.get(newer.strftime('%Y-%m-%d'), {})
+        older_accounts = periods.get(older.strftime('%Y-%m-%d'), {})
+
+        comparison = {}
+        for account_id in set(newer_accounts) | set(older_accounts):
+            newer_costs = newer_accounts.get(account_id, {})
+            older_costs = older_accounts.get(account_id, {})
+            comparison[account_id] = (newer_costs, older_costs, sum(newer_costs.values()), sum(older_costs.values()))
+        return comparison
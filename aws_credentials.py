@@ -0,0 +1,220 @@
+"""
+STS 临时凭证模块
+账号配置中可以用 role_arn 代替长期访问密钥：由一个基础身份（默认凭证链）通过 STS AssumeRole 扮演各账号的角色。
+临时凭证缓存在内存中（可选同时保存到本地文件），过期前重复使用，多次运行和重试不会重复调用 STS；
+不同角色的 AssumeRole 在各自的获取线程中并发执行，同一个角色同时被多个线程请求时只调用一次。
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import boto3
+from botocore.config import Config
+
+# 角色会话名称（显示在目标账号的 CloudTrail 中）
+DEFAULT_SESSION_NAME = 'aws-billing-report'
+
+# 临时凭证剩余有效期少于该秒数时重新扮演角色，避免查询进行中凭证过期
+DEFAULT_REFRESH_MARGIN = 300
+
+
+def create_sts_client(region: str = 'us-east-1', session=None):
+    """
+    创建 STS 客户端（使用区域端点和基础身份的默认凭证链）
+
+    AssumeRole 被限流时由 botocore 的 standard 重试模式退避重试
+
+    Args:
+        region: STS 区域端点
+        session: 可选，boto3 会话（默认使用 boto3 的默认会话）
+    """
+    config = Config(retries={'mode': 'standard', 'max_attempts': 5})
+    if session is not None:
+        return session.client('sts', region_name=region, config=config)
+    return boto3.client('sts', region_name=region, config=config)
+
+
+class TemporaryCredentials:
+    def __init__(self, access_key_id: str, secret_access_key: str, session_token: str, expiration: float):
+        """
+        STS 返回的临时凭证
+
+        Args:
+            access_key_id: 临时访问密钥ID
+            secret_access_key: 临时秘密访问密钥
+            session_token: 会话令牌
+            expiration: 过期时间（Unix时间戳，秒）
+        """
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.session_token = session_token
+        self.expiration = expiration
+
+    def expires_within(self, seconds: float) -> bool:
+        """剩余有效期是否不足 seconds 秒"""
+        return self.expiration - time.time() <= seconds
+
+    def to_dict(self) -> dict:
+        """转换为可JSON序列化的字典（用于本地缓存文件）"""
+        return {
+            'access_key_id': self.access_key_id,
+            'secret_access_key': self.secret_access_key,
+            'session_token': self.session_token,
+            'expiration': self.expiration,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'TemporaryCredentials':
+        """从 to_dict 的结果恢复"""
+        return cls(data['access_key_id'], data['secret_access_key'], data['session_token'], float(data['expiration']))
+
+
+class CredentialCache:
+    def __init__(self, cache_path: str = '', duration: int = 3600, session_name: str = DEFAULT_SESSION_NAME,
+                 refresh_margin: float = DEFAULT_REFRESH_MARGIN, region: str = 'us-east-1'):
+        """
+        按角色缓存 AssumeRole 得到的临时凭证（线程安全）
+
+        Args:
+            cache_path: 本地缓存文件路径（文件权限为600），为空时只缓存在内存中
+            duration: 临时凭证有效期（秒），不能超过角色的最大会话时长
+            session_name: 角色会话名称
+            refresh_margin: 剩余有效期少于该秒数时重新扮演角色
+            region: STS 区域端点
+        """
+        self.cache_path = cache_path
+        self.duration = duration
+        self.session_name = session_name
+        self.refresh_margin = refresh_margin
+        self.region = region
+        self._credentials: Dict[Tuple[str, str], TemporaryCredentials] = {}
+        # 每个角色一个锁：同一个角色只调用一次 AssumeRole，不同角色之间互不等待
+        self._role_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._client = None
+        self._loaded = False
+        # AssumeRole 调用次数和缓存命中次数
+        self.assume_role_calls = 0
+        self.hits = 0
+
+    def get(self, role_arn: str, external_id: str = None) -> TemporaryCredentials:
+        """
+        获取角色的临时凭证，缓存中的凭证即将过期或不存在时调用 AssumeRole
+
+        Args:
+            role_arn: 角色ARN
+            external_id: 可选，角色信任策略要求的外部ID
+
+        Raises:
+            AssumeRole 失败时抛出原始异常
+        """
+        key = (role_arn, external_id or '')
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                self._load()
+            role_lock = self._role_locks.setdefault(key, threading.Lock())
+
+        with role_lock:
+            credentials = self._credentials.get(key)
+            if credentials is not None and not credentials.expires_within(self.refresh_margin):
+                with self._lock:
+                    self.hits += 1
+                return credentials
+
+            credentials = self._assume_role(role_arn, external_id)
+            with self._lock:
+                self._credentials[key] = credentials
+                self.assume_role_calls += 1
+                if self.cache_path:
+                    self._save()
+            return credentials
+
+    def _assume_role(self, role_arn: str, external_id: Optional[str]) -> TemporaryCredentials:
+        """调用 STS AssumeRole"""
+        with self._lock:
+            if self._client is None:
+                self._client = create_sts_client(self.region)
+            client = self._client
+
+        request = {'RoleArn': role_arn, 'RoleSessionName': self.session_name, 'DurationSeconds': self.duration}
+        if external_id:
+            request['ExternalId'] = external_id
+        response = client.assume_role(**request)['Credentials']
+        return TemporaryCredentials(
+            response['AccessKeyId'], response['SecretAccessKey'], response['SessionToken'],
+            response['Expiration'].timestamp()
+        )
+
+    @staticmethod
+    def _file_key(key: Tuple[str, str]) -> str:
+        """缓存文件中的键: <角色ARN>|<外部ID>"""
+        return f"{key[0]}|{key[1]}"
+
+    def _read_file(self) -> Dict[str, dict]:
+        """读取缓存文件，文件不存在或格式错误时返回空字典"""
+        if not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError) as e:
+            print(f"警告: 读取临时凭证缓存 {self.cache_path} 失败，已忽略: {str(e)}")
+            return {}
+
+    def _load(self):
+        """从缓存文件加载未过期的凭证（进程内只加载一次）"""
+        if not self.cache_path:
+            return
+        for file_key, data in self._read_file().items():
+            role_arn, _, external_id = file_key.rpartition('|')
+            try:
+                credentials = TemporaryCredentials.from_dict(data)
+            except (KeyError, TypeError, ValueError):
+                continue
+            if not credentials.expires_within(self.refresh_margin):
+                self._credentials[(role_arn, external_id)] = credentials
+
+    def _save(self):
+        """
+        写入缓存文件（调用方持有 self._lock）
+
+        与文件中其他进程写入的凭证合并（同一个角色保留过期时间较晚的凭证），只保存未过期的凭证；
+        先写入临时文件再替换，文件权限为600
+        """
+        entries = {}
+        for file_key, data in self._read_file().items():
+            try:
+                entries[file_key] = TemporaryCredentials.from_dict(data)
+            except (KeyError, TypeError, ValueError):
+                continue
+        for key, credentials in self._credentials.items():
+            existing = entries.get(self._file_key(key))
+            if existing is None or existing.expiration < credentials.expiration:
+                entries[self._file_key(key)] = credentials
+        data = {
+            file_key: credentials.to_dict()
+            for file_key, credentials in entries.items() if not credentials.expires_within(0)
+        }
+
+        directory = os.path.dirname(self.cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"警告: 写入临时凭证缓存 {self.cache_path} 失败: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def stats(self) -> Dict[str, int]:
+        """AssumeRole 调用次数、缓存命中次数和缓存的角色数"""
+        with self._lock:
+            return {'assume_role_calls': self.assume_role_calls, 'hits': self.hits, 'roles': len(self._credentials)}
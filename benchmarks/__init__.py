@@ -0,0 +1,7 @@
+"""
+性能基准测试
+使用合成账单数据、本地模拟的 Cost Explorer 和本地 SMTP 服务器，测量报告流水线各阶段的耗时、内存峰值和输出大小
+
+运行方式（在项目根目录）:
+    python -m benchmarks.run_pipeline --accounts 50 --services 120 --days 60
+"""
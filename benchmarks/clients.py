@@ -0,0 +1,91 @@
+"""
+Cost Explorer 客户端创建基准测试
+比较为每个账号单独创建客户端（boto3 默认会话）和通过 ClientCache（共享会话和连接池）创建客户端的
+耗时、内存和连接池数量（每个连接池都需要单独建立TLS连接），不发起任何网络请求
+
+运行方式（在项目根目录）:
+    python -m benchmarks.clients --accounts 300
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from typing import Dict
+
+import aws_cost_explorer
+from aws_cost_explorer import ClientCache
+
+
+def measure(mode: str, accounts: int, max_pool_connections: int, max_clients: int) -> Dict[str, object]:
+    """
+    按账号顺序创建并使用 accounts 个不同凭证的客户端（模拟单次运行），测量耗时和内存
+
+    Args:
+        mode: 'per_account'（每个账号 create_client，用完释放）或 'cache'（ClientCache）
+        accounts: 账号数量
+        max_pool_connections: 连接池大小
+        max_clients: ClientCache 最多缓存的客户端数，0 表示不限制
+
+    Returns:
+        耗时、内存和连接池数量
+    """
+    credentials = [(f"AKIABENCH{index:011d}", 'benchmark') for index in range(accounts)]
+    cache = None
+    if mode == 'cache':
+        cache = ClientCache(max_pool_connections, max_clients)
+        # 会话的首次加载不计入测量（与 per_account 使用的已预热的默认会话对比）
+        cache.get('AKIAWARMUP', 'benchmark')
+
+    pools = set()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for key, secret in credentials:
+        if cache is not None:
+            client = cache.get(key, secret)
+        else:
+            client = aws_cost_explorer.create_client(key, secret, max_pool_connections=max_pool_connections)
+        pools.add(id(client._endpoint.http_session))
+        del client
+    wall_seconds = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        'mode': mode,
+        'clients_created': accounts,
+        'wall_seconds': round(wall_seconds, 6),
+        'ms_per_client': round(wall_seconds * 1000 / accounts, 3),
+        'retained_bytes': retained,
+        'peak_bytes': peak,
+        'connection_pools': len(pools),
+    }
+    if cache is not None:
+        result['cached_clients'] = len(cache)
+        cache.close()
+    return result
+
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='Cost Explorer 客户端创建基准测试（不访问网络）')
+    parser.add_argument('--accounts', type=int, default=200, help='账号（不同凭证）数量')
+    parser.add_argument('--max-pool-connections', type=int, default=8, help='连接池大小')
+    parser.add_argument('--max-clients', type=int, default=8, help='ClientCache 最多缓存的客户端数，0 表示不限制')
+    parser.add_argument('--mode', choices=['per_account', 'cache', 'both'], default='both', help='测量的方式')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """运行基准测试并输出JSON结果"""
+    args = parse_args(argv)
+    # 先创建一个客户端，使 botocore 的导入和数据文件加载不计入两种方式的比较
+    aws_cost_explorer.create_client('AKIAWARMUP', 'benchmark')
+
+    modes = ['per_account', 'cache'] if args.mode == 'both' else [args.mode]
+    results = [measure(mode, args.accounts, args.max_pool_connections, args.max_clients) for mode in modes]
+    print(json.dumps({'benchmark': 'clients', 'params': vars(args), 'results': results}, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""
+本地模拟的 Cost Explorer
+实现 AWSCostExplorer 使用的 GetCostAndUsage 接口（分页、按服务、关联账号、使用类型、区域或标签分组、按维度过滤、多指标），
+支持配置每次请求的延迟和服务端限流，用于在没有AWS账号的情况下测量流水线性能；
+同时模拟 STS AssumeRole（角色ARN中的账号ID映射为该账号的临时凭证）
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Tuple
+
+from botocore.exceptions import ClientError
+
+import aws_cost_explorer
+import aws_credentials
+from benchmarks.synthetic import SyntheticBilling
+
+# 各指标相对于 UnblendedCost 的比例
+METRIC_FACTORS = {
+    'UnblendedCost': 1.0,
+    'BlendedCost': 1.0,
+    'AmortizedCost': 0.97,
+    'NetUnblendedCost': 0.95,
+    'NetAmortizedCost': 0.92,
+    'NormalizedUsageAmount': 8.0,
+    'UsageQuantity': 10.0,
+}
+
+
+class FakeCostExplorer:
+    def __init__(self, billing: SyntheticBilling, latency: float = 0.0, max_rate: float = None, page_size: int = 500):
+        """
+        初始化模拟的 Cost Explorer 服务（所有客户端共享延迟、限流和计数）
+
+        Args:
+            billing: 合成账单数据
+            latency: 每次请求的模拟延迟（秒）
+            max_rate: 每秒允许的最大请求数，超出时返回 LimitExceededException，None表示不限流
+            page_size: 每页返回的最大分组数
+        """
+        self.billing = billing
+        self.latency = latency
+        self.max_rate = max_rate
+        self.page_size = page_size
+
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self.calls = 0
+        self.throttled = 0
+        self.groups_returned = 0
+        self.assume_role_calls = 0
+
+    def create_client(self, access_key_id: str = None, secret_access_key: str = None, region: str = 'us-east-1',
+                      session=None, max_pool_connections: int = 10,
+                      session_token: str = None) -> 'FakeCostExplorerClient':
+        """
+        替代 aws_cost_explorer.create_client：访问密钥ID为 BENCH<账号ID> 时只返回该账号的数据，否则视为付款账号
+        """
+        account = None
+        if access_key_id and access_key_id.startswith('BENCH'):
+            account = self.billing.account_index(access_key_id[len('BENCH'):])
+        return FakeCostExplorerClient(self, account)
+
+    def create_sts_client(self, region: str = 'us-east-1', session=None) -> 'FakeSTSClient':
+        """替代 aws_credentials.create_sts_client"""
+        return FakeSTSClient(self)
+
+    @contextmanager
+    def installed(self):
+        """在 with 块内让 AWSCostExplorer、ClientCache 和 CredentialCache 使用本模拟服务"""
+        original = aws_cost_explorer.create_client, aws_credentials.create_sts_client
+        aws_cost_explorer.create_client = self.create_client
+        aws_credentials.create_sts_client = self.create_sts_client
+        try:
+            yield self
+        finally:
+            aws_cost_explorer.create_client, aws_credentials.create_sts_client = original
+
+    def _admit(self):
+        """模拟延迟和服务端限流（滑动窗口，1秒内超过 max_rate 次请求时拒绝）"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            if self.max_rate is None:
+                return
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] >= 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.max_rate:
+                self.throttled += 1
+                raise ClientError(
+                    {
+                        'Error': {'Code': 'LimitExceededException', 'Message': 'Rate exceeded'},
+                        'ResponseMetadata': {'HTTPStatusCode': 400}
+                    },
+                    'GetCostAndUsage'
+                )
+            self._recent.append(now)
+
+    def stats(self) -> Dict[str, int]:
+        """返回请求计数"""
+        with self._lock:
+            stats = {'calls': self.calls, 'throttled': self.throttled, 'groups_returned': self.groups_returned}
+            if self.assume_role_calls:
+                stats['assume_role_calls'] = self.assume_role_calls
+            return stats
+
+
+class FakeSTSClient:
+    def __init__(self, service: FakeCostExplorer):
+        """
+        模拟的 STS 客户端（与 Cost Explorer 共享请求延迟，不计入 Cost Explorer 的请求数和限流）
+
+        Args:
+            service: 共享的模拟服务
+        """
+        self.service = service
+
+    def assume_role(self, RoleArn: str, RoleSessionName: str, DurationSeconds: int = 3600, **kwargs) -> dict:
+        """返回访问密钥ID为 BENCH<角色ARN中的账号ID> 的临时凭证"""
+        if self.service.latency:
+            time.sleep(self.service.latency)
+        with self.service._lock:
+            self.service.assume_role_calls += 1
+        account_id = RoleArn.split(':')[4]
+        return {
+            'Credentials': {
+                'AccessKeyId': f"BENCH{account_id}",
+                'SecretAccessKey': 'benchmark',
+                'SessionToken': f"benchmark-{RoleSessionName}",
+                'Expiration': datetime.now(timezone.utc) + timedelta(seconds=DurationSeconds),
+            }
+        }
+
+
+class FakeCostExplorerClient:
+    def __init__(self, service: FakeCostExplorer, account: int = None):
+        """
+        单个账号（或付款账号）的模拟客户端
+
+        Args:
+            service: 共享的模拟服务
+            account: 账号索引，None表示付款账号（可以按 LINKED_ACCOUNT 分组查询所有账号）
+        """
+        self.service = service
+        self.account = account
+
+    @staticmethod
+    def _periods(start: datetime, end: datetime, granularity: str) -> List[Tuple[datetime, datetime]]:
+        """拆分为日或月周期"""
+        periods = []
+        current = start
+        while current < end:
+            if granularity == 'MONTHLY':
+                next_start = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
+            else:
+                next_start = current + timedelta(days=1)
+            periods.append((current, min(next_start, end)))
+            current = next_start
+        return periods
+
+    @staticmethod
+    def _parse_filter(expression: dict = None) -> Dict[str, set]:
+        """解析 Filter 表达式（只支持 Dimensions 和 And），返回 {维度: 值集合}"""
+        if not expression:
+            return {}
+        if 'And' in expression:
+            filters = {}
+            for child in expression['And']:
+                filters.update(FakeCostExplorerClient._parse_filter(child))
+            return filters
+        dimension = expression['Dimensions']
+        return {dimension['Key']: set(dimension['Values'])}
+
+    def _iter_groups(self, start: datetime, end: datetime, granularity: str, group_keys: List[str],
+                     filters: Dict[str, set] = None) -> Iterator[Tuple[str, List[str], float]]:
+        """按周期顺序生成 (周期开始日期, 分组键, 金额)"""
+        billing = self.service.billing
+        if group_keys[0] == 'LINKED_ACCOUNT':
+            accounts = range(billing.account_count) if self.account is None else [self.account]
+        else:
+            accounts = [0 if self.account is None else self.account]
+        if filters or not set(group_keys) <= {'LINKED_ACCOUNT', 'SERVICE'}:
+            yield from self._iter_breakdown_groups(start, end, granularity, group_keys, filters or {}, accounts)
+            return
+
+        for period_start, period_end in self._periods(start, end, granularity):
+            period = period_start.strftime('%Y-%m-%d')
+            for account in accounts:
+                if granularity == 'MONTHLY':
+                    costs = billing.period_costs(account, period_start, period_end)
+                else:
+                    costs = billing.daily_costs(account, period)
+                for service, amount in costs.items():
+                    if group_keys[0] == 'LINKED_ACCOUNT':
+                        yield period, [billing.account_ids[account], service], amount
+                    else:
+                        yield period, [service], amount
+
+    def _iter_breakdown_groups(self, start: datetime, end: datetime, granularity: str, group_keys: List[str],
+                               filters: Dict[str, set], accounts) -> Iterator[Tuple[str, List[str], float]]:
+        """
+        按使用类型、区域、标签等维度分组或带过滤条件的查询：逐天拆分服务成本，同一周期内分组键相同的金额合并
+        """
+        billing = self.service.billing
+        if 'LINKED_ACCOUNT' in filters:
+            accounts = [account for account in accounts if billing.account_ids[account] in filters['LINKED_ACCOUNT']]
+        dimensions = [key for key in group_keys if key not in ('LINKED_ACCOUNT', 'SERVICE')]
+
+        for period_start, period_end in self._periods(start, end, granularity):
+            totals: Dict[tuple, float] = {}
+            for account in accounts:
+                day = period_start
+                while day < period_end:
+                    date = day.strftime('%Y-%m-%d')
+                    for service, amount in billing.daily_costs(account, date).items():
+                        if 'SERVICE' in filters and service not in filters['SERVICE']:
+                            continue
+                        parts = [((), amount)]
+                        for dimension in dimensions:
+                            parts = [
+                                (labels + (name,), share)
+                                for labels, part in parts
+                                for name, share in billing.breakdown(account, date, service, part, dimension).items()
+                            ]
+                        for labels, part in parts:
+                            values = {'LINKED_ACCOUNT': billing.account_ids[account], 'SERVICE': service}
+                            values.update(zip(dimensions, labels))
+                            key = tuple(values[group_key] for group_key in group_keys)
+                            totals[key] = totals.get(key, 0.0) + part
+                    day += timedelta(days=1)
+            period = period_start.strftime('%Y-%m-%d')
+            for key, amount in totals.items():
+                yield period, list(key), amount
+
+    def _totals_response(self, start: datetime, end: datetime, granularity: str, metrics: List[str],
+                         by_account: bool, filters: Dict[str, set] = None) -> dict:
+        """不按服务分组的请求：每个周期返回总计（Total）或每个关联账号的总计，不分页"""
+        group_keys = ['LINKED_ACCOUNT', 'SERVICE'] if by_account else ['SERVICE']
+        totals: Dict[str, Dict[tuple, float]] = {}
+        for period, keys, amount in self._iter_groups(start, end, granularity, group_keys, filters):
+            period_totals = totals.setdefault(period, {})
+            prefix = tuple(keys[:-1])
+            period_totals[prefix] = period_totals.get(prefix, 0.0) + amount
+
+        def amounts(amount: float) -> dict:
+            return {
+                metric: {'Amount': f"{amount * METRIC_FACTORS.get(metric, 1.0):.10f}", 'Unit': 'USD'}
+                for metric in metrics
+            }
+
+        results = []
+        for period, period_totals in totals.items():
+            result = {'TimePeriod': {'Start': period}}
+            if by_account:
+                result['Groups'] = [
+                    {'Keys': list(prefix), 'Metrics': amounts(amount)} for prefix, amount in period_totals.items()
+                ]
+            else:
+                result['Total'] = amounts(period_totals.get((), 0.0))
+            results.append(result)
+        return {'ResultsByTime': results}
+
+    def get_cost_and_usage(self, TimePeriod: dict, Granularity: str, Metrics: List[str],
+                           GroupBy: List[dict] = None, NextPageToken: str = None, Filter: dict = None,
+                           **kwargs) -> dict:
+        """模拟 GetCostAndUsage（参数和响应结构与 boto3 一致）"""
+        self.service._admit()
+
+        start = datetime.strptime(TimePeriod['Start'], '%Y-%m-%d')
+        end = datetime.strptime(TimePeriod['End'], '%Y-%m-%d')
+        # 标签分组的 Key 为标签键，与维度分组一样用 "TAG:<标签键>" 表示
+        group_keys = [
+            f"TAG:{group['Key']}" if group['Type'] == 'TAG' else group['Key'] for group in GroupBy or []
+        ]
+        filters = self._parse_filter(Filter)
+        if group_keys in ([], ['LINKED_ACCOUNT']):
+            return self._totals_response(start, end, Granularity, Metrics, bool(group_keys), filters)
+        offset = int(NextPageToken or 0)
+        page_size = self.service.page_size
+
+        results = []
+        by_period = {}
+        count = 0
+        has_more = False
+        groups = self._iter_groups(start, end, Granularity, group_keys, filters)
+        for index, (period, keys, amount) in enumerate(groups):
+            if index < offset:
+                continue
+            if count == page_size:
+                has_more = True
+                break
+            result = by_period.get(period)
+            if result is None:
+                result = by_period[period] = {'TimePeriod': {'Start': period}, 'Groups': []}
+                results.append(result)
+            result['Groups'].append({
+                'Keys': keys,
+                'Metrics': {
+                    metric: {'Amount': f"{amount * METRIC_FACTORS.get(metric, 1.0):.10f}", 'Unit': 'USD'}
+                    for metric in Metrics
+                }
+            })
+            count += 1
+
+        with self.service._lock:
+            self.service.groups_returned += count
+
+        response = {'ResultsByTime': results}
+        if group_keys[0] == 'LINKED_ACCOUNT':
+            billing = self.service.billing
+            response['DimensionValueAttributes'] = [
+                {'Value': account_id, 'Attributes': {'description': name}}
+                for account_id, name in zip(billing.account_ids, billing.account_names)
+            ]
+        if has_more:
+            response['NextPageToken'] = str(offset + count)
+        return response
@@ -0,0 +1,410 @@
+"""
+端到端流水线基准测试
+按 main.main() 的顺序执行 配置加载 → 获取数据 → 汇总 → 生成HTML报告 → 构建邮件 → 发送，
+测量每个阶段的耗时、内存峰值和输出大小，结果以JSON输出，便于比较不同版本
+
+运行方式（在项目根目录）:
+    python -m benchmarks.run_pipeline --accounts 50 --services 120 --days 60 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import numpy as np
+
+import config
+from aws_cost_explorer import ClientCache
+from aws_credentials import CredentialCache
+from benchmarks.fake_cost_explorer import FakeCostExplorer
+from benchmarks.smtp_sink import SMTPSink
+from benchmarks.synthetic import SyntheticBilling
+from cost_anomalies import AnomalyDetector
+from cost_export import export_rows, iter_export_rows
+from cost_forecast import ForecastModel
+from cost_matrix import CostMatrix
+from cost_rollup import RollupTree
+from cost_trends import CostTrends
+from email_sender import EmailSender
+from main import fetch_account_data, fetch_accounts_concurrently, fetch_consolidated_account_details
+from rate_limiter import AdaptiveRateLimiter
+from report_generator import ReportGenerator, ReportSizeBudget
+
+
+class StageRecorder:
+    def __init__(self, trace_memory: bool = True):
+        """
+        记录每个阶段的耗时、内存峰值和输出
+
+        Args:
+            trace_memory: 是否使用 tracemalloc 统计内存峰值（会增加被测代码的耗时）
+        """
+        self.trace_memory = trace_memory
+        self.stages: List[dict] = []
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        测量一个阶段，with 块中向返回的字典写入该阶段的输出统计
+        """
+        output = {}
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        yield output
+        wall_seconds = time.perf_counter() - start
+        record = {'name': name, 'wall_seconds': round(wall_seconds, 6)}
+        if self.trace_memory:
+            record['peak_memory_bytes'] = max(0, tracemalloc.get_traced_memory()[1] - baseline)
+        record['output'] = output
+        self.stages.append(record)
+
+
+def report_dates(billing: SyntheticBilling, is_monthly: bool):
+    """与 main.main() 相同的日期计算，以合成数据的结束日期作为"今天" """
+    today = billing.end_date
+    if is_monthly:
+        last_month = (today.replace(day=1) - timedelta(days=1)).replace(day=1)
+        previous_month = (last_month - timedelta(days=1)).replace(day=1)
+        return last_month, previous_month
+    return today - timedelta(days=4), today - timedelta(days=5)
+
+
+def day_matrix(billing: SyntheticBilling, account_names: List[str], date: datetime) -> CostMatrix:
+    """合成数据中某一天 账号 × 服务 的成本矩阵（作为异常检测的输入）"""
+    day = date.strftime('%Y-%m-%d')
+    service_index = {service: column for column, service in enumerate(billing.service_names)}
+    account_index = {name: index for index, name in enumerate(billing.account_names)}
+    current = np.zeros((len(account_names), len(service_index)))
+    for row, name in enumerate(account_names):
+        for service, amount in billing.daily_costs(account_index[name], day).items():
+            current[row, service_index[service]] = amount
+    present = current != 0
+    return CostMatrix(account_names, billing.service_names, current, current, present, present)
+
+
+def run_once(args, billing: SyntheticBilling, sink: SMTPSink) -> Dict[str, object]:
+    """
+    执行一次完整的流水线并返回每个阶段的测量结果
+    """
+    recorder = StageRecorder(trace_memory=not args.no_tracemalloc)
+    is_monthly = args.report_type == 'monthly'
+    yesterday, day_before = report_dates(billing, is_monthly)
+    metrics = args.metrics.split(',')
+    extra_metrics = metrics[1:]
+    fake = FakeCostExplorer(billing, latency=args.latency, max_rate=args.throttle_rate, page_size=args.page_size)
+    rate_limiter = AdaptiveRateLimiter(args.ce_rate, min(args.ce_rate, 0.5))
+    # 每次运行使用新的临时凭证缓存（只在内存中），--assume-role 时每个账号调用一次模拟的 AssumeRole
+    client_cache = ClientCache(args.workers, credential_cache=CredentialCache())
+    os.environ['AWS_ACCOUNTS'] = json.dumps(billing.accounts_config(assume_role=args.assume_role))
+
+    with recorder.stage('config_load') as output:
+        aws_accounts = config.get_aws_accounts()
+        config.get_report_routes()
+        config.get_email_recipients(args.report_type)
+        output['accounts'] = len(aws_accounts)
+        output['config_bytes'] = len(os.environ['AWS_ACCOUNTS'])
+
+    with fake.installed(), recorder.stage('fetch') as output:
+        if args.consolidated:
+            account_details = fetch_consolidated_account_details(
+                [{'account_name': 'bench-payer', 'payer': True}], is_monthly, yesterday, day_before,
+                metrics=metrics, rate_limiter=rate_limiter, client_cache=client_cache
+            )
+        else:
+            results = fetch_accounts_concurrently(
+                aws_accounts,
+                lambda idx, account, deadline: fetch_account_data(
+                    idx, account, len(aws_accounts), is_monthly, yesterday, day_before,
+                    metrics=metrics, rate_limiter=rate_limiter, client_cache=client_cache, deadline=deadline
+                ),
+                max_workers=args.workers
+            )
+            account_details = [acc_detail for acc_detail in results if acc_detail is not None]
+        output['accounts_fetched'] = len(account_details)
+        output.update(fake.stats())
+        output['retries'] = rate_limiter.stats()['retries']
+        output['clients'] = len(client_cache)
+
+    with recorder.stage('aggregate') as output:
+        cost_matrix = CostMatrix.from_account_details(account_details, extra_metrics)
+        all_yesterday_costs, all_day_before_costs = cost_matrix.service_cost_dicts()
+        output['matrix_shape'] = list(cost_matrix.current.shape)
+        output['matrix_bytes'] = int(cost_matrix.current.nbytes + cost_matrix.previous.nbytes)
+
+    # 数据导出：所有格式在一次遍历中逐行写入临时目录
+    export_paths = []
+    if args.export_formats:
+        export_base = os.path.join(tempfile.gettempdir(), f"bench_export.{os.getpid()}")
+        with recorder.stage('export') as output:
+            export_paths, count = export_rows(
+                iter_export_rows(account_details, yesterday, day_before, is_monthly, metrics[0]),
+                export_base, args.export_formats.split(','), compress=not args.export_uncompressed
+            )
+            output['rows'] = count
+            output['file_bytes'] = {os.path.basename(path): os.path.getsize(path) for path in export_paths}
+
+    # 趋势使用合成数据中截至报告日期的日数据（相当于本地缓存中的历史数据）
+    trends = None
+    if args.trend_days:
+        with recorder.stage('trends') as output:
+            end_date = yesterday
+            if is_monthly:
+                end_date = (yesterday.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+            dates = [end_date - timedelta(days=offset) for offset in range(args.trend_days - 1, -1, -1)]
+            days = [date.strftime('%Y-%m-%d') for date in dates if billing.start_date <= date < billing.end_date]
+            account_index = {name: index for index, name in enumerate(billing.account_names)}
+            accounts = [(row, account_index[name]) for row, name in enumerate(cost_matrix.account_names)]
+            trends = CostTrends.from_entries(
+                dates,
+                cost_matrix.account_names,
+                [(row, day) for row, _ in accounts for day in days],
+                [
+                    (row, day, service, amount)
+                    for row, account in accounts for day in days
+                    for service, amount in billing.daily_costs(account, day).items()
+                ]
+            )
+            output['series'] = int(trends.daily.shape[0] * trends.daily.shape[1])
+            output['days'] = len(days)
+
+    # 异常检测：先用报告日期之前的日数据积累状态（不计入测量），再测量报告日期的一次增量更新和状态的保存/加载
+    anomalies = None
+    if args.anomaly_history and not is_monthly:
+        detector = AnomalyDetector()
+        for offset in range(args.anomaly_history, 0, -1):
+            date = yesterday - timedelta(days=offset)
+            detector.observe(date, day_matrix(billing, cost_matrix.account_names, date))
+        state_path = os.path.join(tempfile.gettempdir(), f"bench_anomaly_state.{os.getpid()}.npz")
+        with recorder.stage('anomalies') as output:
+            anomalies = detector.observe(yesterday, cost_matrix)
+            detector.save(state_path)
+            AnomalyDetector(state_path)
+            output['series'] = len(detector)
+            output['anomalies'] = len(anomalies)
+            output['state_bytes'] = os.path.getsize(state_path)
+        os.remove(state_path)
+
+    # 月末预测：先累加本月报告日期之前的日数据（不计入测量），再测量报告日期的一次增量更新、预测和状态的保存/加载
+    forecast = None
+    if not args.no_forecast and not is_monthly:
+        model = ForecastModel()
+        date = yesterday.replace(day=1)
+        while date < yesterday:
+            model.observe(date, day_matrix(billing, cost_matrix.account_names, date))
+            date += timedelta(days=1)
+        state_path = os.path.join(tempfile.gettempdir(), f"bench_forecast_state.{os.getpid()}.npz")
+        with recorder.stage('forecast') as output:
+            model.observe(yesterday, cost_matrix)
+            forecast = model.project(yesterday, cost_matrix.account_names)
+            model.save(state_path)
+            ForecastModel(state_path)
+            output['series'] = len(model)
+            output['days'] = yesterday.day
+            output['projected_total'] = round(forecast.total()[1], 2)
+            output['state_bytes'] = os.path.getsize(state_path)
+        os.remove(state_path)
+
+    # 服务下钻：每个账号的每个服务按合成数据拆分为 --drilldown-groups 个使用类型（拆分结果预先生成，不计入测量），
+    # 测量汇总树的构建、合并和每个服务的前K项选择，下钻行随后计入 render 阶段
+    if args.drilldown_groups and not is_monthly:
+        account_index = {name: index for index, name in enumerate(billing.account_names)}
+        groups = []
+        for acc_name in cost_matrix.account_names:
+            account = account_index[acc_name]
+            rows = []
+            for date, newer in ((yesterday, True), (day_before, False)):
+                day = date.strftime('%Y-%m-%d')
+                for service, amount in billing.daily_costs(account, day).items():
+                    for name, part in billing.breakdown(account, day, service, amount, 'USAGE_TYPE').items():
+                        rows.append(((service, name), part if newer else 0.0, 0.0 if newer else part))
+            groups.append(rows)
+        with recorder.stage('drilldown') as output:
+            leaves = 0
+            for acc_detail, rows in zip(account_details, groups):
+                tree = RollupTree(['SERVICE', 'USAGE_TYPE'])
+                for path, current, previous in rows:
+                    tree.add(path, current, previous)
+                for _, _, _, node in tree.top_children(k=0)[0]:
+                    tree.top_children(node, args.drilldown_top_k)
+                leaves += len(tree)
+                acc_detail['drilldown'] = tree
+            output['leaves'] = leaves
+        del groups
+
+    size_budget = None
+    if args.top_n or args.max_bytes:
+        size_budget = ReportSizeBudget(top_n=args.top_n or None, max_bytes=args.max_bytes or None)
+
+    with recorder.stage('render') as output:
+        html_report = ReportGenerator.generate_html_report(
+            yesterday_costs=all_yesterday_costs,
+            day_before_costs=all_day_before_costs,
+            yesterday_total=cost_matrix.current_total,
+            day_before_total=cost_matrix.previous_total,
+            yesterday_date=yesterday,
+            day_before_date=day_before,
+            account_details=account_details,
+            is_monthly=is_monthly,
+            cost_matrix=cost_matrix,
+            size_budget=size_budget,
+            extra_metrics=extra_metrics,
+            trends=trends,
+            anomalies=anomalies,
+            forecast=forecast,
+            drilldown_top_k=args.drilldown_top_k
+        )
+        output['html_bytes'] = len(html_report.encode('utf-8'))
+
+    message = {
+        'from_addr': 'bench@localhost',
+        'to_addrs': ['finance@localhost'],
+        'subject': 'AWS每日账单报告 - benchmark',
+        'html_content': html_report,
+        'from_name': '运维平台',
+        'attachments': export_paths if args.export_attach else None,
+    }
+
+    with recorder.stage('mime_build') as output:
+        msg, recipients = EmailSender.build_message(**message)
+        output['message_bytes'] = len(msg.as_string())
+
+    email_sender = EmailSender(sink.host, sink.port, 'bench', 'bench', use_ssl=False, starttls=False)
+    before = sink.stats()
+    with recorder.stage('send') as output:
+        results = email_sender.send_batch([message] * args.messages)
+        after = sink.stats()
+        output['messages'] = args.messages
+        output['delivered'] = sum(1 for result in results if result.delivered)
+        output['bytes_sent'] = after['bytes_received'] - before['bytes_received']
+        output['logins'] = after['logins'] - before['logins']
+    for path in export_paths:
+        os.remove(path)
+
+    return {
+        'stages': recorder.stages,
+        'total_seconds': round(sum(stage['wall_seconds'] for stage in recorder.stages), 6),
+        'rate_limiter': rate_limiter.stats(),
+    }
+
+
+def summarize(runs: List[dict]) -> Dict[str, dict]:
+    """
+    汇总多次运行：每个阶段的最小/中位耗时和最大内存峰值，输出统计取最后一次运行
+    """
+    summary = {}
+    for name in [stage['name'] for stage in runs[0]['stages']]:
+        stages = [stage for run in runs for stage in run['stages'] if stage['name'] == name]
+        walls = [stage['wall_seconds'] for stage in stages]
+        entry = {
+            'wall_seconds_min': min(walls),
+            'wall_seconds_median': round(statistics.median(walls), 6),
+        }
+        if 'peak_memory_bytes' in stages[-1]:
+            entry['peak_memory_bytes_max'] = max(stage['peak_memory_bytes'] for stage in stages)
+        entry['output'] = stages[-1]['output']
+        summary[name] = entry
+    totals = [run['total_seconds'] for run in runs]
+    summary['total'] = {'wall_seconds_min': min(totals), 'wall_seconds_median': round(statistics.median(totals), 6)}
+    return summary
+
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='AWS账单报告流水线基准测试（合成数据，本地模拟 Cost Explorer 和 SMTP）')
+    parser.add_argument('--accounts', type=int, default=20, help='账号数量')
+    parser.add_argument('--services', type=int, default=80, help='服务数量')
+    parser.add_argument('--days', type=int, default=60, help='合成数据覆盖的天数')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子')
+    parser.add_argument('--report-type', choices=['daily', 'monthly'], default='daily', help='报表类型')
+    parser.add_argument('--consolidated', action='store_true', help='使用整合账单模式（付款账号一次查询）')
+    parser.add_argument('--metrics', default='UnblendedCost', help='逗号分隔的指标列表，第一个为主指标')
+    parser.add_argument('--assume-role', action='store_true',
+                        help='账号使用 role_arn 配置，获取数据时先通过模拟的 STS 扮演角色（共享 --latency）')
+    parser.add_argument('--workers', type=int, default=8, help='并发获取的线程数')
+    parser.add_argument('--latency', type=float, default=0.0, help='模拟的每次API请求延迟（秒）')
+    parser.add_argument('--throttle-rate', type=float, default=None, help='模拟的服务端限流（次/秒），默认不限流')
+    parser.add_argument('--ce-rate', type=float, default=1000.0, help='客户端限流器的最大速率（次/秒）')
+    parser.add_argument('--page-size', type=int, default=500, help='模拟API每页返回的分组数')
+    parser.add_argument('--top-n', type=int, default=0, help='报告大小预算：每个账号显示的服务数，0表示不限制')
+    parser.add_argument('--max-bytes', type=int, default=0, help='报告大小预算：HTML最大字节数，0表示不限制')
+    parser.add_argument('--trend-days', type=int, default=30, help='趋势章节的天数，0表示不生成趋势')
+    parser.add_argument('--anomaly-history', type=int, default=14,
+                        help='异常检测在报告日期之前积累的天数（仅日报表），0表示不检测')
+    parser.add_argument('--no-forecast', action='store_true', help='不生成月末预测（仅日报表）')
+    parser.add_argument('--drilldown-groups', type=int, default=0,
+                        help='服务下钻：每个服务拆分的使用类型数（仅日报表），0表示不下钻')
+    parser.add_argument('--drilldown-top-k', type=int, default=5, help='服务下钻：每一级显示的子项数')
+    parser.add_argument('--export-formats', default='',
+                        help='数据导出：逗号分隔的格式（jsonl、csv、columnar），为空时不导出')
+    parser.add_argument('--export-uncompressed', action='store_true', help='数据导出：jsonl 和 csv 不使用 gzip 压缩')
+    parser.add_argument('--export-attach', action='store_true', help='数据导出：导出文件作为邮件附件')
+    parser.add_argument('--messages', type=int, default=1, help='发送阶段通过同一个连接发送的邮件数')
+    parser.add_argument('--repeat', type=int, default=3, help='重复运行次数')
+    parser.add_argument('--no-tracemalloc', action='store_true', help='不统计内存峰值（耗时更准确）')
+    parser.add_argument('--output', help='结果JSON文件路径，默认输出到标准输出')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """运行基准测试并输出JSON结果"""
+    args = parse_args(argv)
+    if args.days < 62 and args.report_type == 'monthly':
+        print("警告: 月报表需要覆盖前两个完整月份，建议 --days 至少为 62", file=sys.stderr)
+
+    billing = SyntheticBilling(
+        args.accounts, args.services, args.days, seed=args.seed, breakdown_groups=args.drilldown_groups or 8
+    )
+    billing.warm(billing.start_date, billing.end_date)
+
+    if not args.no_tracemalloc:
+        tracemalloc.start()
+
+    # 流水线各阶段的日志输出到标准错误，标准输出只保留JSON结果
+    stdout = sys.stdout
+    runs = []
+    with SMTPSink() as sink:
+        sys.stdout = sys.stderr
+        try:
+            for _ in range(args.repeat):
+                runs.append(run_once(args, billing, sink))
+        finally:
+            sys.stdout = stdout
+
+    if not args.no_tracemalloc:
+        tracemalloc.stop()
+
+    result = {
+        'benchmark': 'pipeline',
+        'timestamp': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'params': {key: value for key, value in vars(args).items() if key != 'output'},
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count(),
+        },
+        'summary': summarize(runs),
+        'runs': runs,
+    }
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"基准测试结果已保存到: {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+本地 SMTP 接收服务器
+接受登录和邮件但不投递，只记录收到的邮件数量和字节数，用于测量邮件构建和发送阶段的性能
+"""
+import socketserver
+import threading
+from typing import Dict
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """处理一个SMTP连接（只实现 smtplib 发送邮件需要的命令）"""
+
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode('ascii'))
+
+    def handle(self):
+        sink = self.server.sink
+        with sink._lock:
+            sink.connections += 1
+        self.reply('220 localhost benchmark SMTP sink')
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', errors='replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+
+            if verb == 'EHLO':
+                self.wfile.write(b'250-localhost\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n')
+            elif verb == 'HELO':
+                self.reply('250 localhost')
+            elif verb == 'AUTH':
+                parts = command.split()
+                if parts[1].upper() == 'LOGIN':
+                    # AUTH LOGIN：依次读取用户名和密码（smtplib 可能在命令中直接带上用户名）
+                    if len(parts) < 3:
+                        self.reply('334 VXNlcm5hbWU6')
+                        self.rfile.readline()
+                    self.reply('334 UGFzc3dvcmQ6')
+                    self.rfile.readline()
+                with sink._lock:
+                    sink.logins += 1
+                self.reply('235 2.7.0 Authentication successful')
+            elif verb in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                size = 0
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data == b'.\r\n':
+                        break
+                    size += len(data)
+                with sink._lock:
+                    sink.messages += 1
+                    sink.bytes_received += size
+                self.reply('250 OK: queued')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPSink:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        """
+        初始化本地SMTP接收服务器（port为0时自动选择空闲端口）
+
+        通常以上下文管理器的方式使用，with 块结束时关闭服务器。
+        """
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.logins = 0
+        self.messages = 0
+        self.bytes_received = 0
+
+        self._server = _ThreadingServer((host, port), _SMTPHandler)
+        self._server.sink = self
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='smtp-sink', daemon=True)
+
+    def __enter__(self) -> 'SMTPSink':
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> Dict[str, int]:
+        """返回接收统计"""
+        with self._lock:
+            return {
+                'connections': self.connections,
+                'logins': self.logins,
+                'messages': self.messages,
+                'bytes_received': self.bytes_received,
+            }
@@ -0,0 +1,128 @@
+"""
+启动耗时基准测试
+在子进程中多次运行轻量命令（validate-config、--help 等），测量总耗时和扣除解释器启动后的耗时，
+并用 python -X importtime 统计每个命令导入最慢的模块，便于发现启动耗时的回退
+
+运行方式（在项目根目录）:
+    python -m benchmarks.startup --repeat 10 --output startup.json
+    python -m benchmarks.startup --budget-ms 100    # 超出预算时退出码为1（可用于CI）
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List
+
+# 被测命令：名称 -> python 参数，light 表示应在预算内完成的轻量命令
+COMMANDS = {
+    'interpreter': {'args': ['-c', 'pass'], 'light': False},
+    'import_main': {'args': ['-c', 'import main'], 'light': True},
+    'help': {'args': ['main.py', '--help'], 'light': True},
+    'validate_config': {'args': ['main.py', 'validate-config'], 'light': True},
+    'import_fetch_path': {'args': ['-c', 'import aws_cost_explorer'], 'light': False},
+    'import_render_path': {'args': ['-c', 'import report_generator'], 'light': False},
+    'import_send_path': {'args': ['-c', 'import email_sender'], 'light': False},
+}
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_command(args: List[str], repeat: int) -> List[float]:
+    """在子进程中运行命令 repeat 次，返回每次的耗时（毫秒）"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=PROJECT_ROOT, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=False)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def slowest_imports(args: List[str], top: int) -> List[dict]:
+    """
+    用 -X importtime 运行一次命令，返回累计导入耗时最长的顶层模块
+
+    Returns:
+        [{'module': 模块名, 'cumulative_ms': 累计耗时}]，按耗时降序
+    """
+    completed = subprocess.run([sys.executable, '-X', 'importtime'] + args, cwd=PROJECT_ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=False)
+    modules = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # 只统计顶层导入（模块名前只有一个空格），内部依赖的耗时已计入累计值
+        if not name.startswith(' ') or name.startswith('  ') or not cumulative.strip().isdigit():
+            continue
+        modules.append({'module': name.strip(), 'cumulative_ms': round(int(cumulative) / 1000, 3)})
+    modules.sort(key=lambda module: module['cumulative_ms'], reverse=True)
+    return modules[:top]
+
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='AWS账单报告启动耗时基准测试')
+    parser.add_argument('--repeat', type=int, default=10, help='每个命令的运行次数')
+    parser.add_argument('--top', type=int, default=8, help='每个命令列出的最慢导入模块数')
+    parser.add_argument('--budget-ms', type=float, default=0,
+                        help='轻量命令扣除解释器启动后的中位耗时预算（毫秒），超出时退出码为1，0表示不检查')
+    parser.add_argument('--output', help='结果JSON文件路径，默认输出到标准输出')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """运行启动耗时基准测试并输出JSON结果"""
+    args = parse_args(argv)
+
+    results: Dict[str, dict] = {}
+    for name, command in COMMANDS.items():
+        timings = time_command(command['args'], args.repeat)
+        results[name] = {
+            'command': ' '.join(['python'] + command['args']),
+            'light': command['light'],
+            'wall_ms_min': round(min(timings), 3),
+            'wall_ms_median': round(statistics.median(timings), 3),
+            'slowest_imports': slowest_imports(command['args'], args.top) if name != 'interpreter' else [],
+        }
+
+    baseline = results['interpreter']['wall_ms_median']
+    over_budget = []
+    for name, result in results.items():
+        result['overhead_ms_median'] = round(result['wall_ms_median'] - baseline, 3)
+        if args.budget_ms and result['light'] and result['overhead_ms_median'] > args.budget_ms:
+            over_budget.append(name)
+
+    result = {
+        'benchmark': 'startup',
+        'timestamp': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'params': {key: value for key, value in vars(args).items() if key != 'output'},
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'commands': results,
+        'over_budget': over_budget,
+    }
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"基准测试结果已保存到: {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if over_budget:
+        print(f"超出启动耗时预算 {args.budget_ms:g} 毫秒: {', '.join(over_budget)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
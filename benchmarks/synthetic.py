@@ -0,0 +1,180 @@
+"""
+合成账单数据生成器
+按 账号 × 服务 × 天 生成确定性的成本数据，同样的参数和种子总是生成同样的数据
+"""
+import random
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+# 常见的AWS服务名称，服务数超出时追加编号服务
+AWS_SERVICE_NAMES = [
+    'Amazon Elastic Compute Cloud - Compute', 'Amazon Simple Storage Service', 'Amazon Relational Database Service',
+    'Amazon CloudFront', 'AWS Lambda', 'Amazon DynamoDB', 'Amazon Elastic Load Balancing', 'Amazon CloudWatch',
+    'Amazon Virtual Private Cloud', 'Amazon ElastiCache', 'Amazon Elastic Container Service',
+    'Amazon Elastic Kubernetes Service', 'AWS Key Management Service', 'Amazon Route 53', 'Amazon Simple Queue Service',
+    'Amazon Simple Notification Service', 'AWS Glue', 'Amazon Athena', 'Amazon Redshift', 'Amazon OpenSearch Service',
+    'AWS Backup', 'Amazon Elastic File System', 'AWS Secrets Manager', 'Amazon API Gateway', 'AWS Config',
+    'AWS CloudTrail', 'Amazon Kinesis', 'Amazon SageMaker', 'AWS Step Functions', 'EC2 - Other', 'Tax',
+]
+
+# 下钻分组（使用类型、区域、标签）的名称
+AWS_REGIONS = [
+    'us-east-1', 'us-west-2', 'eu-west-1', 'eu-central-1', 'ap-northeast-1', 'ap-southeast-1', 'ap-east-1',
+    'us-east-2', 'ap-south-1', 'sa-east-1', 'ca-central-1', 'eu-north-1',
+]
+USAGE_TYPE_SUFFIXES = [
+    'BoxUsage:m5.large', 'BoxUsage:c5.xlarge', 'TimedStorage-ByteHrs', 'DataTransfer-Out-Bytes', 'Requests-Tier1',
+    'EBS:VolumeUsage.gp3', 'NatGateway-Hours', 'LoadBalancerUsage', 'InstanceUsage:db.r5.large', 'Lambda-GB-Second',
+]
+
+
+class SyntheticBilling:
+    def __init__(self, accounts: int, services: int, days: int, seed: int = 42,
+                 end_date: datetime = None, density: float = 0.6, breakdown_groups: int = 8):
+        """
+        初始化合成账单数据
+
+        Args:
+            accounts: 账号数量
+            services: 服务数量
+            days: 数据覆盖的天数（截止到 end_date，不包含 end_date）
+            seed: 随机种子
+            end_date: 数据结束日期（不包含），默认今天
+            density: 每个账号使用的服务比例（0~1）
+            breakdown_groups: 下钻时每个服务拆分的使用类型、区域或标签值的数量
+        """
+        self.account_count = accounts
+        self.service_count = services
+        self.days = days
+        self.seed = seed
+        self.density = density
+        self.breakdown_groups = breakdown_groups
+        now = end_date or datetime.utcnow()
+        self.end_date = datetime(now.year, now.month, now.day)
+        self.start_date = self.end_date - timedelta(days=days)
+
+        self.account_ids = [f"{100000000000 + index:012d}" for index in range(accounts)]
+        self.account_names = [f"bench-account-{index:04d}" for index in range(accounts)]
+        self.service_names = [
+            AWS_SERVICE_NAMES[index] if index < len(AWS_SERVICE_NAMES) else f"Synthetic Service {index:04d}"
+            for index in range(services)
+        ]
+
+        # 每个账号使用的服务和基础日成本（长尾分布：少数服务占大部分费用）
+        rng = random.Random(seed)
+        self._profiles = []
+        for _ in range(accounts):
+            used = max(1, int(services * density))
+            indexes = sorted(rng.sample(range(services), used))
+            self._profiles.append([(index, rng.paretovariate(1.2) * 5) for index in indexes])
+
+    def account_index(self, account_id: str) -> int:
+        """账号ID对应的索引"""
+        return int(account_id) - 100000000000
+
+    @lru_cache(maxsize=None)
+    def daily_costs(self, account: int, day: str) -> Dict[str, float]:
+        """
+        某个账号某一天按服务分组的成本
+
+        Args:
+            account: 账号索引
+            day: 日期（YYYY-MM-DD），超出数据范围时返回空字典
+
+        Returns:
+            {服务名: 成本}
+        """
+        date = datetime.strptime(day, '%Y-%m-%d')
+        if not self.start_date <= date < self.end_date:
+            return {}
+        rng = random.Random(f"{self.seed}:{account}:{day}")
+        costs = {}
+        for index, base in self._profiles[account]:
+            # 每天在基础成本上随机波动，偶尔为0
+            if rng.random() < 0.05:
+                continue
+            costs[self.service_names[index]] = round(base * rng.uniform(0.7, 1.3), 6)
+        return costs
+
+    @lru_cache(maxsize=None)
+    def _breakdown_weights(self, account: int, service: str, dimension: str) -> Tuple[List[str], List[float]]:
+        """某个账号某个服务按某个维度拆分的分组名称和基础权重（长尾分布）"""
+        rng = random.Random(f"{self.seed}:{account}:{service}:{dimension}")
+        count = self.breakdown_groups
+        if dimension == 'REGION':
+            names = [AWS_REGIONS[index % len(AWS_REGIONS)] + ('' if index < len(AWS_REGIONS) else f"-{index}")
+                     for index in range(count)]
+        elif dimension.startswith('TAG:'):
+            # 标签分组的键为 "<标签键>$<标签值>"，第一个为没有该标签的资源
+            tag_key = dimension[4:]
+            names = [f"{tag_key}$"] + [f"{tag_key}${tag_key.lower()}-{index:03d}" for index in range(1, count)]
+        else:
+            prefix = ''.join(word[0] for word in service.split() if word[0].isupper())
+            names = [f"{prefix}-{USAGE_TYPE_SUFFIXES[index % len(USAGE_TYPE_SUFFIXES)]}"
+                     + ('' if index < len(USAGE_TYPE_SUFFIXES) else f"-{index}") for index in range(count)]
+        return names, [rng.paretovariate(1.0) for _ in names]
+
+    def breakdown(self, account: int, day: str, service: str, amount: float, dimension: str) -> Dict[str, float]:
+        """
+        将某个账号某一天某个服务的成本按维度拆分（每天在基础权重上随机波动，合计等于原金额）
+
+        Args:
+            account: 账号索引
+            day: 日期（YYYY-MM-DD）
+            service: 服务名
+            amount: 该服务当天的成本
+            dimension: 'USAGE_TYPE'、'REGION' 或 'TAG:<标签键>'
+
+        Returns:
+            {分组名: 成本}
+        """
+        names, weights = self._breakdown_weights(account, service, dimension)
+        rng = random.Random(f"{self.seed}:{account}:{day}:{service}:{dimension}")
+        weights = [weight * rng.uniform(0.5, 1.5) for weight in weights]
+        total = sum(weights)
+        return {name: amount * weight / total for name, weight in zip(names, weights)}
+
+    def period_costs(self, account: int, start: datetime, end: datetime) -> Dict[str, float]:
+        """
+        某个账号一段时间内按服务汇总的成本
+
+        Args:
+            account: 账号索引
+            start: 开始日期（包含）
+            end: 结束日期（不包含）
+
+        Returns:
+            {服务名: 成本}
+        """
+        totals = {}
+        day = start
+        while day < end:
+            for service, amount in self.daily_costs(account, day.strftime('%Y-%m-%d')).items():
+                totals[service] = totals.get(service, 0.0) + amount
+            day += timedelta(days=1)
+        return totals
+
+    def warm(self, start: datetime, end: datetime):
+        """
+        预先生成一段时间内所有账号的数据，避免生成数据的耗时计入被测阶段
+        """
+        for account in range(self.account_count):
+            self.period_costs(account, max(start, self.start_date), min(end, self.end_date))
+
+    def accounts_config(self, assume_role: bool = False) -> List[dict]:
+        """
+        生成 AWS_ACCOUNTS 格式的账号配置（访问密钥ID用于本地模拟的 Cost Explorer 识别账号）
+
+        Args:
+            assume_role: 使用 role_arn 代替访问密钥（由本地模拟的 STS 换成该账号的临时凭证）
+        """
+        accounts = []
+        for account_id, name in zip(self.account_ids, self.account_names):
+            if assume_role:
+                account = {'role_arn': f"arn:aws:iam::{account_id}:role/BillingReport"}
+            else:
+                account = {'access_key_id': f"BENCH{account_id}", 'secret_access_key': 'benchmark'}
+            account.update({'region': 'us-east-1', 'account_name': name, 'account_id': account_id})
+            accounts.append(account)
+        return accounts
@@ -49,6 +49,7 @@ SMTP_SERVER = os.getenv('SMTP_SERVER', 'smtp.larksuite.com')
 SMTP_PORT = int(os.getenv('SMTP_PORT', '465'))
 SMTP_USERNAME = os.getenv('SMTP_USERNAME', 'sysplat@mail.com')
 SMTP_PASSWORD = os.getenv('SMTP_PASSWORD', '')
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'true').lower() in ('1', 'true', 'yes')  # 非465端口是否使用STARTTLS（内网中继可关闭）
 EMAIL_FROM = os.getenv('EMAIL_FROM', 'sysplat@mail.pro')
 EMAIL_FROM_NAME = os.getenv('EMAIL_FROM_NAME', '运维平台')  # 邮件发送人显示名称
 
@@ -103,6 +104,76 @@ def get_email_cc_recipients(report_type='daily'):
     
     return [email.strip() for email in cc_recipients.split(',') if email.strip()]
 
+# 报告路由配置：按收件组拆分报告，每个收件组只接收自己负责的账号
+# 可以通过环境变量 REPORT_ROUTES（JSON字符串）或 REPORT_ROUTES_FILE 指定，默认为 report_routes.json
+REPORT_ROUTES_FILE = os.getenv('REPORT_ROUTES_FILE', 'report_routes.json')
+
+def _split_addresses(value):
+    """将逗号分隔的字符串或列表转换为邮箱地址列表"""
+    if isinstance(value, str):
+        value = value.split(',')
+    return [email.strip() for email in value or [] if email and email.strip()]
+
+def get_report_routes():
+    """
+    获取报告路由列表
+    从环境变量 REPORT_ROUTES 或 report_routes.json 文件读取，未配置时返回空列表（所有收件人接收同一份完整报告）
+    
+    每个路由的格式:
+        {"name": "平台组", "accounts": ["prod-main", "prod-data"], "to": ["platform@mail.com"], "cc": [], "subject": "可选"}
+    accounts 为账号名称列表或逗号分隔的字符串，"*" 表示所有账号（例如财务需要的完整报告）；to/cc 也可以是逗号分隔的字符串
+    
+    Returns:
+        路由列表，to/cc 已转换为邮箱地址列表
+    """
+    routes = None
+    routes_env = os.getenv('REPORT_ROUTES', '')
+    if routes_env:
+        try:
+            routes = json.loads(routes_env)
+        except json.JSONDecodeError:
+            print("警告: REPORT_ROUTES 环境变量 JSON格式错误，尝试从文件读取")
+    
+    if routes is None and os.path.exists(REPORT_ROUTES_FILE):
+        try:
+            with open(REPORT_ROUTES_FILE, 'r', encoding='utf-8') as f:
+                routes = json.load(f)
+        except Exception as e:
+            print(f"警告: 读取 {REPORT_ROUTES_FILE} 文件时出错: {str(e)}")
+    
+    if not routes:
+        return []
+    if not isinstance(routes, list):
+        print("警告: 报告路由配置格式错误，应为路由列表，已忽略")
+        return []
+    
+    valid_routes = []
+    for idx, route in enumerate(routes, 1):
+        if not isinstance(route, dict):
+            print(f"警告: 报告路由第 {idx} 项格式错误，应为对象，已忽略")
+            continue
+        name = route.get('name', f'路由{idx}')
+        to_addrs = _split_addresses(route.get('to'))
+        if not to_addrs:
+            print(f"警告: 报告路由 {name} 未配置收件人（to），已忽略")
+            continue
+        accounts = route.get('accounts', '*')
+        if isinstance(accounts, str):
+            accounts = '*' if accounts.strip() == '*' else _split_addresses(accounts)
+        elif isinstance(accounts, list):
+            accounts = [str(account) for account in accounts]
+        else:
+            print(f"警告: 报告路由 {name} 的 accounts 格式错误，应为账号名称列表、逗号分隔的字符串或 \"*\"，已忽略")
+            continue
+        valid_routes.append({
+            'name': name,
+            'accounts': accounts,
+            'to': to_addrs,
+            'cc': _split_addresses(route.get('cc')),
+            'subject': route.get('subject')
+        })
+    return valid_routes
+
 # 报表类型配置
 # 可选值: 'daily' (日报表) 或 'monthly' (月报表)
 # 日报表: 获取前4天和前5天的账单数据
@@ -112,3 +183,159 @@ REPORT_TYPE = os.getenv('REPORT_TYPE', 'monthly')  # 默认为日报表
 
 # 邮件主题
 EMAIL_SUBJECT = 'AWS每日账单报告'
+
+# 并发获取配置
+# FETCH_MAX_WORKERS: 同时获取数据的账号数（线程池大小）
+# FETCH_ACCOUNT_TIMEOUT: 单个账号获取数据的超时时间（秒），0 表示不限制
+FETCH_MAX_WORKERS = int(os.getenv('FETCH_MAX_WORKERS', '8'))
+FETCH_ACCOUNT_TIMEOUT = float(os.getenv('FETCH_ACCOUNT_TIMEOUT', '120'))
+
+# 本地成本缓存配置
+# 已结算（结束日期早于 COST_CACHE_FINAL_LAG_DAYS 天前）的日/月数据会缓存到本地SQLite文件
+# 清除缓存: python cost_cache.py clear [--account 名称] [--granularity DAILY|MONTHLY] [--since YYYY-MM-DD]
+COST_CACHE_ENABLED = os.getenv('COST_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+COST_CACHE_PATH = os.getenv('COST_CACHE_PATH', 'cost_cache.db')
+COST_CACHE_FINAL_LAG_DAYS = int(os.getenv('COST_CACHE_FINAL_LAG_DAYS', '4'))
+
+# 月报表使用日数据的月累计
+# 日报表获取的已结算日数据写入缓存时会累加到所在月份的月累计，某个月份的每一天都已缓存时，
+# 月报表直接使用该月累计，不再为这个月调用 Cost Explorer API（需要启用本地缓存）
+MONTHLY_FROM_DAILY = os.getenv('MONTHLY_FROM_DAILY', 'true').lower() in ('1', 'true', 'yes')
+# 可选：用一次不按服务分组的API请求核对月累计的总计，
+# 差额超过 MONTHLY_RECONCILE_TOLERANCE（占API月总计的比例）时改为从API获取该月明细
+MONTHLY_RECONCILE = os.getenv('MONTHLY_RECONCILE', 'false').lower() in ('1', 'true', 'yes')
+MONTHLY_RECONCILE_TOLERANCE = float(os.getenv('MONTHLY_RECONCILE_TOLERANCE', '0.001'))
+
+# 整合账单模式（AWS Organizations）
+# 设置为 consolidated 时，只使用付款账号查询一次（按 LINKED_ACCOUNT 和 SERVICE 分组），
+# 再拆分为每个关联账号的明细，关联账号无需配置访问密钥。
+# 付款账号为 accounts.json 中 "payer": true 的账号（默认第一个账号；未配置账号时使用默认凭证链），
+# 其他账号可只配置 "account_id" 和 "account_name" 用于指定显示名称和顺序。
+BILLING_MODE = os.getenv('BILLING_MODE', 'per_account')
+
+# 报告输出文件（可选）
+# 设置后会将HTML报告逐段写入该文件，便于存档或在浏览器中预览
+REPORT_OUTPUT_PATH = os.getenv('REPORT_OUTPUT_PATH', '')
+
+# 报告大小预算（Gmail 会截断超过约102KB的HTML邮件）
+# REPORT_TOP_N: 每个账号只显示费用最高的前N个服务，0 表示全部显示
+# REPORT_COLLAPSE_TAIL: 超出前N个的服务是否合并为一行"其他 (k 个服务)"
+# REPORT_DROP_ZERO_ROWS: 是否去掉两个周期金额都为 $0.00 的服务行
+# REPORT_MAX_BYTES: HTML最大字节数，超出时省略放不下的异常、月末预测、趋势章节和后面账号的服务明细表格，0 表示不限制
+REPORT_TOP_N = int(os.getenv('REPORT_TOP_N', '0'))
+REPORT_COLLAPSE_TAIL = os.getenv('REPORT_COLLAPSE_TAIL', 'true').lower() in ('1', 'true', 'yes')
+REPORT_DROP_ZERO_ROWS = os.getenv('REPORT_DROP_ZERO_ROWS', 'false').lower() in ('1', 'true', 'yes')
+REPORT_MAX_BYTES = int(os.getenv('REPORT_MAX_BYTES', '0'))
+
+# 趋势章节（数据来自本地缓存的日数据，不额外调用API）
+# REPORT_TREND_DAYS: 显示截至报告日期（月报表为该月最后一天）近N天的走势图、7日平均和周环比，0 表示不显示
+# REPORT_TREND_SERVICES: 趋势章节中显示的费用最高的服务数
+REPORT_TREND_DAYS = int(os.getenv('REPORT_TREND_DAYS', '30'))
+REPORT_TREND_SERVICES = int(os.getenv('REPORT_TREND_SERVICES', '10'))
+
+# 成本异常检测（仅日报表）：为每个 账号-服务 序列维护EWMA均值和方差，状态保存在本地文件中
+# ANOMALY_DETECTION_ENABLED: 是否启用（默认关闭），启用后报告增加异常章节，并写入状态文件 ANOMALY_STATE_PATH
+#   （默认为工作目录下的 anomaly_state.npz，Docker中建议指向持久化卷）
+# ANOMALY_HALF_LIFE_DAYS: EWMA 的半衰期（天）
+# ANOMALY_Z_THRESHOLD: 偏离预期超过该倍数的标准差时视为异常
+# ANOMALY_MIN_AMOUNT: 偏离预期的金额（美元）至少为该值时才视为异常
+# ANOMALY_MIN_HISTORY: 序列至少积累该天数的历史后才参与检测
+# ANOMALY_MAX_ROWS: 报告中最多显示的异常数（按偏离金额排序），0 表示全部显示
+ANOMALY_DETECTION_ENABLED = os.getenv('ANOMALY_DETECTION_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+ANOMALY_STATE_PATH = os.getenv('ANOMALY_STATE_PATH', 'anomaly_state.npz')
+ANOMALY_HALF_LIFE_DAYS = float(os.getenv('ANOMALY_HALF_LIFE_DAYS', '14'))
+ANOMALY_Z_THRESHOLD = float(os.getenv('ANOMALY_Z_THRESHOLD', '3'))
+ANOMALY_MIN_AMOUNT = float(os.getenv('ANOMALY_MIN_AMOUNT', '10'))
+ANOMALY_MIN_HISTORY = int(os.getenv('ANOMALY_MIN_HISTORY', '7'))
+ANOMALY_MAX_ROWS = int(os.getenv('ANOMALY_MAX_ROWS', '20'))
+
+# 月末成本预测（仅日报表）：为每个账号和 账号-服务 序列累加本月日成本的线性回归状态，状态保存在本地文件中
+# FORECAST_ENABLED: 是否启用（默认关闭），启用后报告增加预测章节，并写入状态文件 FORECAST_STATE_PATH
+#   （默认为工作目录下的 forecast_state.npz，Docker中建议指向持久化卷）
+# FORECAST_TREND_DAYS: 本月统计天数达到该值后按线性趋势外推，之前按日均成本外推
+# FORECAST_CONFIDENCE: 置信区间的置信水平（0~1）
+# FORECAST_SERVICES: 预测章节中显示的预测费用最高的服务数
+FORECAST_ENABLED = os.getenv('FORECAST_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+FORECAST_STATE_PATH = os.getenv('FORECAST_STATE_PATH', 'forecast_state.npz')
+FORECAST_TREND_DAYS = int(os.getenv('FORECAST_TREND_DAYS', '7'))
+FORECAST_CONFIDENCE = float(os.getenv('FORECAST_CONFIDENCE', '0.9'))
+FORECAST_SERVICES = int(os.getenv('FORECAST_SERVICES', '10'))
+
+# 服务下钻（每个账号额外调用API）：在服务明细中展开变化最大的服务，按下一级分组找出变化来源
+# REPORT_DRILLDOWN: 服务之下的分组（逗号分隔，最多2级），可选 USAGE_TYPE、REGION、TAG:<成本分配标签键>，
+#   例如 USAGE_TYPE 或 REGION,TAG:Team；为空时不下钻。整合账单模式下只使用第一级
+# REPORT_DRILLDOWN_SERVICES: 每个账号展开的服务数（按金额变化的绝对值从大到小）
+# REPORT_DRILLDOWN_TOP_K: 每一级只显示金额变化最大的前K项，其余合并为一行，0 表示全部显示
+REPORT_DRILLDOWN = [level.strip() for level in os.getenv('REPORT_DRILLDOWN', '').split(',') if level.strip()]
+REPORT_DRILLDOWN_SERVICES = int(os.getenv('REPORT_DRILLDOWN_SERVICES', '3'))
+REPORT_DRILLDOWN_TOP_K = int(os.getenv('REPORT_DRILLDOWN_TOP_K', '5'))
+
+# 数据导出（与邮件使用同一份数据，每行一个 账号 × 服务 × 周期 × 指标，供数据仓库加载）
+# EXPORT_FORMATS: 导出格式（逗号分隔），可选 jsonl、csv、columnar（安装了 pyarrow 时为 Parquet，否则为 .npz）；
+#   为空时不导出
+# EXPORT_DIR: 导出文件目录，文件名为 aws_costs_<daily|monthly>_<报告日期或月份>.<扩展名>
+# EXPORT_COMPRESS: jsonl 和 csv 是否使用 gzip 压缩（列存格式本身已压缩）
+# EXPORT_ATTACH: 是否将导出文件作为邮件附件（按路由拆分的报告只附带该路由账号的数据）
+EXPORT_FORMATS = [
+    export_format.strip().lower() for export_format in os.getenv('EXPORT_FORMATS', '').split(',')
+    if export_format.strip()
+]
+EXPORT_DIR = os.getenv('EXPORT_DIR', 'exports')
+EXPORT_COMPRESS = os.getenv('EXPORT_COMPRESS', 'true').lower() in ('1', 'true', 'yes')
+EXPORT_ATTACH = os.getenv('EXPORT_ATTACH', 'false').lower() in ('1', 'true', 'yes')
+
+# GetCostAndUsage 支持的指标
+SUPPORTED_COST_METRICS = (
+    'UnblendedCost', 'AmortizedCost', 'BlendedCost', 'NetUnblendedCost',
+    'NetAmortizedCost', 'NormalizedUsageAmount', 'UsageQuantity'
+)
+
+# 成本指标（逗号分隔，同一次 GetCostAndUsage 请求中获取，不增加API调用次数）
+# 第一个为主指标，用于总计、变化量和排序，例如 UnblendedCost,AmortizedCost,NetUnblendedCost,UsageQuantity
+COST_METRICS = [metric.strip() for metric in os.getenv('COST_METRICS', 'UnblendedCost').split(',') if metric.strip()]
+# 报告中作为附加列显示的指标（必须包含在 COST_METRICS 中），为空时显示 COST_METRICS 中除主指标外的所有指标
+REPORT_EXTRA_METRICS = [
+    metric.strip() for metric in os.getenv('REPORT_EXTRA_METRICS', '').split(',') if metric.strip()
+] or COST_METRICS[1:]
+
+# Cost Explorer 限流和重试配置（所有账号共享同一个限流器）
+# CE_RATE_LIMIT: 最大请求速率（次/秒），遇到限流时自动降低，连续成功后逐步恢复
+# CE_MIN_RATE: 降速的下限（次/秒）
+# CE_MAX_RETRIES: 限流或服务端错误时的最大重试次数（指数退避，带随机抖动）
+# CE_BACKOFF_BASE / CE_BACKOFF_MAX: 第一次重试的最大等待时间和单次等待上限（秒）
+# CE_MAX_POOL_CONNECTIONS: 所有账号共享的 Cost Explorer 连接池大小，默认与 FETCH_MAX_WORKERS 一致
+CE_RATE_LIMIT = float(os.getenv('CE_RATE_LIMIT', '5'))
+CE_MIN_RATE = float(os.getenv('CE_MIN_RATE', '0.5'))
+CE_MAX_RETRIES = int(os.getenv('CE_MAX_RETRIES', '8'))
+CE_BACKOFF_BASE = float(os.getenv('CE_BACKOFF_BASE', '1'))
+CE_BACKOFF_MAX = float(os.getenv('CE_BACKOFF_MAX', '30'))
+CE_MAX_POOL_CONNECTIONS = int(os.getenv('CE_MAX_POOL_CONNECTIONS', str(FETCH_MAX_WORKERS)))
+
+# 通过 STS AssumeRole 访问账号（账号配置中的 role_arn，代替长期访问密钥）
+# 基础身份使用默认凭证链（环境变量、AWS_PROFILE、实例角色等），需要有 sts:AssumeRole 权限
+# ASSUME_ROLE_DURATION: 临时凭证有效期（秒），不能超过角色的最大会话时长（默认1小时）
+# ASSUME_ROLE_REFRESH_MARGIN: 剩余有效期少于该秒数时重新扮演角色
+# ASSUME_ROLE_SESSION_NAME: 角色会话名称（显示在目标账号的 CloudTrail 中）
+# ASSUME_ROLE_CACHE_PATH: 临时凭证的本地缓存文件（权限600），多次运行之间复用未过期的凭证；为空时只缓存在内存中
+# STS_REGION: STS 区域端点
+ASSUME_ROLE_DURATION = int(os.getenv('ASSUME_ROLE_DURATION', '3600'))
+ASSUME_ROLE_REFRESH_MARGIN = int(os.getenv('ASSUME_ROLE_REFRESH_MARGIN', '300'))
+ASSUME_ROLE_SESSION_NAME = os.getenv('ASSUME_ROLE_SESSION_NAME', 'aws-billing-report')
+ASSUME_ROLE_CACHE_PATH = os.getenv('ASSUME_ROLE_CACHE_PATH', '')
+STS_REGION = os.getenv('STS_REGION', 'us-east-1')
+
+# 运行指标输出
+# METRICS_JSON_LOG: 结构化JSON日志文件路径（追加写入，每行一个事件），'-' 表示输出到标准错误，为空时不输出
+# METRICS_TEXTFILE_PATH: Prometheus textfile 路径，例如 /var/lib/node_exporter/textfile_collector/aws_billing_report.prom
+METRICS_JSON_LOG = os.getenv('METRICS_JSON_LOG', '')
+METRICS_TEXTFILE_PATH = os.getenv('METRICS_TEXTFILE_PATH', '')
+
+# 守护进程模式（python daemon.py），常驻运行并按UTC时间自动发送报告
+# DAEMON_REPORTS: 自动发送的报表类型（逗号分隔），日报表每天发送，月报表每月 DAEMON_MONTHLY_DAY 号发送
+# DAEMON_RUN_AT: 每天的运行时间（UTC，HH:MM）
+# 收到 SIGHUP 时重新加载 accounts.json 和报告路由，无需重启
+DAEMON_REPORTS = [
+    report.strip().lower() for report in os.getenv('DAEMON_REPORTS', 'daily,monthly').split(',') if report.strip()
+]
+DAEMON_RUN_AT = os.getenv('DAEMON_RUN_AT', '01:00')
+DAEMON_MONTHLY_DAY = int(os.getenv('DAEMON_MONTHLY_DAY', '5'))
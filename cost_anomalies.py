@@ -0,0 +1,266 @@
+"""
+成本异常检测模块
+为每个 (账号, 服务) 序列维护指数加权移动平均（EWMA）和方差，每天的新数据只做一次 O(1) 更新，
+不需要重新扫描历史数据；与预期偏离超过阈值（标准差倍数和最小金额）的序列标记为异常。
+所有序列的状态存放在numpy数组中批量更新，运行之间保存为压缩的 .npz 文件
+"""
+import argparse
+import os
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+
+from cost_matrix import CostMatrix
+
+# 状态文件格式版本，格式不兼容时重新开始积累
+STATE_VERSION = 1
+
+# 标准差的下限：均值的比例和绝对金额，避免长期不变的序列因方差接近0而对很小的变化报警
+MIN_RELATIVE_STD = 0.05
+MIN_STD = 0.01
+
+# 超过该天数没有更新的序列（账号已移除或服务已停用）在每次更新后删除
+STALE_DAYS = 90
+
+
+class AnomalyDetector:
+    def __init__(self, path: str = None, half_life_days: float = 14, z_threshold: float = 3.0,
+                 min_amount: float = 10.0, min_history: int = 7):
+        """
+        初始化异常检测器，path 存在时加载之前保存的状态
+
+        Args:
+            path: 可选，状态文件路径（.npz）
+            half_life_days: EWMA 的半衰期（天），越小越快适应新的成本水平
+            z_threshold: 偏离预期超过该倍数的标准差时视为异常
+            min_amount: 偏离预期的金额至少为该值时才视为异常（忽略金额很小的波动）
+            min_history: 序列至少有该天数的历史后才参与检测
+        """
+        self.path = path
+        self.alpha = 1 - 0.5 ** (1 / half_life_days)
+        self.z_threshold = z_threshold
+        self.min_amount = min_amount
+        self.min_history = min_history
+
+        # 账号和服务名称表，序列用名称表中的编号表示
+        self.account_names: List[str] = []
+        self.service_names: List[str] = []
+        self._account_codes: Dict[str, int] = {}
+        self._service_codes: Dict[str, int] = {}
+        self._series_index: Dict[tuple, int] = {}
+
+        # 每个序列的状态：当前的均值、方差和天数，以及最近一次更新之前的状态（同一天重复运行时从这里重新计算）
+        self.state = {
+            'account': np.zeros(0, dtype=np.int32),
+            'service': np.zeros(0, dtype=np.int32),
+            'mean': np.zeros(0),
+            'var': np.zeros(0),
+            'count': np.zeros(0, dtype=np.int32),
+            'prev_mean': np.zeros(0),
+            'prev_var': np.zeros(0),
+            'prev_count': np.zeros(0, dtype=np.int32),
+            'last_day': np.zeros(0, dtype=np.int32),
+        }
+
+        if path and os.path.exists(path):
+            self._load(path)
+
+    def _load(self, path: str):
+        """加载状态文件（格式版本不同时忽略）"""
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version']) != STATE_VERSION:
+                print(f"警告: 异常检测状态文件 {path} 的格式版本不兼容，重新开始积累")
+                return
+            self.account_names = data['account_names'].tolist()
+            self.service_names = data['service_names'].tolist()
+            for name in self.state:
+                self.state[name] = data[name]
+        self._account_codes = {name: code for code, name in enumerate(self.account_names)}
+        self._service_codes = {name: code for code, name in enumerate(self.service_names)}
+        self._series_index = {
+            key: index for index, key in enumerate(zip(self.state['account'].tolist(), self.state['service'].tolist()))
+        }
+
+    def save(self, path: str = None):
+        """
+        原子保存状态（先写临时文件再重命名）
+
+        Args:
+            path: 可选，默认使用初始化时的路径
+        """
+        path = path or self.path
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                version=np.array(STATE_VERSION),
+                account_names=np.array(self.account_names, dtype=str),
+                service_names=np.array(self.service_names, dtype=str),
+                **self.state
+            )
+        os.replace(tmp_path, path)
+
+    def __len__(self) -> int:
+        return len(self.state['mean'])
+
+    @staticmethod
+    def _code(names: List[str], codes: Dict[str, int], name: str) -> int:
+        """名称在名称表中的编号（不存在时追加）"""
+        code = codes.get(name)
+        if code is None:
+            code = codes[name] = len(names)
+            names.append(name)
+        return code
+
+    def _series(self, account_codes: List[int], service_codes: List[int]) -> np.ndarray:
+        """
+        (账号编号, 服务编号) 对应的序列索引，新序列追加到状态数组末尾（初始状态为没有历史）
+        """
+        indexes = np.empty(len(account_codes), dtype=np.intp)
+        new_keys = []
+        total = len(self)
+        for position, key in enumerate(zip(account_codes, service_codes)):
+            index = self._series_index.get(key)
+            if index is None:
+                index = self._series_index[key] = total + len(new_keys)
+                new_keys.append(key)
+            indexes[position] = index
+        if new_keys:
+            accounts, services = zip(*new_keys)
+            additions = {
+                'account': np.array(accounts, dtype=np.int32),
+                'service': np.array(services, dtype=np.int32),
+            }
+            for name, values in self.state.items():
+                extra = additions.get(name, np.zeros(len(new_keys), dtype=values.dtype))
+                self.state[name] = np.concatenate([values, extra])
+        return indexes
+
+    def observe(self, day: datetime, cost_matrix: CostMatrix) -> List[dict]:
+        """
+        用某一天的成本矩阵更新所有序列，并返回当天的异常
+
+        报告中的账号在当天没有某个服务的数据时按0更新；不在报告中的账号（例如获取失败）不更新。
+        每个序列先用更新前的均值和方差计算偏离程度，再更新状态。同一天重复运行时从更新前的状态重新计算，
+        结果与只运行一次相同；早于序列最近一次更新的日期不更新也不检测。
+
+        Args:
+            day: 数据日期
+            cost_matrix: 当天的成本矩阵（current 为当天成本）
+
+        Returns:
+            异常列表 [{'account', 'service', 'amount', 'expected', 'deviation', 'z_score', 'history_days'}]，
+            按偏离金额的绝对值从大到小排序
+        """
+        day_number = day.toordinal()
+        matrix_accounts = [
+            self._code(self.account_names, self._account_codes, name) for name in cost_matrix.account_names
+        ]
+        matrix_services = [
+            self._code(self.service_names, self._service_codes, name) for name in cost_matrix.service_names
+        ]
+
+        rows, columns = np.nonzero(cost_matrix.current_present)
+        indexes = self._series(
+            [matrix_accounts[row] for row in rows.tolist()],
+            [matrix_services[column] for column in columns.tolist()]
+        )
+
+        state = self.state
+        amounts = np.zeros(len(self))
+        amounts[indexes] = cost_matrix.current[rows, columns]
+        in_report = np.isin(state['account'], np.array(matrix_accounts, dtype=np.int32))
+        update = in_report & (state['last_day'] <= day_number)
+        rerun = update & (state['last_day'] == day_number)
+
+        # 更新前的状态（同一天重复运行时使用上一次更新之前的状态）
+        mean = np.where(rerun, state['prev_mean'], state['mean'])
+        var = np.where(rerun, state['prev_var'], state['var'])
+        count = np.where(rerun, state['prev_count'], state['count'])
+
+        deviation = amounts - mean
+        std = np.maximum(np.sqrt(var), np.maximum(MIN_RELATIVE_STD * np.abs(mean), MIN_STD))
+        z_score = deviation / std
+        flagged = (
+            update
+            & (count >= self.min_history)
+            & (np.abs(z_score) >= self.z_threshold)
+            & (np.abs(deviation) >= self.min_amount)
+        )
+
+        # EWMA 更新；历史较短时权重取 1/(天数+1)，即普通的累计均值和方差，避免初始几天的方差被低估
+        alpha = np.maximum(self.alpha, 1 / (count + 1))
+        increment = alpha * deviation
+        new_mean = mean + increment
+        new_var = (1 - alpha) * (var + deviation * increment)
+        state['prev_mean'] = np.where(update, mean, state['prev_mean'])
+        state['prev_var'] = np.where(update, var, state['prev_var'])
+        state['prev_count'] = np.where(update, count, state['prev_count']).astype(np.int32)
+        state['mean'] = np.where(update, new_mean, state['mean'])
+        state['var'] = np.where(update, new_var, state['var'])
+        state['count'] = np.where(update, count + 1, state['count']).astype(np.int32)
+        state['last_day'] = np.where(update, day_number, state['last_day']).astype(np.int32)
+
+        anomalies = []
+        for index in np.flatnonzero(flagged)[np.argsort(-np.abs(deviation[flagged]), kind='stable')].tolist():
+            anomalies.append({
+                'account': self.account_names[state['account'][index]],
+                'service': self.service_names[state['service'][index]],
+                'amount': float(amounts[index]),
+                'expected': float(mean[index]),
+                'deviation': float(deviation[index]),
+                'z_score': float(z_score[index]),
+                'history_days': int(count[index]),
+            })
+
+        self._prune(day_number)
+        return anomalies
+
+    def _prune(self, day_number: int):
+        """删除超过 STALE_DAYS 天没有更新的序列"""
+        keep = self.state['last_day'] >= day_number - STALE_DAYS
+        if keep.all():
+            return
+        for name, values in self.state.items():
+            self.state[name] = values[keep]
+        self._series_index = {
+            key: index for index, key in enumerate(zip(self.state['account'].tolist(), self.state['service'].tolist()))
+        }
+
+    def stats(self) -> Dict[str, int]:
+        """返回状态统计 {序列数, 可参与检测的序列数, 账号数, 服务数}"""
+        return {
+            'series': len(self),
+            'ready': int((self.state['count'] >= self.min_history).sum()),
+            'accounts': len(np.unique(self.state['account'])),
+            'services': len(np.unique(self.state['service'])),
+        }
+
+
+def main():
+    """异常检测状态管理命令：查看统计或重置"""
+    from config import ANOMALY_STATE_PATH
+
+    parser = argparse.ArgumentParser(description='AWS账单异常检测状态管理')
+    parser.add_argument('--path', default=ANOMALY_STATE_PATH, help='状态文件路径')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help='查看状态统计')
+    subparsers.add_parser('reset', help='删除状态文件（重新开始积累）')
+    args = parser.parse_args()
+
+    if args.command == 'reset':
+        if os.path.exists(args.path):
+            os.remove(args.path)
+        print(f"已删除异常检测状态: {args.path}")
+        return
+
+    detector = AnomalyDetector(args.path)
+    stats = detector.stats()
+    print(f"状态文件: {args.path}")
+    print(f"  序列数: {stats['series']}（已积累足够历史: {stats['ready']}）")
+    print(f"  账号数: {stats['accounts']}, 服务数: {stats['services']}")
+
+
+if __name__ == '__main__':
+    main()
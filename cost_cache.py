@@ -0,0 +1,354 @@
+"""
+本地成本缓存模块
+将已经结算完成（不会再变化）的日/月账单数据保存到本地SQLite文件，
+避免每次运行都重复调用 Cost Explorer API。
+写入日数据时同时累加到所在月份的月累计中，某个月份的每一天都已缓存时可以直接得到该月的服务成本
+"""
+import argparse
+import calendar
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+# 缓存中多维分组键（例如 关联账号ID + 服务）的分隔符
+GROUP_KEY_SEPARATOR = '\t'
+
+
+class CostCache:
+    def __init__(self, path: str, final_lag_days: int = 4):
+        """
+        初始化成本缓存
+
+        Args:
+            path: SQLite 数据库文件路径
+            final_lag_days: 数据结算延迟天数，结束日期早于该天数的周期视为已结算
+        """
+        self.path = path
+        self.final_lag_days = final_lag_days
+        # 多个线程共享同一个连接，通过锁串行化访问
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cost_periods (
+                account TEXT NOT NULL,
+                granularity TEXT NOT NULL,
+                period TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                total REAL NOT NULL,
+                fetched_at TEXT NOT NULL,
+                PRIMARY KEY (account, granularity, period, metric)
+            );
+            CREATE TABLE IF NOT EXISTS cost_entries (
+                account TEXT NOT NULL,
+                granularity TEXT NOT NULL,
+                period TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                service TEXT NOT NULL,
+                amount REAL NOT NULL,
+                PRIMARY KEY (account, granularity, period, metric, service)
+            );
+            CREATE TABLE IF NOT EXISTS account_names (
+                account_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS month_to_date (
+                account TEXT NOT NULL,
+                month TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                service TEXT NOT NULL,
+                amount REAL NOT NULL,
+                PRIMARY KEY (account, month, metric, service)
+            );
+            CREATE TABLE IF NOT EXISTS month_to_date_days (
+                account TEXT NOT NULL,
+                month TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                day TEXT NOT NULL,
+                PRIMARY KEY (account, metric, day)
+            );
+        """)
+        # 旧版本创建的缓存文件没有月累计，按已缓存的日数据补建
+        with self._conn:
+            if self._conn.execute("SELECT 1 FROM month_to_date_days LIMIT 1").fetchone() is None:
+                self._rebuild_month_to_date()
+
+    def is_finalized(self, period_end: datetime, now: datetime = None) -> bool:
+        """
+        判断周期是否已结算
+
+        Args:
+            period_end: 周期结束日期（不包含）
+            now: 当前时间（默认UTC当前时间）
+
+        Returns:
+            周期最后一天早于等于 final_lag_days 天前时返回True
+        """
+        now = now or datetime.utcnow()
+        today = datetime(now.year, now.month, now.day)
+        last_day = datetime(period_end.year, period_end.month, period_end.day) - timedelta(days=1)
+        return last_day <= today - timedelta(days=self.final_lag_days)
+
+    def get(self, account: str, granularity: str, period: str, metric: str) -> Optional[Dict[str, float]]:
+        """
+        读取缓存的服务成本
+
+        Returns:
+            服务成本字典；未缓存时返回None（已缓存但无费用时返回空字典）
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM cost_periods WHERE account=? AND granularity=? AND period=? AND metric=?",
+                (account, granularity, period, metric)
+            ).fetchone()
+            if row is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT service, amount FROM cost_entries WHERE account=? AND granularity=? AND period=? AND metric=?",
+                (account, granularity, period, metric)
+            ).fetchall()
+        return {service: amount for service, amount in rows}
+
+    def put(self, account: str, granularity: str, period: str, metric: str, costs: Dict[str, float]):
+        """
+        写入（覆盖）某个周期的服务成本
+        """
+        fetched_at = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        key = (account, granularity, period, metric)
+        with self._lock, self._conn:
+            if granularity == 'DAILY':
+                self._add_to_month(account, period, metric, costs)
+            self._conn.execute(
+                "DELETE FROM cost_entries WHERE account=? AND granularity=? AND period=? AND metric=?", key
+            )
+            self._conn.executemany(
+                "INSERT INTO cost_entries VALUES (?, ?, ?, ?, ?, ?)",
+                [key + (service, amount) for service, amount in costs.items()]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cost_periods VALUES (?, ?, ?, ?, ?, ?)",
+                key + (sum(costs.values()), fetched_at)
+            )
+
+    def _add_to_month(self, account: str, day: str, metric: str, costs: Dict[str, float]):
+        """
+        将一天的服务成本累加到所在月份的月累计（调用方持有锁并在同一事务中覆盖日数据）
+
+        该天已经累加过时（重新获取覆盖），先减去之前缓存的金额，避免重复计算。
+        """
+        month = day[:8] + '01'
+        deltas = dict(costs)
+        counted = self._conn.execute(
+            "SELECT 1 FROM month_to_date_days WHERE account=? AND metric=? AND day=?", (account, metric, day)
+        ).fetchone()
+        if counted is not None:
+            for service, amount in self._conn.execute(
+                "SELECT service, amount FROM cost_entries WHERE account=? AND granularity='DAILY' AND period=? AND metric=?",
+                (account, day, metric)
+            ):
+                deltas[service] = deltas.get(service, 0.0) - amount
+        self._conn.executemany(
+            "INSERT INTO month_to_date VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (account, month, metric, service) DO UPDATE SET amount = amount + excluded.amount",
+            [(account, month, metric, service, amount) for service, amount in deltas.items()]
+        )
+        self._conn.execute(
+            "INSERT OR IGNORE INTO month_to_date_days VALUES (?, ?, ?, ?)", (account, month, metric, day)
+        )
+
+    def _rebuild_month_to_date(self, account: str = None, since_month: str = None):
+        """
+        按已缓存的日数据重新计算月累计（调用方持有锁并在事务中调用）
+
+        Args:
+            account: 只重建该账号（及其整合账单数据）的月累计
+            since_month: 只重建该月份（YYYY-MM-01）及之后的月累计
+        """
+        conditions = []
+        source_conditions = []
+        params = []
+        if account:
+            conditions.append(" AND (account=? OR substr(account, 1, ?)=?)")
+            source_conditions.append(" AND (account=? OR substr(account, 1, ?)=?)")
+            params.extend([account, len(account) + 1, f"{account}@"])
+        if since_month:
+            conditions.append(" AND month>=?")
+            source_conditions.append(" AND period>=?")
+            params.append(since_month)
+        where = ''.join(conditions)
+        source_where = ''.join(source_conditions)
+
+        self._conn.execute(f"DELETE FROM month_to_date WHERE 1=1{where}", params)
+        self._conn.execute(f"DELETE FROM month_to_date_days WHERE 1=1{where}", params)
+        self._conn.execute(f"""
+            INSERT INTO month_to_date
+            SELECT account, substr(period, 1, 8) || '01', metric, service, SUM(amount)
+            FROM cost_entries WHERE granularity='DAILY'{source_where}
+            GROUP BY account, substr(period, 1, 8) || '01', metric, service
+        """, params)
+        self._conn.execute(f"""
+            INSERT INTO month_to_date_days
+            SELECT account, substr(period, 1, 8) || '01', metric, period
+            FROM cost_periods WHERE granularity='DAILY'{source_where}
+        """, params)
+
+    def get_month_from_daily(self, account: str, month: str, metric: str) -> Optional[Dict[str, float]]:
+        """
+        读取由日数据累加得到的整月服务成本
+
+        Args:
+            account: 缓存账号键
+            month: 月份第一天（YYYY-MM-01）
+            metric: 指标名
+
+        Returns:
+            服务成本字典；该月有任何一天未缓存时返回None
+        """
+        year, month_number = int(month[:4]), int(month[5:7])
+        days_in_month = calendar.monthrange(year, month_number)[1]
+        with self._lock:
+            days = self._conn.execute(
+                "SELECT COUNT(*) FROM month_to_date_days WHERE account=? AND month=? AND metric=?",
+                (account, month, metric)
+            ).fetchone()[0]
+            if days < days_in_month:
+                return None
+            rows = self._conn.execute(
+                "SELECT service, amount FROM month_to_date WHERE account=? AND month=? AND metric=?",
+                (account, month, metric)
+            ).fetchall()
+        return {service: amount for service, amount in rows}
+
+    def get_daily_history(self, accounts: List[str], start: str, end: str,
+                          metric: str) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str, str, float]]]:
+        """
+        批量读取多个账号一段时间内已缓存的日数据（用于趋势，不访问API）
+
+        Args:
+            accounts: 缓存账号键列表
+            start: 开始日期（YYYY-MM-DD，包含）
+            end: 结束日期（YYYY-MM-DD，不包含）
+            metric: 指标名
+
+        Returns:
+            ([(账号, 日期)] 已缓存的日期, [(账号, 日期, 服务, 金额)])
+        """
+        periods = []
+        entries = []
+        with self._lock:
+            # 分批查询，避免超过 SQLite 的参数数量上限
+            for offset in range(0, len(accounts), 500):
+                chunk = accounts[offset:offset + 500]
+                condition = (f"granularity='DAILY' AND account IN ({', '.join('?' * len(chunk))}) "
+                             f"AND period>=? AND period<? AND metric=?")
+                params = list(chunk) + [start, end, metric]
+                periods.extend(self._conn.execute(
+                    f"SELECT account, period FROM cost_periods WHERE {condition}", params
+                ).fetchall())
+                entries.extend(self._conn.execute(
+                    f"SELECT account, period, service, amount FROM cost_entries WHERE {condition}", params
+                ).fetchall())
+        return periods, entries
+
+    def put_account_names(self, names: Dict[str, str]):
+        """
+        保存关联账号ID到账号名称的映射
+        """
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO account_names VALUES (?, ?)", list(names.items()))
+
+    def get_account_names(self) -> Dict[str, str]:
+        """
+        读取关联账号ID到账号名称的映射
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT account_id, name FROM account_names").fetchall()
+        return dict(rows)
+
+    def invalidate(self, account: str = None, granularity: str = None, since: str = None) -> int:
+        """
+        删除缓存数据
+
+        Args:
+            account: 只删除该账号的数据（默认全部账号）
+            granularity: 只删除该粒度的数据，'DAILY' 或 'MONTHLY'（默认全部）
+            since: 只删除周期开始日期不早于该日期（YYYY-MM-DD）的数据
+
+        Returns:
+            删除的周期数
+        """
+        conditions = []
+        params = []
+        if account:
+            # 同时清除该账号以 <账号>@ 为前缀的缓存键（按前缀精确比较，账号名称中的 _ 和 % 不是通配符）
+            conditions.append("(account=? OR substr(account, 1, ?)=?)")
+            params.extend([account, len(account) + 1, f"{account}@"])
+        if granularity:
+            conditions.append("granularity=?")
+            params.append(granularity.upper())
+        if since:
+            conditions.append("period>=?")
+            params.append(since)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM cost_entries{where}", params)
+            removed = self._conn.execute(f"DELETE FROM cost_periods{where}", params).rowcount
+            if not granularity or granularity.upper() == 'DAILY':
+                self._rebuild_month_to_date(account, since[:8] + '01' if since else None)
+            return removed
+
+    def stats(self) -> Dict[str, int]:
+        """
+        返回缓存统计信息 {粒度: 周期数}，MONTH_TO_DATE 为有月累计的月份数（按账号和指标分别计数）
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT granularity, COUNT(*) FROM cost_periods GROUP BY granularity"
+            ).fetchall()
+            months = self._conn.execute(
+                "SELECT COUNT(*) FROM (SELECT DISTINCT account, month, metric FROM month_to_date_days)"
+            ).fetchone()[0]
+        stats = dict(rows)
+        stats['MONTH_TO_DATE'] = months
+        return stats
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    """缓存管理命令：查看统计或清除缓存"""
+    from config import COST_CACHE_PATH
+
+    parser = argparse.ArgumentParser(description='AWS账单本地缓存管理')
+    parser.add_argument('--path', default=COST_CACHE_PATH, help='缓存文件路径')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('stats', help='查看缓存统计')
+
+    clear_parser = subparsers.add_parser('clear', help='清除缓存（下次运行时重新从API获取）')
+    clear_parser.add_argument('--account', help='只清除该账号名称的缓存')
+    clear_parser.add_argument('--granularity', choices=['DAILY', 'MONTHLY', 'daily', 'monthly'], help='只清除该粒度的缓存')
+    clear_parser.add_argument('--since', help='只清除该日期（YYYY-MM-DD）及之后的周期')
+
+    args = parser.parse_args()
+    cache = CostCache(args.path)
+
+    if args.command == 'stats':
+        stats = cache.stats()
+        print(f"缓存文件: {args.path}")
+        print(f"  日数据周期数: {stats.get('DAILY', 0)}")
+        print(f"  月数据周期数: {stats.get('MONTHLY', 0)}")
+        print(f"  日数据月累计数: {stats.get('MONTH_TO_DATE', 0)}")
+    else:
+        removed = cache.invalidate(args.account, args.granularity, args.since)
+        print(f"已清除 {removed} 个缓存周期")
+
+    cache.close()
+
+
+if __name__ == '__main__':
+    main()
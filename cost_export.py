@@ -0,0 +1,317 @@
+"""
+成本数据导出模块
+将报告使用的数据逐行导出为机器可读的文件，供数据仓库或其他工具直接加载（不需要解析HTML）：
+每行为一个 账号 × 服务 × 周期 × 指标 的金额，支持 JSON Lines、CSV 和列存格式，
+所有格式在同一次遍历中逐行写入，不在内存中构建完整的数据集（列存格式只缓存一批数据）。
+列存格式在安装了 pyarrow 时为 Parquet，否则为按批次写入的压缩 numpy 数组（.npz，字符串列按字典编码）。
+文件先写入临时文件，全部写完后再重命名，读取方不会看到写了一半的文件。
+"""
+import csv
+import gzip
+import json
+import os
+import zipfile
+from datetime import date, datetime
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+# 导出的列，每行一个 账号 × 服务 × 周期 × 指标
+COLUMNS = ('period_start', 'granularity', 'account_name', 'account_id', 'service', 'metric', 'amount')
+
+# 字符串列（列存格式中按字典编码）
+STRING_COLUMNS = ('granularity', 'account_name', 'account_id', 'service', 'metric')
+
+# 支持的导出格式
+EXPORT_FORMATS = ('jsonl', 'csv', 'columnar')
+
+# 列存格式每批的行数（每批单独写出，内存中只保留一批）
+BATCH_ROWS = 50000
+
+# gzip 压缩级别（默认的9级比6级慢很多，压缩率只略高）
+GZIP_LEVEL = 6
+
+# 导出行: (周期开始日期, 粒度, 账号名称, 账号ID, 服务, 指标, 金额)
+Row = Tuple[str, str, str, str, str, str, float]
+
+
+def iter_export_rows(account_details: List[dict], yesterday: datetime, day_before: datetime, is_monthly: bool,
+                     metric: str) -> Iterator[Row]:
+    """
+    按账号配置顺序逐行生成导出数据（先报告周期，再对比周期）
+
+    Args:
+        account_details: 账号明细列表（fetch_account_data 的结果）
+        yesterday: 报告周期的日期（月报表为该月的任意一天）
+        day_before: 对比周期的日期
+        is_monthly: 是否为月报表（周期开始日期为该月1号）
+        metric: 主指标名称，账号明细中没有按指标保存的数据时使用（例如旧版本 fetch 输出的JSON）
+
+    Yields:
+        (周期开始日期, 粒度, 账号名称, 账号ID, 服务, 指标, 金额)
+    """
+    granularity = 'MONTHLY' if is_monthly else 'DAILY'
+    periods = []
+    for period_date, prefix in ((yesterday, 'yesterday'), (day_before, 'day_before')):
+        if is_monthly:
+            period_date = period_date.replace(day=1)
+        periods.append((period_date.strftime('%Y-%m-%d'), prefix))
+
+    for acc_detail in account_details:
+        account_name = acc_detail['account_name']
+        account_id = str(acc_detail.get('account_id') or '')
+        for period_start, prefix in periods:
+            metrics = acc_detail.get(f'{prefix}_metrics') or {metric: acc_detail[f'{prefix}_costs']}
+            for metric_name, costs in metrics.items():
+                for service, amount in costs.items():
+                    yield period_start, granularity, account_name, account_id, service, metric_name, float(amount)
+
+
+def _load_pyarrow():
+    """导入 pyarrow（可选依赖），未安装时返回None"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow
+
+
+class _ExportWriter:
+    # 文件扩展名（子类设置）
+    extension = ''
+
+    def __init__(self, base_path: str):
+        """
+        导出文件写入器：逐行写入临时文件，commit 时重命名为最终文件
+
+        Args:
+            base_path: 不含扩展名的文件路径
+        """
+        self.path = base_path + self.extension
+        self._tmp_path = self.path + '.tmp'
+
+    def write(self, row: Row):
+        raise NotImplementedError
+
+    def _close(self):
+        raise NotImplementedError
+
+    def commit(self):
+        """写完所有数据，替换最终文件"""
+        self._close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """导出失败时关闭并删除临时文件"""
+        try:
+            self._close()
+        finally:
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+
+
+class _TextWriter(_ExportWriter):
+    def __init__(self, base_path: str, compress: bool):
+        """文本格式写入器，compress 为 True 时写入 gzip 压缩文件（扩展名追加 .gz）"""
+        if compress:
+            self.extension += '.gz'
+        super().__init__(base_path)
+        if compress:
+            self._file = gzip.open(self._tmp_path, 'wt', compresslevel=GZIP_LEVEL, encoding='utf-8', newline='')
+        else:
+            self._file = open(self._tmp_path, 'w', encoding='utf-8', newline='')
+
+    def _close(self):
+        self._file.close()
+
+
+class JsonLinesWriter(_TextWriter):
+    extension = '.jsonl'
+    # 复用同一个编码器（json.dumps 带参数时每次调用都会创建新的编码器）
+    _encode = json.JSONEncoder(ensure_ascii=False).encode
+
+    def write(self, row: Row):
+        self._file.write(self._encode(dict(zip(COLUMNS, row))) + '\n')
+
+
+class CsvWriter(_TextWriter):
+    extension = '.csv'
+
+    def __init__(self, base_path: str, compress: bool):
+        """CSV 写入器，第一行为列名"""
+        super().__init__(base_path, compress)
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(COLUMNS)
+
+    def write(self, row: Row):
+        self._writer.writerow(row)
+
+
+class _BatchWriter(_ExportWriter):
+    def __init__(self, base_path: str, batch_rows: int = BATCH_ROWS):
+        """列存格式写入器：按列缓存一批数据，每满 batch_rows 行写出一批"""
+        super().__init__(base_path)
+        self.batch_rows = batch_rows
+        self._columns: Tuple[list, ...] = tuple([] for _ in COLUMNS)
+        self._appends = tuple(column.append for column in self._columns)
+
+    def write(self, row: Row):
+        for append, value in zip(self._appends, row):
+            append(value)
+        if len(self._columns[0]) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        """写出当前缓存的一批数据"""
+        if self._columns[0]:
+            self._write_batch(dict(zip(COLUMNS, self._columns)))
+            for column in self._columns:
+                column.clear()
+
+    def _write_batch(self, columns: Dict[str, list]):
+        raise NotImplementedError
+
+
+class ParquetWriter(_BatchWriter):
+    extension = '.parquet'
+
+    def __init__(self, base_path: str, batch_rows: int = BATCH_ROWS):
+        """Parquet 写入器（需要 pyarrow），每批写为一个 row group，使用 zstd 压缩"""
+        super().__init__(base_path, batch_rows)
+        pa = _load_pyarrow()
+        self._pa = pa
+        self._schema = pa.schema(
+            [('period_start', pa.date32())]
+            + [(name, pa.string()) for name in COLUMNS[1:-1]]
+            + [('amount', pa.float64())]
+        )
+        self._writer = pa.parquet.ParquetWriter(self._tmp_path, self._schema, compression='zstd')
+        # 每批中的日期只有两个，解析结果复用
+        self._dates: Dict[str, date] = {}
+
+    def _write_batch(self, columns: Dict[str, list]):
+        dates = self._dates
+        for value in columns['period_start']:
+            if value not in dates:
+                dates[value] = datetime.strptime(value, '%Y-%m-%d').date()
+        columns['period_start'] = [dates[value] for value in columns['period_start']]
+        self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self._schema))
+
+    def _close(self):
+        self.flush()
+        self._writer.close()
+
+
+class NpzWriter(_BatchWriter):
+    extension = '.npz'
+
+    def __init__(self, base_path: str, batch_rows: int = BATCH_ROWS):
+        """
+        未安装 pyarrow 时的列存格式：与 np.savez_compressed 相同的 zip 容器，可以直接用 np.load 读取
+
+        每批写入 batch-<序号>/<列名>.npy，字符串列保存为 int32 编码，
+        编码对应的字符串在结束时写入 dictionary/<列名>.npy；load_npz_export 读取并还原为完整的列
+        """
+        super().__init__(base_path, batch_rows)
+        self._zip = zipfile.ZipFile(self._tmp_path, 'w', compression=zipfile.ZIP_DEFLATED)
+        self._batches = 0
+        self._dictionaries: Dict[str, Dict[str, int]] = {name: {} for name in STRING_COLUMNS}
+
+    def _write_member(self, name: str, values: np.ndarray):
+        with self._zip.open(f'{name}.npy', 'w', force_zip64=True) as member:
+            np.lib.format.write_array(member, values, allow_pickle=False)
+
+    def _write_batch(self, columns: Dict[str, list]):
+        prefix = f'batch-{self._batches:06d}'
+        self._write_member(f'{prefix}/period_start', np.array(columns['period_start'], dtype='datetime64[D]'))
+        for name in STRING_COLUMNS:
+            codes = self._dictionaries[name]
+            values = [codes.setdefault(value, len(codes)) for value in columns[name]]
+            self._write_member(f'{prefix}/{name}', np.array(values, dtype=np.int32))
+        self._write_member(f'{prefix}/amount', np.array(columns['amount'], dtype=np.float64))
+        self._batches += 1
+
+    def _close(self):
+        if self._zip.fp is None:
+            return
+        self.flush()
+        for name, codes in self._dictionaries.items():
+            self._write_member(f'dictionary/{name}', np.array(list(codes), dtype=str))
+        self._zip.close()
+
+
+def load_npz_export(path: str) -> Dict[str, np.ndarray]:
+    """
+    读取 NpzWriter 导出的文件
+
+    Returns:
+        {列名: 所有批次合并后的数组}，字符串列已按字典还原
+    """
+    with np.load(path) as data:
+        batches = sorted({key.partition('/')[0] for key in data.files if key.startswith('batch-')})
+        result = {}
+        for name in COLUMNS:
+            if batches:
+                values = np.concatenate([data[f'{batch}/{name}'] for batch in batches])
+            else:
+                values = np.array([], dtype=np.int32 if name in STRING_COLUMNS else np.float64)
+            if name in STRING_COLUMNS:
+                values = data[f'dictionary/{name}'][values]
+            result[name] = values
+        return result
+
+
+def open_writer(export_format: str, base_path: str, compress: bool = True) -> _ExportWriter:
+    """
+    按格式创建写入器
+
+    Args:
+        export_format: 'jsonl'、'csv' 或 'columnar'
+        base_path: 不含扩展名的文件路径
+        compress: 文本格式是否使用 gzip 压缩（列存格式本身已压缩）
+    """
+    if export_format == 'jsonl':
+        return JsonLinesWriter(base_path, compress)
+    if export_format == 'csv':
+        return CsvWriter(base_path, compress)
+    if export_format == 'columnar':
+        return ParquetWriter(base_path) if _load_pyarrow() is not None else NpzWriter(base_path)
+    raise ValueError(f"不支持的导出格式: {export_format}")
+
+
+def export_rows(rows: Iterable[Row], base_path: str, formats: Sequence[str], compress: bool = True) -> Tuple[List[str], int]:
+    """
+    在一次遍历中把数据行写入所有格式的文件
+
+    Args:
+        rows: 数据行（通常为 iter_export_rows 的生成器）
+        base_path: 不含扩展名的文件路径，每种格式追加自己的扩展名
+        formats: 导出格式列表
+        compress: 文本格式是否使用 gzip 压缩
+
+    Returns:
+        (导出文件路径列表, 行数)
+    """
+    writers = []
+    committed = 0
+    try:
+        for export_format in formats:
+            writers.append(open_writer(export_format, base_path, compress))
+        count = 0
+        for row in rows:
+            for writer in writers:
+                writer.write(row)
+            count += 1
+        for writer in writers:
+            writer.commit()
+            committed += 1
+    except BaseException:
+        # 已替换的最终文件保留，其余写入器删除临时文件
+        for writer in writers[committed:]:
+            try:
+                writer.abort()
+            except Exception:
+                pass
+        raise
+    return [writer.path for writer in writers], count
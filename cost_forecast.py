@@ -0,0 +1,403 @@
+"""
+月末成本预测模块
+每个账号和每个 (账号, 服务) 序列只保存本月日成本对日期的线性回归的累计量（Σx、Σx²、Σy、Σxy、Σy²），
+每天的新数据只做一次 O(1) 累加，不需要重新拟合历史数据。预测值为本月至今的成本加上未统计日期的回归预测，
+置信区间由账号的回归残差方差计算。所有状态存放在numpy数组中，运行之间保存为压缩的 .npz 文件
+"""
+import argparse
+import calendar
+import os
+from datetime import datetime
+from statistics import NormalDist
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from cost_matrix import CostMatrix
+
+# 状态文件格式版本，格式不兼容时重新开始积累
+STATE_VERSION = 1
+
+# 本月统计天数少于该值时不计算置信区间（残差方差的自由度太小）
+MIN_BAND_DAYS = 3
+
+
+def month_number(day: datetime) -> int:
+    """日期所在月份的序号（年 × 12 + 月 - 1）"""
+    return day.year * 12 + day.month - 1
+
+
+class MonthEndForecast:
+    def __init__(self, month: datetime, days_in_month: int, account_names: List[str], days: np.ndarray,
+                 month_to_date: np.ndarray, projected: np.ndarray, std: np.ndarray, confidence: float,
+                 service_names: List[str], service_month_to_date: np.ndarray, service_projected: np.ndarray):
+        """
+        初始化月末预测结果（通常由 ForecastModel.project 构建）
+
+        Args:
+            month: 预测月份的第一天
+            days_in_month: 该月天数
+            account_names: 账号名称列表
+            days: 每个账号本月已统计的天数
+            month_to_date: 每个账号本月至今（已统计日期）的成本
+            projected: 每个账号预测的月末总成本
+            std: 每个账号预测的标准差（天数不足时为 nan）
+            confidence: 置信区间的置信水平（0~1）
+            service_names: 服务名称列表
+            service_month_to_date: 每个账号每个服务本月至今的成本，形状 (账号数, 服务数)
+            service_projected: 每个账号每个服务预测的月末成本，形状 (账号数, 服务数)
+        """
+        self.month = month
+        self.days_in_month = days_in_month
+        self.account_names = account_names
+        self.days = days
+        self.month_to_date = month_to_date
+        self.projected = projected
+        self.std = std
+        self.confidence = confidence
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.service_names = service_names
+        self.service_month_to_date = service_month_to_date
+        self.service_projected = service_projected
+        self.account_index = {name: row for row, name in enumerate(account_names)}
+
+    def subset(self, account_names: List[str]) -> 'MonthEndForecast':
+        """只保留指定账号（例如报告路由负责的账号），合计按这些账号重新计算"""
+        rows = [self.account_index[name] for name in account_names if name in self.account_index]
+        return MonthEndForecast(
+            self.month, self.days_in_month, [self.account_names[row] for row in rows], self.days[rows],
+            self.month_to_date[rows], self.projected[rows], self.std[rows], self.confidence,
+            self.service_names, self.service_month_to_date[rows], self.service_projected[rows]
+        )
+
+    def _band(self, month_to_date: float, projected: float, std: float) -> Tuple[float, float]:
+        """置信区间（下限不低于本月至今的成本），标准差为 nan 时返回 (nan, nan)"""
+        if np.isnan(std):
+            return float('nan'), float('nan')
+        return max(month_to_date, projected - self.z * std), projected + self.z * std
+
+    def account(self, account_name: str) -> Optional[Tuple[int, float, float, float, float]]:
+        """账号的 (已统计天数, 本月至今, 预测月末, 区间下限, 区间上限)，账号没有预测时返回None"""
+        row = self.account_index.get(account_name)
+        if row is None:
+            return None
+        month_to_date, projected = float(self.month_to_date[row]), float(self.projected[row])
+        return (int(self.days[row]), month_to_date, projected) + self._band(month_to_date, projected, float(self.std[row]))
+
+    def total(self) -> Tuple[float, float, float, float]:
+        """
+        所有账号的 (本月至今, 预测月末, 区间下限, 区间上限)
+
+        合计的方差为各账号方差之和（假设账号之间的波动相互独立）
+        """
+        month_to_date, projected = float(self.month_to_date.sum()), float(self.projected.sum())
+        std = float(np.sqrt((self.std ** 2).sum()))
+        return (month_to_date, projected) + self._band(month_to_date, projected, std)
+
+    def top_services(self, count: int) -> List[Tuple[str, float, float]]:
+        """所有账号合计预测月末成本最高的服务 [(服务名, 本月至今, 预测月末)]"""
+        projected = self.service_projected.sum(axis=0)
+        month_to_date = self.service_month_to_date.sum(axis=0)
+        order = np.argsort(-projected, kind='stable')[:count]
+        return [
+            (self.service_names[column], float(month_to_date[column]), float(projected[column]))
+            for column in order.tolist() if projected[column] > 0
+        ]
+
+
+class ForecastModel:
+    # 账号状态：月份序号、本月已统计日期的位掩码（第 d 天为第 d-1 位）、最近一次统计的日期和当天总成本，以及回归累计量
+    ACCOUNT_FIELDS = {
+        'month': np.int32, 'mask': np.uint32, 'last_day': np.int32, 'last_total': np.float64,
+        'n': np.float64, 'sx': np.float64, 'sxx': np.float64, 'sy': np.float64, 'sxy': np.float64, 'syy': np.float64,
+    }
+    # 序列状态：账号和服务编号、回归累计量和账号最近一次统计日期当天的成本
+    SERIES_FIELDS = {
+        'account': np.int32, 'service': np.int32, 'sy': np.float64, 'sxy': np.float64, 'last': np.float64,
+    }
+
+    def __init__(self, path: str = None, trend_days: int = 7):
+        """
+        初始化月末预测模型，path 存在时加载之前保存的状态
+
+        本月统计天数达到 trend_days 后按线性趋势外推，之前按日均成本（run rate）外推。
+        账号中第一次出现的服务在之前已统计的日期按0计算（与账号共用 Σx 和 Σx²）。
+
+        Args:
+            path: 可选，状态文件路径（.npz）
+            trend_days: 开始使用线性趋势的天数
+        """
+        self.path = path
+        self.trend_days = trend_days
+        self.account_names: List[str] = []
+        self.service_names: List[str] = []
+        self._account_codes: Dict[str, int] = {}
+        self._service_codes: Dict[str, int] = {}
+        self._series_index: Dict[tuple, int] = {}
+        # 账号状态按账号编号索引
+        self.accounts = {name: np.zeros(0, dtype=dtype) for name, dtype in self.ACCOUNT_FIELDS.items()}
+        self.series = {name: np.zeros(0, dtype=dtype) for name, dtype in self.SERIES_FIELDS.items()}
+
+        if path and os.path.exists(path):
+            self._load(path)
+
+    def _load(self, path: str):
+        """加载状态文件（格式版本不同时忽略）"""
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version']) != STATE_VERSION:
+                print(f"警告: 月末预测状态文件 {path} 的格式版本不兼容，重新开始积累")
+                return
+            self.account_names = data['account_names'].tolist()
+            self.service_names = data['service_names'].tolist()
+            for name in self.accounts:
+                self.accounts[name] = data[f"account_{name}"]
+            for name in self.series:
+                self.series[name] = data[f"series_{name}"]
+        self._account_codes = {name: code for code, name in enumerate(self.account_names)}
+        self._service_codes = {name: code for code, name in enumerate(self.service_names)}
+        self._reindex()
+
+    def save(self, path: str = None):
+        """
+        原子保存状态（先写临时文件再重命名）
+
+        Args:
+            path: 可选，默认使用初始化时的路径
+        """
+        path = path or self.path
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                version=np.array(STATE_VERSION),
+                account_names=np.array(self.account_names, dtype=str),
+                service_names=np.array(self.service_names, dtype=str),
+                **{f"account_{name}": values for name, values in self.accounts.items()},
+                **{f"series_{name}": values for name, values in self.series.items()}
+            )
+        os.replace(tmp_path, path)
+
+    def __len__(self) -> int:
+        return len(self.series['sy'])
+
+    def _reindex(self):
+        """重建 (账号编号, 服务编号) -> 序列索引"""
+        self._series_index = {
+            key: index for index, key in enumerate(zip(self.series['account'].tolist(), self.series['service'].tolist()))
+        }
+
+    def _account_code(self, name: str) -> int:
+        """账号编号（新账号追加到账号状态数组末尾，月份为 -1 表示没有数据）"""
+        code = self._account_codes.get(name)
+        if code is None:
+            code = self._account_codes[name] = len(self.account_names)
+            self.account_names.append(name)
+            for field, values in self.accounts.items():
+                initial = -1 if field == 'month' else 0
+                self.accounts[field] = np.append(values, np.array([initial], dtype=values.dtype))
+        return code
+
+    def _service_code(self, name: str) -> int:
+        """服务编号"""
+        code = self._service_codes.get(name)
+        if code is None:
+            code = self._service_codes[name] = len(self.service_names)
+            self.service_names.append(name)
+        return code
+
+    def observe(self, day: datetime, cost_matrix: CostMatrix) -> int:
+        """
+        用某一天的成本矩阵累加回归状态
+
+        报告中的账号在当天没有某个服务的数据时按0累加；进入新的月份时账号的状态清零。
+        同一账号同一天再次统计时：如果是最近一次统计的日期（例如重复运行），先减去上一次的值再累加；
+        否则跳过。早于账号状态所在月份的日期也跳过。
+
+        Args:
+            day: 数据日期
+            cost_matrix: 当天的成本矩阵（current 为当天成本）
+
+        Returns:
+            本次更新的账号数
+        """
+        month, x = month_number(day), day.day
+        bit = np.uint32(1 << (x - 1))
+        codes = np.array([self._account_code(name) for name in cost_matrix.account_names], dtype=np.intp)
+        accounts = self.accounts
+
+        # 进入新月份的账号：清零状态并删除其序列
+        rolled = codes[accounts['month'][codes] < month]
+        if len(rolled):
+            for field, values in accounts.items():
+                values[rolled] = month if field == 'month' else 0
+            keep = ~np.isin(self.series['account'], rolled)
+            if not keep.all():
+                for field, values in self.series.items():
+                    self.series[field] = values[keep]
+                self._reindex()
+
+        seen = (accounts['mask'][codes] & bit) != 0
+        rerun = seen & (accounts['last_day'][codes] == x)
+        update = (accounts['month'][codes] == month) & (~seen | rerun)
+        if not update.any():
+            return 0
+        latest = update & (x >= accounts['last_day'][codes])
+
+        # 当天出现的序列（新序列的累计量为0，相当于之前已统计的日期按0计算）
+        rows, columns = np.nonzero(cost_matrix.current_present & update[:, None])
+        service_codes = [self._service_code(name) for name in cost_matrix.service_names]
+        new_keys = []
+        indexes = np.empty(len(rows), dtype=np.intp)
+        for position, key in enumerate(zip(codes[rows].tolist(), [service_codes[column] for column in columns.tolist()])):
+            index = self._series_index.get(key)
+            if index is None:
+                index = self._series_index[key] = len(self) + len(new_keys)
+                new_keys.append(key)
+            indexes[position] = index
+        if new_keys:
+            new_accounts, new_services = zip(*new_keys)
+            additions = {'account': np.array(new_accounts), 'service': np.array(new_services)}
+            for field, values in self.series.items():
+                extra = additions.get(field, np.zeros(len(new_keys)))
+                self.series[field] = np.concatenate([values, extra.astype(values.dtype)])
+
+        # 按账号编号索引的标记，展开到序列
+        flags = np.zeros((3, len(self.account_names)), dtype=bool)
+        flags[0, codes[update]] = True
+        flags[1, codes[rerun & update]] = True
+        flags[2, codes[latest]] = True
+        series = self.series
+        series_update, series_rerun, series_latest = flags[:, series['account']]
+        amounts = np.zeros(len(self))
+        amounts[indexes] = cost_matrix.current[rows, columns]
+
+        # 重复统计时先减去上一次的值
+        totals = cost_matrix.current_totals
+        previous = np.where(rerun, accounts['last_total'][codes], 0.0)
+        removed = rerun.astype(np.float64)
+        delta = np.where(update, totals, 0.0) - previous
+        count = update.astype(np.float64) - removed
+        accounts['n'][codes] += count
+        accounts['sx'][codes] += count * x
+        accounts['sxx'][codes] += count * x * x
+        accounts['sy'][codes] += delta
+        accounts['sxy'][codes] += delta * x
+        accounts['syy'][codes] += np.where(update, totals ** 2, 0.0) - previous ** 2
+        accounts['mask'][codes[update]] |= bit
+        accounts['last_day'][codes[latest]] = x
+        accounts['last_total'][codes[latest]] = totals[latest]
+
+        series_delta = np.where(series_update, amounts, 0.0) - np.where(series_rerun, series['last'], 0.0)
+        series['sy'] += series_delta
+        series['sxy'] += series_delta * x
+        series['last'] = np.where(series_latest, amounts, series['last'])
+        return int(update.sum())
+
+    def project(self, day: datetime, account_names: List[str], confidence: float = 0.9) -> Optional[MonthEndForecast]:
+        """
+        预测 day 所在月份的月末成本
+
+        Args:
+            day: 报告日期（预测该日期所在的月份）
+            account_names: 预测的账号（没有该月状态的账号不包括在内）
+            confidence: 置信区间的置信水平
+
+        Returns:
+            MonthEndForecast 实例；没有任何账号有该月数据时返回None
+        """
+        month = month_number(day)
+        days_in_month = calendar.monthrange(day.year, day.month)[1]
+        accounts = self.accounts
+        codes = [self._account_codes.get(name) for name in account_names]
+        rows = [row for row, code in enumerate(codes) if code is not None
+                and accounts['month'][code] == month and accounts['n'][code] > 0]
+        if not rows:
+            return None
+        codes = np.array([codes[row] for row in rows], dtype=np.intp)
+
+        n, sx, sxx = accounts['n'][codes], accounts['sx'][codes], accounts['sxx'][codes]
+        sy, sxy, syy = accounts['sy'][codes], accounts['sxy'][codes], accounts['syy'][codes]
+        # 未统计的日期的天数和日期之和
+        remaining_days = days_in_month - n
+        remaining_x = days_in_month * (days_in_month + 1) / 2 - sx
+        x_mean = sx / n
+        centered_xx = sxx - sx * x_mean
+        trend = (n >= self.trend_days) & (centered_xx > 1e-9)
+        safe_xx = np.where(trend, centered_xx, 1.0)
+        offset = remaining_x - remaining_days * x_mean
+
+        centered_xy = sxy - sx * sy / n
+        slope = np.where(trend, centered_xy / safe_xx, 0.0)
+
+        # 残差方差和未统计日期合计的预测方差（包括回归参数的不确定性）
+        residual = np.maximum(syy - sy * sy / n - slope * centered_xy, 0.0)
+        dof = n - 1 - trend
+        sigma2 = residual / np.where(dof > 0, dof, 1)
+        variance = sigma2 * (remaining_days + remaining_days ** 2 / n + np.where(trend, offset ** 2 / safe_xx, 0.0))
+        std = np.where(n >= MIN_BAND_DAYS, np.sqrt(variance), np.nan)
+
+        # 服务的预测（与账号共用 n、Σx、Σx²），每个服务未统计日期的预测合计不低于0，账号的预测为其服务预测之和
+        row_of = np.full(len(self.account_names), -1, dtype=np.intp)
+        row_of[codes] = np.arange(len(codes))
+        series = self.series
+        selected = np.flatnonzero(row_of[series['account']] >= 0)
+        series_rows = row_of[series['account'][selected]]
+        series_sy = series['sy'][selected]
+        series_centered_xy = series['sxy'][selected] - sx[series_rows] * series_sy / n[series_rows]
+        series_slope = np.where(trend[series_rows], series_centered_xy / safe_xx[series_rows], 0.0)
+        series_remaining = np.maximum(
+            remaining_days[series_rows] * series_sy / n[series_rows] + series_slope * offset[series_rows], 0.0
+        )
+        service_codes, service_columns = np.unique(series['service'][selected], return_inverse=True)
+        shape = (len(codes), len(service_codes))
+        service_month_to_date = np.zeros(shape)
+        service_projected = np.zeros(shape)
+        np.add.at(service_month_to_date, (series_rows, service_columns), series_sy)
+        np.add.at(service_projected, (series_rows, service_columns), series_sy + series_remaining)
+        projected = sy + np.bincount(series_rows, weights=series_remaining, minlength=len(codes))
+
+        return MonthEndForecast(
+            datetime(day.year, day.month, 1), days_in_month, [account_names[row] for row in rows],
+            n.astype(int), sy, projected, std, confidence,
+            [self.service_names[code] for code in service_codes.tolist()], service_month_to_date, service_projected
+        )
+
+    def stats(self) -> Dict[str, int]:
+        """返回状态统计 {账号数, 序列数, 服务数}"""
+        return {
+            'accounts': int((self.accounts['month'] >= 0).sum()),
+            'series': len(self),
+            'services': len(np.unique(self.series['service'])),
+        }
+
+
+def main():
+    """月末预测状态管理命令：查看统计或重置"""
+    from config import FORECAST_STATE_PATH
+
+    parser = argparse.ArgumentParser(description='AWS账单月末预测状态管理')
+    parser.add_argument('--path', default=FORECAST_STATE_PATH, help='状态文件路径')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help='查看状态统计')
+    subparsers.add_parser('reset', help='删除状态文件（重新开始积累）')
+    args = parser.parse_args()
+
+    if args.command == 'reset':
+        if os.path.exists(args.path):
+            os.remove(args.path)
+        print(f"已删除月末预测状态: {args.path}")
+        return
+
+    model = ForecastModel(args.path)
+    stats = model.stats()
+    print(f"状态文件: {args.path}")
+    print(f"  账号数: {stats['accounts']}, 序列数: {stats['series']}, 服务数: {stats['services']}")
+    for code, name in enumerate(model.account_names):
+        month = int(model.accounts['month'][code])
+        if month >= 0:
+            print(f"  {name}: {month // 12}-{month % 12 + 1:02d} 已统计 {int(model.accounts['n'][code])} 天, "
+                  f"本月至今 ${model.accounts['sy'][code]:,.2f}")
+
+
+if __name__ == '__main__':
+    main()
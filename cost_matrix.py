@@ -0,0 +1,304 @@
+"""
+成本矩阵模块
+将所有账号的服务成本存放在 账号 × 服务 的稠密矩阵中，批量计算汇总、变化量、变化百分比、颜色和排序
+"""
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+# 颜色编码，与 ReportGenerator.calculate_change 的颜色一致
+COLORS = ('black', 'red', 'green')
+BLACK, RED, GREEN = 0, 1, 2
+
+
+class CostMatrix:
+    def __init__(self, account_names: List[str], service_names: List[str],
+                 current: np.ndarray, previous: np.ndarray,
+                 current_present: np.ndarray, previous_present: np.ndarray,
+                 extra_current: Dict[str, np.ndarray] = None):
+        """
+        初始化成本矩阵（通常通过 from_account_details 构建）
+
+        Args:
+            account_names: 账号名称列表，行索引
+            service_names: 服务名称列表，列索引
+            current: 当前周期成本矩阵，形状 (账号数, 服务数)
+            previous: 之前周期成本矩阵，形状 (账号数, 服务数)
+            current_present: 当前周期中该账号是否有该服务的数据（布尔矩阵）
+            previous_present: 之前周期中该账号是否有该服务的数据（布尔矩阵）
+            extra_current: 可选，附加指标（如 AmortizedCost）的当前周期矩阵 {指标名: 矩阵}，形状与 current 相同
+        """
+        self.account_names = account_names
+        self.service_names = service_names
+        self.current = current
+        self.previous = previous
+        self.current_present = current_present
+        self.previous_present = previous_present
+
+        # 批量计算汇总
+        self.current_totals = current.sum(axis=1)
+        self.previous_totals = previous.sum(axis=1)
+        self.service_current_totals = current.sum(axis=0)
+        self.service_previous_totals = previous.sum(axis=0)
+        self.current_total = float(self.current_totals.sum())
+        self.previous_total = float(self.previous_totals.sum())
+
+        # 批量计算每个账号每个服务的变化
+        self.change, self.change_percent, self.color = self.compute_changes(current, previous)
+        self.total_change, self.total_change_percent, self.total_color = self.compute_changes(
+            self.current_totals, self.previous_totals
+        )
+
+        # 附加指标只在报告中作为额外的列显示，不参与变化和排序
+        self.extra_current = extra_current or {}
+        self.extra_metrics = list(self.extra_current)
+        self.extra_totals = {metric: matrix.sum(axis=1) for metric, matrix in self.extra_current.items()}
+
+        # 每个账号内按当前周期费用从高到低排序（费用相同时保持服务首次出现的顺序）
+        self.order = np.argsort(-current, axis=1, kind='stable')
+
+    @classmethod
+    def from_account_details(cls, account_details: List[dict], extra_metrics: List[str] = ()) -> 'CostMatrix':
+        """
+        从账号明细列表构建矩阵
+
+        Args:
+            account_details: [{'account_name', 'yesterday_costs', 'day_before_costs', 'yesterday_metrics', ...}]
+            extra_metrics: 可选，从 yesterday_metrics 中读取的附加指标列表
+
+        Returns:
+            CostMatrix 实例
+        """
+        # 服务名称按首次出现的顺序编号
+        service_index: Dict[str, int] = {}
+        for acc_detail in account_details:
+            for service in acc_detail['yesterday_costs']:
+                service_index.setdefault(service, len(service_index))
+            for service in acc_detail['day_before_costs']:
+                service_index.setdefault(service, len(service_index))
+
+        shape = (len(account_details), len(service_index))
+        current = np.zeros(shape)
+        previous = np.zeros(shape)
+        current_present = np.zeros(shape, dtype=bool)
+        previous_present = np.zeros(shape, dtype=bool)
+
+        for row, acc_detail in enumerate(account_details):
+            costs = acc_detail['yesterday_costs']
+            if costs:
+                columns = [service_index[service] for service in costs]
+                current[row, columns] = list(costs.values())
+                current_present[row, columns] = True
+            costs = acc_detail['day_before_costs']
+            if costs:
+                columns = [service_index[service] for service in costs]
+                previous[row, columns] = list(costs.values())
+                previous_present[row, columns] = True
+
+        extra_current = {}
+        for metric in extra_metrics:
+            matrix = extra_current[metric] = np.zeros(shape)
+            for row, acc_detail in enumerate(account_details):
+                costs = acc_detail.get('yesterday_metrics', {}).get(metric)
+                if costs:
+                    items = [(service_index[service], amount) for service, amount in costs.items()
+                             if service in service_index]
+                    if items:
+                        columns, amounts = zip(*items)
+                        matrix[row, list(columns)] = amounts
+
+        return cls(
+            [acc_detail['account_name'] for acc_detail in account_details],
+            list(service_index),
+            current, previous, current_present, previous_present,
+            extra_current
+        )
+
+    @classmethod
+    def from_costs(cls, current_costs: Dict[str, float], previous_costs: Dict[str, float],
+                   account_name: str = '') -> 'CostMatrix':
+        """
+        从单个账号（或汇总）的服务成本字典构建一行的矩阵
+        """
+        return cls.from_account_details([{
+            'account_name': account_name,
+            'yesterday_costs': current_costs,
+            'day_before_costs': previous_costs
+        }])
+
+    def subset(self, rows: List[int]) -> 'CostMatrix':
+        """
+        按账号行选取子矩阵（例如某个团队负责的账号）
+
+        每行的成本、变化、颜色和排序直接复用已计算的结果，只重新汇总按服务和全部账号的合计。
+
+        Args:
+            rows: 账号行索引列表（按该顺序排列）
+
+        Returns:
+            新的 CostMatrix，服务列与原矩阵相同
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        matrix = CostMatrix.__new__(CostMatrix)
+        matrix.account_names = [self.account_names[row] for row in rows.tolist()]
+        matrix.service_names = self.service_names
+        for name in ('current', 'previous', 'current_present', 'previous_present',
+                     'current_totals', 'previous_totals', 'change', 'change_percent', 'color',
+                     'total_change', 'total_change_percent', 'total_color', 'order'):
+            setattr(matrix, name, getattr(self, name)[rows])
+        matrix.service_current_totals = matrix.current.sum(axis=0)
+        matrix.service_previous_totals = matrix.previous.sum(axis=0)
+        matrix.current_total = float(matrix.current_totals.sum())
+        matrix.previous_total = float(matrix.previous_totals.sum())
+        matrix.extra_current = {metric: values[rows] for metric, values in self.extra_current.items()}
+        matrix.extra_metrics = self.extra_metrics
+        matrix.extra_totals = {metric: totals[rows] for metric, totals in self.extra_totals.items()}
+        return matrix
+
+    @staticmethod
+    def compute_changes(current: np.ndarray, previous: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        批量计算变化量、变化百分比和颜色编码（规则与 ReportGenerator.calculate_change 相同）
+
+        Args:
+            current: 当前值数组
+            previous: 之前值数组（形状与 current 相同）
+
+        Returns:
+            (变化量, 变化百分比, 颜色编码)，之前值为0且当前值大于0时变化百分比为 inf
+        """
+        base_zero = previous == 0
+        grew_from_zero = base_zero & (current > 0)
+
+        change = np.where(base_zero, np.where(grew_from_zero, current, 0.0), current - previous)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change_percent = np.where(
+                base_zero,
+                np.where(grew_from_zero, np.inf, 0.0),
+                change / np.where(base_zero, 1.0, previous) * 100
+            )
+
+        color = np.full(current.shape, BLACK, dtype=np.int8)
+        color[change > 0] = RED
+        color[(change < 0) & ~base_zero] = GREEN
+        return change, change_percent, color
+
+    def service_cost_dicts(self) -> Tuple[Dict[str, float], Dict[str, float]]:
+        """
+        所有账号按服务汇总的成本字典（只包含在对应周期出现过的服务）
+
+        Returns:
+            (当前周期服务成本, 之前周期服务成本)
+        """
+        current_columns = np.flatnonzero(self.current_present.any(axis=0)).tolist()
+        previous_columns = np.flatnonzero(self.previous_present.any(axis=0)).tolist()
+        current_totals = self.service_current_totals.tolist()
+        previous_totals = self.service_previous_totals.tolist()
+        return (
+            {self.service_names[column]: current_totals[column] for column in current_columns},
+            {self.service_names[column]: previous_totals[column] for column in previous_columns}
+        )
+
+    def select_account_columns(self, row: int, top_n: int = None, drop_zero: bool = False,
+                               zero_threshold: float = 0.005) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        选择某个账号要显示的服务列（按当前周期费用从高到低）
+
+        Args:
+            row: 账号行索引
+            top_n: 只显示前N个服务，None表示全部显示
+            drop_zero: 是否去掉两个周期金额都显示为 $0.00 的服务
+            zero_threshold: 视为0的金额阈值
+
+        Returns:
+            (显示的服务列索引, 超出前N个的长尾服务列索引)
+        """
+        order = self.order[row]
+        order = order[(self.current_present[row] | self.previous_present[row])[order]]
+        if drop_zero:
+            nonzero = (
+                (np.abs(self.current[row, order]) >= zero_threshold)
+                | (np.abs(self.previous[row, order]) >= zero_threshold)
+            )
+            order = order[nonzero]
+        if top_n is not None and top_n >= 0:
+            return order[:top_n], order[top_n:]
+        return order, order[:0]
+
+    def iter_account_rows(self, row: int, columns: np.ndarray = None) -> Iterator[Tuple[str, float, float, float, float, str]]:
+        """
+        按当前周期费用从高到低返回某个账号的服务明细
+
+        Args:
+            row: 账号行索引
+            columns: 可选，要返回的服务列索引（默认该账号出现过的全部服务）
+
+        Yields:
+            (服务名, 当前成本, 之前成本, 变化量, 变化百分比, 颜色)
+        """
+        if columns is None:
+            columns, _ = self.select_account_columns(row)
+        service_names = self.service_names
+        rows = zip(
+            columns.tolist(),
+            self.current[row, columns].tolist(),
+            self.previous[row, columns].tolist(),
+            self.change[row, columns].tolist(),
+            self.change_percent[row, columns].tolist(),
+            self.color[row, columns].tolist()
+        )
+        for column, current, previous, change, change_percent, color in rows:
+            yield service_names[column], current, previous, change, change_percent, COLORS[color]
+
+    def columns_total(self, row: int, columns: np.ndarray) -> Tuple[float, float]:
+        """
+        某个账号若干服务列的成本合计
+
+        Returns:
+            (当前周期合计, 之前周期合计)
+        """
+        return float(self.current[row, columns].sum()), float(self.previous[row, columns].sum())
+
+    def extra_values(self, row: int, columns: np.ndarray) -> List[Tuple[float, ...]]:
+        """
+        某个账号若干服务列的附加指标（当前周期）
+
+        Returns:
+            与 columns 一一对应的列表，每项为按 extra_metrics 顺序排列的指标值元组
+        """
+        if not self.extra_metrics:
+            return [()] * len(columns)
+        return list(zip(*(self.extra_current[metric][row, columns].tolist() for metric in self.extra_metrics)))
+
+    def extra_columns_total(self, row: int, columns: np.ndarray) -> Tuple[float, ...]:
+        """
+        某个账号若干服务列的附加指标合计（按 extra_metrics 顺序）
+        """
+        return tuple(float(self.extra_current[metric][row, columns].sum()) for metric in self.extra_metrics)
+
+    def extra_account_totals(self, row: int) -> Tuple[float, ...]:
+        """
+        某个账号的附加指标合计（按 extra_metrics 顺序）
+        """
+        return tuple(float(self.extra_totals[metric][row]) for metric in self.extra_metrics)
+
+    def extra_grand_totals(self) -> Tuple[float, ...]:
+        """
+        所有账号的附加指标合计（按 extra_metrics 顺序）
+        """
+        return tuple(float(self.extra_totals[metric].sum()) for metric in self.extra_metrics)
+
+    def account_total_row(self, row: int) -> Tuple[float, float, float, float, str]:
+        """
+        某个账号的总成本和变化
+
+        Returns:
+            (当前总成本, 之前总成本, 变化量, 变化百分比, 颜色)
+        """
+        return (
+            float(self.current_totals[row]),
+            float(self.previous_totals[row]),
+            float(self.total_change[row]),
+            float(self.total_change_percent[row]),
+            COLORS[self.total_color[row]]
+        )
@@ -0,0 +1,246 @@
+"""
+成本下钻模块
+按多级分组（例如 服务 → 使用类型 → 成本分配标签）汇总两个周期的成本，保存为紧凑的汇总树：
+添加叶子分组时同时累加所有上级节点的合计，上级节点的金额始终等于其所有子项之和；
+叶子分组只追加到定长数组中（不为每个叶子创建对象或字典项），几十万个叶子分组也只占用几MB内存。
+报告中每一级只显示金额变化最大的前K项，其余合并为一行
+"""
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 根节点编号
+ROOT = 0
+
+# 子项: (名称, 当前周期成本, 上一周期成本, 节点编号)，节点编号为None表示叶子（不能继续下钻）
+Child = Tuple[str, float, float, Optional[int]]
+
+# 标签值为空（资源没有该标签）时显示的名称
+UNTAGGED = '(无标签)'
+
+
+def group_label(level: str, key: str) -> str:
+    """
+    Cost Explorer 返回的分组键转换为显示名称（标签分组的键为 "<标签键>$<标签值>"，只保留标签值）
+    """
+    if level.startswith('TAG:'):
+        return key.partition('$')[2] or UNTAGGED
+    return key
+
+
+class RollupTree:
+    def __init__(self, levels: Sequence[str]):
+        """
+        初始化空的汇总树
+
+        Args:
+            levels: 每一级的分组名称，例如 ['SERVICE', 'USAGE_TYPE']，最后一级为叶子
+        """
+        if not levels:
+            raise ValueError("汇总树至少需要一级分组")
+        self.levels = list(levels)
+
+        # 名称表：所有级别共用，节点和叶子只保存名称编号
+        self.names: List[str] = []
+        self._name_codes: Dict[str, int] = {}
+
+        # 内部节点（根节点和最后一级之前的分组）：父节点、名称编号和两个周期的合计
+        self._node_parent = array('i', [-1])
+        self._node_name = array('i', [-1])
+        self._node_current = array('d', [0.0])
+        self._node_previous = array('d', [0.0])
+        self._node_index: Dict[Tuple[int, int], int] = {}
+        # 最近一次添加的上级路径和对应的节点编号（从根节点开始）
+        self._last_prefix: Optional[Tuple[str, ...]] = None
+        self._last_chain: List[int] = []
+
+        # 叶子：逐条追加，同一个叶子可以出现多次（例如两个周期分别添加），compact 时合并
+        self._leaf_parent = array('i')
+        self._leaf_name = array('i')
+        self._leaf_current = array('d')
+        self._leaf_previous = array('d')
+
+        # compact 后每个节点的叶子在叶子数组中的范围，以及每个节点的内部子节点；添加新数据后重新计算
+        self._leaf_offsets: Optional[np.ndarray] = None
+        self._node_children: Dict[int, List[int]] = {}
+
+    def _code(self, name: str) -> int:
+        """名称在名称表中的编号（不存在时追加）"""
+        code = self._name_codes.get(name)
+        if code is None:
+            code = self._name_codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def add(self, path: Sequence[str], current: float = 0.0, previous: float = 0.0):
+        """
+        添加一个叶子分组的成本，同时累加路径上所有上级节点（包括根节点）的合计
+
+        Args:
+            path: 每一级的分组名称，长度与 levels 相同，例如 ('Amazon EC2', 'BoxUsage:m5.large')
+            current: 当前周期成本
+            previous: 上一周期成本
+        """
+        if len(path) != len(self.levels):
+            raise ValueError(f"分组路径应为 {len(self.levels)} 级: {path}")
+        # Cost Explorer 的结果通常按上级分组连续返回，上级路径与上一次相同时直接复用
+        prefix = tuple(path[:-1])
+        if prefix != self._last_prefix:
+            self._last_prefix, self._last_chain = prefix, self._chain(prefix)
+        for node in self._last_chain:
+            self._node_current[node] += current
+            self._node_previous[node] += previous
+
+        self._leaf_parent.append(self._last_chain[-1])
+        self._leaf_name.append(self._code(path[-1]))
+        self._leaf_current.append(current)
+        self._leaf_previous.append(previous)
+        self._leaf_offsets = None
+
+    def _chain(self, prefix: Tuple[str, ...]) -> List[int]:
+        """从根节点到上级路径最后一级的节点编号列表（不存在的节点依次创建）"""
+        chain = [ROOT]
+        for name in prefix:
+            key = (chain[-1], self._code(name))
+            child = self._node_index.get(key)
+            if child is None:
+                child = self._node_index[key] = len(self._node_parent)
+                self._node_parent.append(key[0])
+                self._node_name.append(key[1])
+                self._node_current.append(0.0)
+                self._node_previous.append(0.0)
+            chain.append(child)
+        return chain
+
+    def compact(self):
+        """
+        合并重复的叶子并按父节点排序（每个节点的叶子在数组中连续），建立子项索引
+
+        添加数据后第一次读取子项时自动调用；合并后的叶子数组替换原数组，重复添加的叶子不再占用内存。
+        """
+        if self._leaf_offsets is not None:
+            return
+        parents = np.frombuffer(self._leaf_parent, dtype=np.int32).astype(np.int64)
+        names = np.frombuffer(self._leaf_name, dtype=np.int32).astype(np.int64)
+        keys, inverse = np.unique(parents * max(len(self.names), 1) + names, return_inverse=True)
+        current = np.bincount(inverse, weights=np.frombuffer(self._leaf_current), minlength=len(keys))
+        previous = np.bincount(inverse, weights=np.frombuffer(self._leaf_previous), minlength=len(keys))
+        parents, names = np.divmod(keys, max(len(self.names), 1))
+
+        self._leaf_parent = self._array('i', parents.astype(np.int32))
+        self._leaf_name = self._array('i', names.astype(np.int32))
+        self._leaf_current = self._array('d', current)
+        self._leaf_previous = self._array('d', previous)
+        self._leaf_offsets = np.searchsorted(parents, np.arange(len(self._node_parent) + 1))
+
+        self._node_children = {}
+        for node in range(1, len(self._node_parent)):
+            self._node_children.setdefault(self._node_parent[node], []).append(node)
+
+    @staticmethod
+    def _array(typecode: str, values: np.ndarray) -> array:
+        """numpy 数组复制为 array.array（可以继续追加）"""
+        result = array(typecode)
+        result.frombytes(values.tobytes())
+        return result
+
+    def __len__(self) -> int:
+        """叶子分组数（合并重复的叶子后）"""
+        self.compact()
+        return len(self._leaf_parent)
+
+    def totals(self, node: int = ROOT) -> Tuple[float, float]:
+        """节点的 (当前周期合计, 上一周期合计)"""
+        return self._node_current[node], self._node_previous[node]
+
+    def find(self, path: Sequence[str]) -> Optional[int]:
+        """
+        按分组名称查找内部节点，例如 find(['Amazon EC2']) 为该服务的节点
+
+        Returns:
+            节点编号；路径不存在（或指向叶子）时返回None
+        """
+        node = ROOT
+        for name in path:
+            code = self._name_codes.get(name)
+            node = None if code is None else self._node_index.get((node, code))
+            if node is None:
+                return None
+        return node
+
+    def top_children(self, node: int = ROOT, k: int = 5) -> Tuple[List[Child], Tuple[int, float, float]]:
+        """
+        节点下金额变化（绝对值）最大的前K个子项，变化相同时按当前周期成本排序
+
+        只对前K项排序（np.argpartition），子项很多时也只需线性时间。
+
+        Args:
+            node: 节点编号
+            k: 子项数，0 表示全部
+
+        Returns:
+            (子项列表, (其余子项数, 其余子项的当前周期合计, 上一周期合计))
+        """
+        self.compact()
+        internal = node in self._node_children
+        if internal:
+            nodes = np.array(self._node_children[node])
+            names = np.frombuffer(self._node_name, dtype=np.int32)[nodes]
+            current = np.frombuffer(self._node_current)[nodes]
+            previous = np.frombuffer(self._node_previous)[nodes]
+        else:
+            start, end = self._leaf_offsets[node], self._leaf_offsets[node + 1]
+            names = np.frombuffer(self._leaf_name, dtype=np.int32)[start:end]
+            current = np.frombuffer(self._leaf_current)[start:end]
+            previous = np.frombuffer(self._leaf_previous)[start:end]
+
+        change = np.abs(current - previous)
+        selected = np.arange(len(names))
+        if k and k < len(selected):
+            selected = np.argpartition(-change, k - 1)[:k]
+        selected = selected[np.lexsort((-current[selected], -change[selected]))]
+
+        children = [
+            (self.names[names[index]], float(current[index]), float(previous[index]),
+             int(nodes[index]) if internal else None)
+            for index in selected.tolist()
+        ]
+        rest = np.ones(len(names), dtype=bool)
+        rest[selected] = False
+        return children, (int(rest.sum()), float(current[rest].sum()), float(previous[rest].sum()))
+
+    def to_dict(self) -> dict:
+        """转换为可JSON序列化的字典（按列保存，用于 fetch 命令输出的JSON）"""
+        self.compact()
+        return {
+            'levels': self.levels,
+            'names': self.names,
+            'nodes': [
+                self._node_parent.tolist(), self._node_name.tolist(),
+                self._node_current.tolist(), self._node_previous.tolist()
+            ],
+            'leaves': [
+                self._leaf_parent.tolist(), self._leaf_name.tolist(),
+                self._leaf_current.tolist(), self._leaf_previous.tolist()
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'RollupTree':
+        """从 to_dict 的结果恢复"""
+        tree = cls(data['levels'])
+        tree.names = list(data['names'])
+        tree._name_codes = {name: code for code, name in enumerate(tree.names)}
+        parents, names, current, previous = data['nodes']
+        tree._node_parent = array('i', parents)
+        tree._node_name = array('i', names)
+        tree._node_current = array('d', current)
+        tree._node_previous = array('d', previous)
+        tree._node_index = {(parents[node], names[node]): node for node in range(1, len(parents))}
+        parents, names, current, previous = data['leaves']
+        tree._leaf_parent = array('i', parents)
+        tree._leaf_name = array('i', names)
+        tree._leaf_current = array('d', current)
+        tree._leaf_previous = array('d', previous)
+        return tree
@@ -0,0 +1,273 @@
+"""
+成本趋势模块
+从本地缓存的日数据批量构建 账号 × 服务 × 天 的三维数组，向量化计算每个序列的迷你走势图、
+7日移动平均和周环比，不额外调用 Cost Explorer API；数千个账号-服务序列也只需要几次数组运算
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from cost_cache import GROUP_KEY_SEPARATOR
+from cost_matrix import COLORS, CostMatrix
+
+# 迷你走势图的字符（从低到高），没有缓存数据的日期显示为空格
+SPARK_CHARS = '▁▂▃▄▅▆▇█'
+SPARK_GAP = ' '
+
+# 移动平均窗口（天），周环比为最近一个窗口与之前一个窗口的平均值比较
+WINDOW = 7
+
+
+def sparklines(values: np.ndarray, observed: np.ndarray) -> np.ndarray:
+    """
+    批量生成迷你走势图（每个序列按自身的最小值和最大值缩放到8级）
+
+    Args:
+        values: 形状 (序列数, 天数) 的金额
+        observed: 形状相同的布尔数组，该天是否有缓存数据
+
+    Returns:
+        形状 (序列数,) 的字符串数组
+    """
+    count, days = values.shape
+    if not count or not days:
+        return np.full(count, '', dtype='<U1')
+    low = np.where(observed, values, np.inf).min(axis=1, keepdims=True)
+    high = np.where(observed, values, -np.inf).max(axis=1, keepdims=True)
+    span = high - low
+    with np.errstate(invalid='ignore'):
+        scaled = np.where(span > 0, (values - low) / np.where(span > 0, span, 1.0), 0.0)
+    levels = np.clip((scaled * len(SPARK_CHARS)).astype(np.intp), 0, len(SPARK_CHARS) - 1)
+    codes = np.array([ord(char) for char in SPARK_CHARS], dtype='<u4')[levels]
+    codes[~observed] = ord(SPARK_GAP)
+    # 每行 days 个 UTF-32 码点，直接按定长字符串解释，不逐个拼接
+    return np.ascontiguousarray(codes).view(f'<U{days}').reshape(count)
+
+
+def rolling_means(values: np.ndarray, observed: np.ndarray, window: int) -> np.ndarray:
+    """
+    批量计算移动平均（只对窗口内有数据的日期取平均，窗口内没有数据时为 nan）
+
+    Args:
+        values: 形状 (序列数, 天数) 的金额
+        observed: 形状相同的布尔数组
+        window: 窗口天数
+
+    Returns:
+        形状 (序列数, 天数) 的移动平均
+    """
+    count, days = values.shape
+    sums = np.zeros((count, days + 1))
+    counts = np.zeros((count, days + 1))
+    np.cumsum(np.where(observed, values, 0.0), axis=1, out=sums[:, 1:])
+    np.cumsum(observed, axis=1, out=counts[:, 1:])
+    start = np.maximum(np.arange(1, days + 1) - window, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums[:, 1:] - sums[:, start]) / (counts[:, 1:] - counts[:, start])
+
+
+def trend_stats(values: np.ndarray, observed: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    批量计算一组序列的走势图、最近一天金额、7日平均和周环比
+
+    Args:
+        values: 形状 (..., 天数) 的金额
+        observed: 可以广播到 values 形状的布尔数组
+
+    Returns:
+        {'spark', 'latest', 'average', 'change', 'change_percent', 'color'}，形状为 values.shape[:-1]；
+        最近一天没有数据时 latest 为 nan
+    """
+    shape, days = values.shape[:-1], values.shape[-1]
+    values = values.reshape(-1, days)
+    observed = np.broadcast_to(observed, shape + (days,)).reshape(-1, days)
+
+    means = np.nan_to_num(rolling_means(values, observed, WINDOW))
+    current = means[:, -1] if days else np.zeros(len(values))
+    previous = means[:, -1 - WINDOW] if days > WINDOW else np.zeros(len(values))
+    change, change_percent, color = CostMatrix.compute_changes(current, previous)
+    latest = np.where(observed[:, -1], values[:, -1], np.nan) if days else np.full(len(values), np.nan)
+
+    stats = {
+        'spark': sparklines(values, observed),
+        'latest': latest,
+        'average': current,
+        'change': change,
+        'change_percent': change_percent,
+        'color': color,
+    }
+    return {name: array.reshape(shape) for name, array in stats.items()}
+
+
+class CostTrends:
+    def __init__(self, dates: List[datetime], account_names: List[str], service_names: List[str],
+                 daily: np.ndarray, observed: np.ndarray):
+        """
+        初始化成本趋势（通常通过 from_cache 构建），所有统计在构建时批量计算
+
+        Args:
+            dates: 日期列表（按时间顺序）
+            account_names: 账号名称列表
+            service_names: 服务名称列表
+            daily: 每天的服务成本，形状 (账号数, 服务数, 天数)
+            observed: 每个账号每天是否有缓存数据（布尔），形状 (账号数, 天数)
+        """
+        self.dates = dates
+        self.account_names = account_names
+        self.service_names = service_names
+        self.daily = daily
+        self.observed = observed
+        self.account_index = {name: row for row, name in enumerate(account_names)}
+        self.service_index = {name: column for column, name in enumerate(service_names)}
+
+        any_observed = observed.any(axis=0)
+        self.cells = trend_stats(daily, observed[:, None, :])
+        self.accounts = trend_stats(daily.sum(axis=1), observed)
+        self.services = trend_stats(daily.sum(axis=0), any_observed)
+        self.total = trend_stats(daily.sum(axis=(0, 1))[None, :], any_observed)
+        # 服务在整个时间段内的合计，用于选出费用最高的服务
+        self.service_sums = daily.sum(axis=(0, 2))
+
+    @classmethod
+    def from_entries(cls, dates: List[datetime], account_names: List[str], periods: Iterable[Tuple[int, str]],
+                     entries: Iterable[Tuple[int, str, str, float]]) -> 'CostTrends':
+        """
+        从逐条的日数据构建
+
+        Args:
+            dates: 日期列表（连续，按时间顺序）
+            account_names: 账号名称列表
+            periods: [(账号行, 日期YYYY-MM-DD)] 有数据的日期（包括没有费用的日期）
+            entries: [(账号行, 日期YYYY-MM-DD, 服务名, 金额)]
+
+        Returns:
+            CostTrends 实例
+        """
+        day_index = {date.strftime('%Y-%m-%d'): column for column, date in enumerate(dates)}
+        observed = np.zeros((len(account_names), len(dates)), dtype=bool)
+        for row, day in periods:
+            observed[row, day_index[day]] = True
+
+        service_index: Dict[str, int] = {}
+        rows, columns, days, amounts = [], [], [], []
+        for row, day, service, amount in entries:
+            rows.append(row)
+            columns.append(service_index.setdefault(service, len(service_index)))
+            days.append(day_index[day])
+            amounts.append(amount)
+
+        # 换算为扁平索引后用 bincount 一次累加（同一天同一服务的多条记录会合并）
+        shape = (len(account_names), len(service_index), len(dates))
+        daily = np.zeros(shape)
+        if amounts:
+            flat = np.ravel_multi_index((np.array(rows), np.array(columns), np.array(days)), shape)
+            daily = np.bincount(flat, weights=np.array(amounts), minlength=daily.size).reshape(shape)
+        return cls(dates, account_names, list(service_index), daily, observed)
+
+    @classmethod
+    def from_cache(cls, cost_cache, account_details: List[dict], end_date: datetime, days: int,
+                   metric: str) -> Optional['CostTrends']:
+        """
+        从本地缓存读取截至 end_date（包含）的 days 天日数据构建趋势（一次批量查询）
+
+        Args:
+            cost_cache: CostCache 实例
+            account_details: 账号明细列表，cache_account 为缓存账号键（默认 account_name），
+                整合账单模式下 account_id 为缓存分组键中的关联账号ID
+            end_date: 最后一天
+            days: 天数
+            metric: 指标名
+
+        Returns:
+            CostTrends 实例；缓存中没有任何一天的数据时返回None
+        """
+        end_date = datetime(end_date.year, end_date.month, end_date.day)
+        dates = [end_date - timedelta(days=offset) for offset in range(days - 1, -1, -1)]
+
+        # 缓存账号键 -> {关联账号ID（逐账号查询时为None）: 账号行}
+        sources: Dict[str, Dict[Optional[str], int]] = {}
+        for row, acc_detail in enumerate(account_details):
+            cache_account = acc_detail.get('cache_account', acc_detail['account_name'])
+            sources.setdefault(cache_account, {})[acc_detail.get('account_id')] = row
+
+        periods, entries = cost_cache.get_daily_history(
+            list(sources), dates[0].strftime('%Y-%m-%d'), (end_date + timedelta(days=1)).strftime('%Y-%m-%d'), metric
+        )
+        if not periods:
+            return None
+
+        observed_days = [
+            (row, day) for cache_account, day in periods for row in sources[cache_account].values()
+        ]
+        daily_entries = []
+        for cache_account, day, key, amount in entries:
+            rows = sources[cache_account]
+            if None in rows:
+                daily_entries.append((rows[None], day, key, amount))
+                continue
+            # 整合账单模式的分组键为 "<关联账号ID>\t<服务名>"
+            account_id, _, service = key.partition(GROUP_KEY_SEPARATOR)
+            if account_id in rows:
+                daily_entries.append((rows[account_id], day, service, amount))
+
+        account_names = [acc_detail['account_name'] for acc_detail in account_details]
+        return cls.from_entries(dates, account_names, observed_days, daily_entries)
+
+    def subset(self, account_names: List[str]) -> 'CostTrends':
+        """
+        只保留指定账号（例如报告路由负责的账号），服务和全部账号的合计按这些账号重新计算
+        """
+        rows = [self.account_index[name] for name in account_names if name in self.account_index]
+        return CostTrends(
+            self.dates, [self.account_names[row] for row in rows], self.service_names,
+            self.daily[rows], self.observed[rows]
+        )
+
+    @staticmethod
+    def _row(stats: Dict[str, np.ndarray], index) -> Tuple[str, float, float, float, float, str]:
+        """读取一个序列的 (走势图, 最近一天金额, 7日平均, 周环比变化量, 周环比百分比, 颜色)"""
+        return (
+            str(stats['spark'][index]),
+            float(stats['latest'][index]),
+            float(stats['average'][index]),
+            float(stats['change'][index]),
+            float(stats['change_percent'][index]),
+            COLORS[stats['color'][index]]
+        )
+
+    def account(self, account_name: str) -> Optional[Tuple[str, float, float, float, float, str]]:
+        """账号总成本的趋势，账号没有趋势数据时返回None"""
+        row = self.account_index.get(account_name)
+        return None if row is None else self._row(self.accounts, row)
+
+    def service(self, service: str) -> Optional[Tuple[str, float, float, float, float, str]]:
+        """所有账号某个服务的趋势"""
+        column = self.service_index.get(service)
+        return None if column is None else self._row(self.services, column)
+
+    def cell(self, account_name: str, service: str) -> Optional[Tuple[str, float, float, float, float, str]]:
+        """某个账号某个服务的趋势"""
+        row = self.account_index.get(account_name)
+        column = self.service_index.get(service)
+        if row is None or column is None:
+            return None
+        return self._row(self.cells, (row, column))
+
+    def combined(self, account_name: str, services: List[str]) -> Optional[Tuple[str, float, float, float, float, str]]:
+        """某个账号多个服务合计的趋势（例如合并的长尾服务）"""
+        row = self.account_index.get(account_name)
+        if row is None:
+            return None
+        columns = [self.service_index[service] for service in services if service in self.service_index]
+        values = self.daily[row, columns].sum(axis=0)[None, :]
+        return self._row(trend_stats(values, self.observed[row]), 0)
+
+    def grand_total(self) -> Tuple[str, float, float, float, float, str]:
+        """所有账号总成本的趋势"""
+        return self._row(self.total, 0)
+
+    def top_services(self, count: int) -> List[str]:
+        """整个时间段内合计费用最高的服务"""
+        order = np.argsort(-self.service_sums, kind='stable')[:count]
+        return [self.service_names[column] for column in order.tolist()]
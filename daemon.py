@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+守护进程模式
+常驻运行，按UTC时间自动发送日报表和月报表（日期计算与 main.py 相同），
+在多次运行之间复用已导入的模块、Cost Explorer 客户端和本地成本缓存，避免每次冷启动。
+
+信号:
+    SIGHUP           重新加载 accounts.json（或 AWS_ACCOUNTS）和报告路由
+    SIGTERM / SIGINT 当前报告完成后退出
+
+运行方式:
+    python daemon.py
+    python daemon.py --run-now daily    # 启动后立即运行一次日报表，之后按计划运行
+"""
+import argparse
+import signal
+import sys
+import threading
+import traceback
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from dateutil import tz
+
+import main as report_main
+from aws_cost_explorer import ClientCache
+from config import (
+    get_aws_accounts,
+    get_report_routes,
+    COST_CACHE_ENABLED,
+    COST_CACHE_PATH,
+    COST_CACHE_FINAL_LAG_DAYS,
+    CE_MAX_POOL_CONNECTIONS,
+    DAEMON_REPORTS,
+    DAEMON_RUN_AT,
+    DAEMON_MONTHLY_DAY
+)
+from cost_cache import CostCache
+
+REPORT_TYPES = ('daily', 'monthly')
+
+# 单次休眠的上限（秒），系统时间调整或休眠唤醒后能及时重新计算下次运行时间
+MAX_SLEEP_SECONDS = 300
+
+
+def parse_time_of_day(value: str) -> Tuple[int, int]:
+    """
+    解析 HH:MM 格式的时间
+
+    Raises:
+        ValueError: 格式错误
+    """
+    try:
+        hour, minute = (int(part) for part in value.split(':'))
+    except ValueError:
+        raise ValueError(f"时间格式错误: {value}，应为 HH:MM")
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"时间格式错误: {value}，应为 HH:MM")
+    return hour, minute
+
+
+def next_run_time(report_type: str, after: datetime, run_at: Tuple[int, int], monthly_day: int) -> datetime:
+    """
+    计算某类报表在 after 之后的下一次运行时间（UTC）
+
+    Args:
+        report_type: 'daily' 或 'monthly'
+        after: 起始时间（带UTC时区），返回的时间严格晚于该时间
+        run_at: 每天的运行时间 (时, 分)
+        monthly_day: 月报表在每月几号运行（1~28）
+
+    Returns:
+        下一次运行时间
+    """
+    hour, minute = run_at
+    if report_type == 'monthly':
+        candidate = after.replace(day=monthly_day, hour=hour, minute=minute, second=0, microsecond=0)
+        if candidate <= after:
+            month_start = (after.replace(day=1) + timedelta(days=32)).replace(day=1)
+            candidate = month_start.replace(day=monthly_day, hour=hour, minute=minute, second=0, microsecond=0)
+        return candidate
+    candidate = after.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if candidate <= after:
+        candidate += timedelta(days=1)
+    return candidate
+
+
+class WarmState:
+    def __init__(self):
+        """
+        守护进程在多次运行之间保持的状态：账号和路由配置、Cost Explorer 客户端缓存和本地成本缓存
+        """
+        self.aws_accounts: List[dict] = []
+        self.report_routes: List[dict] = []
+        self.client_cache = ClientCache(CE_MAX_POOL_CONNECTIONS)
+        self.cost_cache = CostCache(COST_CACHE_PATH, COST_CACHE_FINAL_LAG_DAYS) if COST_CACHE_ENABLED else None
+
+    def reload(self):
+        """
+        重新加载账号配置和报告路由，释放不再使用的客户端
+
+        新的账号配置为空（例如文件正在编辑、JSON格式错误）时继续使用之前的账号配置。
+        """
+        aws_accounts = get_aws_accounts()
+        if not aws_accounts and self.aws_accounts:
+            print(f"警告: 重新加载后没有可用的账号配置，继续使用之前的 {len(self.aws_accounts)} 个账号")
+            return
+        self.aws_accounts = aws_accounts
+        self.report_routes = get_report_routes()
+        released = self.client_cache.retain(aws_accounts)
+        print(f"已加载 {len(self.aws_accounts)} 个AWS账号, {len(self.report_routes)} 个报告路由"
+              + (f", 释放 {released} 个不再使用的客户端" if released else ''))
+
+    def close(self):
+        """关闭共享的连接池和本地成本缓存"""
+        self.client_cache.close()
+        if self.cost_cache is not None:
+            self.cost_cache.close()
+
+
+class ReportDaemon:
+    def __init__(self, report_types: List[str], run_at: Tuple[int, int], monthly_day: int):
+        """
+        初始化守护进程
+
+        Args:
+            report_types: 自动发送的报表类型列表
+            run_at: 每天的运行时间 (时, 分)，UTC
+            monthly_day: 月报表在每月几号运行
+        """
+        self.report_types = report_types
+        self.run_at = run_at
+        self.monthly_day = monthly_day
+        self.utc = tz.gettz('UTC')
+        self.warm = WarmState()
+
+        self._wake = threading.Event()
+        self._reload_requested = False
+        self._stop_requested = False
+
+    def install_signal_handlers(self):
+        """注册 SIGHUP（重新加载）和 SIGTERM/SIGINT（退出）处理函数"""
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+
+    def _on_reload(self, signum, frame):
+        self._reload_requested = True
+        self._wake.set()
+
+    def _on_stop(self, signum, frame):
+        self._stop_requested = True
+        self._wake.set()
+
+    def run_report(self, report_type: str, scheduled_at: datetime) -> bool:
+        """
+        运行一次报告（失败不会退出守护进程）
+
+        Args:
+            report_type: 报表类型
+            scheduled_at: 计划运行时间，报表日期按该时间计算
+
+        Returns:
+            是否成功生成并发送
+        """
+        print(f"\n[守护进程] 开始运行 {report_type} 报表（计划时间 {scheduled_at.strftime('%Y-%m-%d %H:%M')} UTC）")
+        try:
+            report_main.main(report_type, now=scheduled_at, warm=self.warm)
+            return True
+        except SystemExit as e:
+            # run_report 在配置错误或发送失败时调用 sys.exit(1)
+            if e.code in (None, 0):
+                return True
+            print(f"[守护进程] {report_type} 报表运行失败（退出码 {e.code}），等待下次计划运行")
+        except Exception as e:
+            print(f"[守护进程] {report_type} 报表运行出错: {str(e)}")
+            traceback.print_exc()
+        return False
+
+    def run_forever(self, run_now: List[str] = None):
+        """
+        按计划循环运行，直到收到 SIGTERM/SIGINT
+
+        Args:
+            run_now: 启动后立即运行一次的报表类型列表
+        """
+        self.warm.reload()
+        now = datetime.now(self.utc)
+        for report_type in run_now or []:
+            self.run_report(report_type, now)
+
+        next_runs: Dict[str, datetime] = {
+            report_type: next_run_time(report_type, datetime.now(self.utc), self.run_at, self.monthly_day)
+            for report_type in self.report_types
+        }
+        for report_type, due in next_runs.items():
+            print(f"[守护进程] {report_type} 报表下次运行: {due.strftime('%Y-%m-%d %H:%M')} UTC")
+
+        try:
+            while not self._stop_requested:
+                if self._reload_requested:
+                    self._reload_requested = False
+                    print("[守护进程] 收到 SIGHUP，重新加载配置")
+                    self.warm.reload()
+
+                report_type, due = min(next_runs.items(), key=lambda item: item[1])
+                delay = (due - datetime.now(self.utc)).total_seconds()
+                if delay > 0:
+                    self._wake.wait(min(delay, MAX_SLEEP_SECONDS))
+                    self._wake.clear()
+                    continue
+
+                self.run_report(report_type, due)
+                # 运行时间超过计划间隔时跳过错过的时间点，不补发
+                next_runs[report_type] = next_run_time(
+                    report_type, max(due, datetime.now(self.utc)), self.run_at, self.monthly_day
+                )
+                print(f"[守护进程] {report_type} 报表下次运行: {next_runs[report_type].strftime('%Y-%m-%d %H:%M')} UTC")
+        finally:
+            self.warm.close()
+        print("[守护进程] 已退出")
+
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='AWS账单报告守护进程')
+    parser.add_argument('--run-now', choices=REPORT_TYPES, action='append', default=[],
+                        help='启动后立即运行一次该报表（可重复指定）')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """启动守护进程"""
+    args = parse_args(argv)
+
+    report_types = [report_type for report_type in DAEMON_REPORTS if report_type in REPORT_TYPES]
+    if len(report_types) < len(DAEMON_REPORTS):
+        print(f"警告: DAEMON_REPORTS 中只支持 {', '.join(REPORT_TYPES)}，其余已忽略")
+    if not report_types:
+        print("错误: 请配置 DAEMON_REPORTS（daily、monthly）")
+        sys.exit(1)
+    if not 1 <= DAEMON_MONTHLY_DAY <= 28:
+        print("错误: DAEMON_MONTHLY_DAY 应在 1~28 之间")
+        sys.exit(1)
+    try:
+        run_at = parse_time_of_day(DAEMON_RUN_AT)
+    except ValueError as e:
+        print(f"错误: DAEMON_RUN_AT {str(e)}")
+        sys.exit(1)
+
+    daemon = ReportDaemon(report_types, run_at, DAEMON_MONTHLY_DAY)
+    daemon.install_signal_handlers()
+    print(f"守护进程已启动: {', '.join(report_types)} 报表，每天 {DAEMON_RUN_AT} UTC 运行"
+          + (f"（月报表每月 {DAEMON_MONTHLY_DAY} 号）" if 'monthly' in report_types else ''))
+    daemon.run_forever(args.run_now)
+
+
+if __name__ == '__main__':
+    main()
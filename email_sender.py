@@ -1,15 +1,189 @@
 """
 邮件发送模块
 """
+import os
 import smtplib
+from email.mime.application import MIMEApplication
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.header import Header
-from typing import List
+from typing import List, Tuple
+
+# SMTP连接超时时间（秒），某些SMTP服务器响应较慢
+SMTP_TIMEOUT = 60
+
+# 连接被服务器断开时可以重连后重试的错误（此时邮件尚未被服务器接受）
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError)
+
+
+class DeliveryResult:
+    def __init__(self, subject: str, recipients: List[str], delivered: bool, error: Exception = None,
+                 size: int = 0):
+        """
+        单封邮件的发送结果
+        
+        Args:
+            subject: 邮件主题
+            recipients: 收件人和抄送人地址列表
+            delivered: 服务器是否已接受该邮件
+            error: 发送失败时的异常
+            size: 邮件大小（字节）
+        """
+        self.subject = subject
+        self.recipients = recipients
+        self.delivered = delivered
+        self.error = error
+        self.size = size
+
+
+class SMTPSession:
+    def __init__(self, sender: 'EmailSender'):
+        """
+        SMTP会话：在多封邮件之间复用同一个已登录的连接
+        
+        通常通过 EmailSender.session() 以上下文管理器的方式使用：
+            
+            with email_sender.session() as session:
+                results = session.send_batch(messages)
+        
+        连接在第一次发送时建立，服务器断开连接时自动重连并重试当前邮件。
+        
+        Args:
+            sender: 提供SMTP服务器和登录配置的 EmailSender
+        """
+        self.sender = sender
+        self.server = None
+        # 登录次数（包括重连）
+        self.logins = 0
+        # 认证失败后不再重复登录（避免触发服务器的登录频率限制）
+        self._auth_error = None
+    
+    def __enter__(self) -> 'SMTPSession':
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def connect(self):
+        """建立连接并登录（根据配置选择SSL或STARTTLS）"""
+        sender = self.sender
+        if sender.use_ssl:
+            # 使用SSL连接（端口465）
+            print(f"使用SSL连接 {sender.smtp_server}:{sender.smtp_port}")
+            server = smtplib.SMTP_SSL(sender.smtp_server, sender.smtp_port, timeout=SMTP_TIMEOUT)
+        elif sender.starttls:
+            # 使用STARTTLS连接（端口587或其他）
+            print(f"使用STARTTLS连接 {sender.smtp_server}:{sender.smtp_port}")
+            server = smtplib.SMTP(sender.smtp_server, sender.smtp_port, timeout=SMTP_TIMEOUT)
+        else:
+            # 不加密的SMTP连接（仅用于内网中继或本地测试）
+            print(f"使用SMTP连接（未加密） {sender.smtp_server}:{sender.smtp_port}")
+            server = smtplib.SMTP(sender.smtp_server, sender.smtp_port, timeout=SMTP_TIMEOUT)
+        try:
+            if not sender.use_ssl and sender.starttls:
+                server.starttls()
+            server.login(sender.username, sender.password)
+        except Exception:
+            self._discard(server)
+            raise
+        self.server = server
+        self.logins += 1
+    
+    def close(self):
+        """退出并关闭连接（忽略关闭时的错误，已发送的邮件不受影响）"""
+        if self.server is not None:
+            server, self.server = self.server, None
+            try:
+                server.quit()
+            except Exception:
+                pass
+            self._discard(server)
+    
+    @staticmethod
+    def _discard(server):
+        """直接关闭底层连接，忽略错误"""
+        try:
+            server.close()
+        except Exception:
+            pass
+    
+    def send_message(self, msg: MIMEMultipart, from_addr: str, recipients: List[str]) -> int:
+        """
+        通过当前连接发送一封已构建的邮件，连接不可用时重连一次后重试
+        
+        sendmail 返回即表示服务器已接受邮件，之后连接关闭的错误不影响该邮件。
+        
+        Returns:
+            邮件大小（字节）
+        
+        Raises:
+            发送失败时抛出原始异常
+        """
+        if self._auth_error is not None:
+            raise self._auth_error
+        
+        message = msg.as_string()
+        for attempt in range(2):
+            try:
+                if self.server is None:
+                    self.connect()
+                self.server.sendmail(from_addr, recipients, message)
+                return len(message.encode('utf-8'))
+            except smtplib.SMTPAuthenticationError as e:
+                self._auth_error = e
+                raise
+            except (smtplib.SMTPResponseException, *RECONNECT_ERRORS) as e:
+                # (-1, b'\x00\x00\x00') 之类的错误表示服务器已经关闭了连接
+                if isinstance(e, smtplib.SMTPResponseException) and e.smtp_code != -1:
+                    raise
+                if self.server is not None:
+                    self._discard(self.server)
+                    self.server = None
+                if attempt:
+                    raise
+                print(f"SMTP连接已断开，正在重新连接: {str(e)}")
+    
+    def send(self, from_addr: str, to_addrs: List[str], subject: str, html_content: str,
+             from_name: str = None, cc_addrs: List[str] = None, attachments: List[str] = None) -> DeliveryResult:
+        """
+        发送一封HTML邮件（参数同 EmailSender.send_email）
+        
+        Returns:
+            DeliveryResult，失败时不抛出异常，错误记录在 error 中
+        """
+        msg, recipients = EmailSender.build_message(
+            from_addr, to_addrs, subject, html_content, from_name, cc_addrs, attachments
+        )
+        try:
+            size = self.send_message(msg, from_addr, recipients)
+        except Exception as e:
+            print(f"邮件发送失败 - {subject}: {str(e)}")
+            return DeliveryResult(subject, recipients, False, e)
+        
+        # 显示发送信息
+        send_info = f"收件人: {', '.join(to_addrs)}"
+        if cc_addrs:
+            send_info += f" | 抄送: {', '.join(cc_addrs)}"
+        print(f"邮件已成功发送 - {send_info}")
+        return DeliveryResult(subject, recipients, True, size=size)
+    
+    def send_batch(self, messages: List[dict]) -> List[DeliveryResult]:
+        """
+        通过同一个连接依次发送多封邮件，单封失败不影响其他邮件
+        
+        Args:
+            messages: 邮件参数字典列表，键同 send 的参数
+                （from_addr, to_addrs, subject, html_content, from_name, cc_addrs, attachments）
+        
+        Returns:
+            与 messages 顺序一致的发送结果列表
+        """
+        return [self.send(**message) for message in messages]
 
 
 class EmailSender:
-    def __init__(self, smtp_server: str, smtp_port: int, username: str, password: str, use_ssl: bool = None):
+    def __init__(self, smtp_server: str, smtp_port: int, username: str, password: str, use_ssl: bool = None,
+                 starttls: bool = True):
         """
         初始化邮件发送器
         
@@ -19,6 +193,7 @@ class EmailSender:
             username: 邮箱用户名
             password: 邮箱密码或应用专用密码
             use_ssl: 是否使用SSL连接（None表示自动判断：465端口使用SSL，其他端口使用STARTTLS）
+            starttls: 不使用SSL时是否使用STARTTLS，False表示使用不加密的连接（仅用于内网中继或本地测试）
         """
         self.smtp_server = smtp_server
         self.smtp_port = smtp_port
@@ -29,10 +204,84 @@ class EmailSender:
             self.use_ssl = (smtp_port == 465)
         else:
             self.use_ssl = use_ssl
+        self.starttls = starttls
+    
+    def session(self) -> SMTPSession:
+        """
+        创建复用连接的SMTP会话（上下文管理器），用于一次运行中发送多封邮件
+        """
+        return SMTPSession(self)
+    
+    def send_batch(self, messages: List[dict]) -> List[DeliveryResult]:
+        """
+        通过一个连接发送多封邮件（参数同 SMTPSession.send_batch），失败的邮件会打印排查建议
+        
+        Returns:
+            与 messages 顺序一致的发送结果列表
+        """
+        with self.session() as session:
+            results = session.send_batch(messages)
+        
+        # 同一个错误（例如认证失败）只打印一次排查建议
+        reported = set()
+        for result in results:
+            if result.error is not None and id(result.error) not in reported:
+                reported.add(id(result.error))
+                self._print_troubleshooting(result.error)
+        return results
+    
+    @staticmethod
+    def build_message(from_addr: str, to_addrs: List[str], subject: str, html_content: str,
+                      from_name: str = None, cc_addrs: List[str] = None,
+                      attachments: List[str] = None) -> Tuple[MIMEMultipart, List[str]]:
+        """
+        构建HTML邮件
+        
+        Args:
+            attachments: 可选，附件文件路径列表（有附件时邮件类型为 multipart/mixed）
+        
+        Returns:
+            (邮件对象, 收件人和抄送人地址列表)
+        """
+        msg = MIMEMultipart('mixed' if attachments else 'alternative')
+        
+        # 设置发件人（如果有显示名称，使用格式：显示名称 <email@example.com>）
+        if from_name:
+            # 使用 Header 编码中文显示名称
+            from_header = Header(from_name, 'utf-8').encode()
+            msg['From'] = f'{from_header} <{from_addr}>'
+        else:
+            msg['From'] = from_addr
+        
+        msg['To'] = ', '.join(to_addrs)
+        
+        # 设置抄送人（如果有）
+        if cc_addrs and len(cc_addrs) > 0:
+            msg['Cc'] = ', '.join(cc_addrs)
+        
+        msg['Subject'] = Header(subject, 'utf-8').encode()
+        
+        # 添加HTML内容
+        html_part = MIMEText(html_content, 'html', 'utf-8')
+        msg.attach(html_part)
+        
+        # 添加附件（按二进制发送，例如压缩后的导出文件）
+        for path in attachments or []:
+            with open(path, 'rb') as f:
+                attachment = MIMEApplication(f.read(), Name=os.path.basename(path))
+            attachment.add_header('Content-Disposition', 'attachment', filename=os.path.basename(path))
+            msg.attach(attachment)
+        
+        # 合并收件人和抄送人列表用于 sendmail
+        all_recipients = to_addrs.copy()
+        if cc_addrs and len(cc_addrs) > 0:
+            all_recipients.extend(cc_addrs)
+        
+        return msg, all_recipients
     
     def send_email(self, from_addr: str, to_addrs: List[str], subject: str, html_content: str, from_name: str = None, cc_addrs: List[str] = None):
         """
-        发送HTML邮件
+        发送HTML邮件（单独建立一个连接，发送后关闭）
         
         Args:
             from_addr: 发件人地址
@@ -41,72 +290,23 @@ class EmailSender:
             html_content: HTML内容
             from_name: 发件人显示名称（可选）
             cc_addrs: 抄送人地址列表（可选）
+        
+        Raises:
+            发送失败时抛出原始异常
         """
-        server = None
-        email_sent = False
-        try:
-            # 创建邮件
-            msg = MIMEMultipart('alternative')
-            
-            # 设置发件人（如果有显示名称，使用格式：显示名称 <email@example.com>）
-            if from_name:
-                # 使用 Header 编码中文显示名称
-                from_header = Header(from_name, 'utf-8').encode()
-                msg['From'] = f'{from_header} <{from_addr}>'
-            else:
-                msg['From'] = from_addr
-            
-            msg['To'] = ', '.join(to_addrs)
-            
-            # 设置抄送人（如果有）
-            if cc_addrs and len(cc_addrs) > 0:
-                msg['Cc'] = ', '.join(cc_addrs)
-            
-            msg['Subject'] = Header(subject, 'utf-8').encode()
-            
-            # 添加HTML内容
-            html_part = MIMEText(html_content, 'html', 'utf-8')
-            msg.attach(html_part)
-            
-            # 发送邮件（根据配置选择SSL或STARTTLS）
-            # 增加超时时间到60秒，因为某些SMTP服务器响应较慢
-            if self.use_ssl:
-                # 使用SSL连接（端口465）
-                print(f"使用SSL连接 {self.smtp_server}:{self.smtp_port}")
-                server = smtplib.SMTP_SSL(self.smtp_server, self.smtp_port, timeout=60)
-            else:
-                # 使用STARTTLS连接（端口587或其他）
-                print(f"使用STARTTLS连接 {self.smtp_server}:{self.smtp_port}")
-                server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=60)
-                server.starttls()
-            
-            server.login(self.username, self.password)
-            
-            # 合并收件人和抄送人列表用于 sendmail
-            all_recipients = to_addrs.copy()
-            if cc_addrs and len(cc_addrs) > 0:
-                all_recipients.extend(cc_addrs)
-            
-            server.sendmail(from_addr, all_recipients, msg.as_string())
-            email_sent = True  # 标记邮件已成功发送
-            
-            # 显示发送信息
-            send_info = f"收件人: {', '.join(to_addrs)}"
-            if cc_addrs and len(cc_addrs) > 0:
-                send_info += f" | 抄送: {', '.join(cc_addrs)}"
-            print(f"邮件已成功发送 - {send_info}")
-            
-        except smtplib.SMTPResponseException as e:
-            # 处理 SMTP 响应错误，包括 (-1, b'\x00\x00\x00') 这种连接关闭错误
-            if e.smtp_code == -1 and email_sent:
-                # 如果邮件已经发送成功，忽略退出时的连接关闭错误
-                print(f"邮件已发送，但连接关闭时出现警告（可忽略）: {str(e)}")
-                return  # 邮件已成功发送，直接返回
-            else:
-                print(f"SMTP服务器返回错误: {e.smtp_code} - {e.smtp_error}")
-                raise
-        except smtplib.SMTPAuthenticationError as e:
-            error_msg = str(e)
+        with self.session() as session:
+            result = session.send(from_addr, to_addrs, subject, html_content, from_name, cc_addrs)
+        
+        if not result.delivered:
+            self._print_troubleshooting(result.error)
+            raise result.error
+    
+    def _print_troubleshooting(self, error: Exception):
+        """
+        根据发送错误打印排查建议
+        """
+        if isinstance(error, smtplib.SMTPAuthenticationError):
+            error_msg = str(error)
             if '535' in error_msg or 'BadCredentials' in error_msg:
                 print("=" * 60)
                 print("Gmail SMTP 认证失败！")
@@ -122,15 +322,16 @@ class EmailSender:
                 print("   https://myaccount.google.com/apppasswords")
                 print("3. 使用应用专用密码（16位字符，无空格）作为 SMTP_PASSWORD")
                 print("=" * 60)
-            raise
-        except (smtplib.SMTPServerDisconnected, TimeoutError, ConnectionError) as e:
-            error_msg = str(e)
+        elif isinstance(error, smtplib.SMTPResponseException):
+            print(f"SMTP服务器返回错误: {error.smtp_code} - {error.smtp_error}")
+        elif isinstance(error, (smtplib.SMTPServerDisconnected, TimeoutError, ConnectionError)):
+            error_msg = str(error)
             print("=" * 60)
             print("SMTP连接失败！")
             print("=" * 60)
             print(f"错误信息: {error_msg}")
             print(f"SMTP服务器: {self.smtp_server}:{self.smtp_port}")
-            print(f"连接方式: {'SSL' if self.use_ssl else 'STARTTLS'}")
+            print(f"连接方式: {'SSL' if self.use_ssl else 'STARTTLS' if self.starttls else 'SMTP（未加密）'}")
             print("\n可能的原因：")
             print("1. SMTP服务器地址或端口配置错误")
             print("2. 网络连接问题或防火墙阻止")
@@ -144,25 +345,5 @@ class EmailSender:
                 print("  - 确保在Lark管理后台启用了IMAP/SMTP服务")
                 print("  - 检查是否使用了正确的授权码（不是登录密码）")
             print("=" * 60)
-            raise
-        except Exception as e:
-            print(f"发送邮件时出错: {str(e)}")
-            raise
-        finally:
-            # 安全关闭连接（忽略关闭时的错误，因为邮件可能已经成功发送）
-            if server:
-                try:
-                    server.quit()
-                except (smtplib.SMTPResponseException, Exception) as close_error:
-                    # 如果邮件已发送成功，忽略关闭连接时的错误
-                    if email_sent:
-                        # 邮件已成功发送，连接关闭错误可以忽略
-                        pass
-                    else:
-                        # 如果邮件未发送，记录关闭错误但不抛出（避免掩盖原始错误）
-                        pass
-                try:
-                    server.close()
-                except:
-                    pass
-
+        else:
+            print(f"发送邮件时出错: {str(error)}")
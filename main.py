@@ -2,10 +2,26 @@
 """
 AWS账单报告主程序
 支持日报表和月报表
+
+命令:
+    python main.py [run]          获取数据、生成报告并发送邮件（默认）
+    python main.py fetch          获取数据并保存为JSON
+    python main.py render         从JSON生成HTML报告
+    python main.py send           发送已生成的HTML报告
+    python main.py validate-config  检查配置
+    python main.py backfill       回填历史数据到本地缓存
+
+boto3、numpy 和邮件模块只在使用它们的命令中导入，validate-config 等轻量命令无需加载
+（启动耗时: python -m benchmarks.startup）
 """
+import argparse
+import json
+import os
+import re
 import sys
+import threading
+import time
 from datetime import datetime, timedelta
-from dateutil import tz
 
 from config import (
     get_aws_accounts,
@@ -14,50 +30,586 @@ from config import (
     SMTP_PORT,
     SMTP_USERNAME,
     SMTP_PASSWORD,
+    SMTP_STARTTLS,
     EMAIL_FROM,
     EMAIL_FROM_NAME,
     get_email_recipients,
     get_email_cc_recipients,
-    EMAIL_SUBJECT
+    get_report_routes,
+    EMAIL_SUBJECT,
+    FETCH_MAX_WORKERS,
+    FETCH_ACCOUNT_TIMEOUT,
+    COST_CACHE_ENABLED,
+    COST_CACHE_PATH,
+    COST_CACHE_FINAL_LAG_DAYS,
+    MONTHLY_FROM_DAILY,
+    MONTHLY_RECONCILE,
+    MONTHLY_RECONCILE_TOLERANCE,
+    BILLING_MODE,
+    REPORT_OUTPUT_PATH,
+    REPORT_TOP_N,
+    REPORT_COLLAPSE_TAIL,
+    REPORT_DROP_ZERO_ROWS,
+    REPORT_MAX_BYTES,
+    REPORT_TREND_DAYS,
+    REPORT_TREND_SERVICES,
+    ANOMALY_DETECTION_ENABLED,
+    ANOMALY_STATE_PATH,
+    ANOMALY_HALF_LIFE_DAYS,
+    ANOMALY_Z_THRESHOLD,
+    ANOMALY_MIN_AMOUNT,
+    ANOMALY_MIN_HISTORY,
+    ANOMALY_MAX_ROWS,
+    FORECAST_ENABLED,
+    FORECAST_STATE_PATH,
+    FORECAST_TREND_DAYS,
+    FORECAST_CONFIDENCE,
+    FORECAST_SERVICES,
+    REPORT_DRILLDOWN,
+    REPORT_DRILLDOWN_SERVICES,
+    REPORT_DRILLDOWN_TOP_K,
+    EXPORT_FORMATS,
+    EXPORT_DIR,
+    EXPORT_COMPRESS,
+    EXPORT_ATTACH,
+    COST_METRICS,
+    REPORT_EXTRA_METRICS,
+    CE_RATE_LIMIT,
+    CE_MIN_RATE,
+    CE_MAX_RETRIES,
+    CE_BACKOFF_BASE,
+    CE_BACKOFF_MAX,
+    CE_MAX_POOL_CONNECTIONS,
+    ASSUME_ROLE_DURATION,
+    ASSUME_ROLE_REFRESH_MARGIN,
+    METRICS_JSON_LOG,
+    METRICS_TEXTFILE_PATH,
+    SUPPORTED_COST_METRICS
 )
-from aws_cost_explorer import AWSCostExplorer
-from report_generator import ReportGenerator
-from email_sender import EmailSender
 
+# 并发获取时各账号的进度行共用一个锁
+_print_lock = threading.Lock()
 
-def main():
-    """主函数"""
-    # 检查配置
-    if not EMAIL_FROM:
-        print("错误: 请配置EMAIL_FROM环境变量或在config.py中设置")
-        sys.exit(1)
+
+def print_line(message):
+    """
+    打印一行进度（可在线程池中调用）
     
-    # 检查收件人配置（根据报表类型）
-    recipients = get_email_recipients(REPORT_TYPE)
-    if not recipients:
-        print(f"错误: 请配置EMAIL_TO_{REPORT_TYPE.upper()}或EMAIL_TO环境变量或在config.py中设置")
-        sys.exit(1)
+    print 会分别写出文本和换行符，多个线程同时打印时不同账号的输出会拼到同一行；
+    这里整行（包括换行符）在锁内一次写出
+    """
+    with _print_lock:
+        sys.stdout.write(f"{message}\n")
+        sys.stdout.flush()
+
+
+def aggregate_comparison_rows(rows, newer_period, older_period, metrics):
+    """
+    逐行消费成本数据迭代器，汇总两个周期按服务分组的成本
     
-    if not SMTP_USERNAME or not SMTP_PASSWORD:
-        print("错误: 请配置SMTP_USERNAME和SMTP_PASSWORD环境变量或在config.py中设置")
-        sys.exit(1)
+    分组键的最后一项为服务名，前面的项（如关联账号ID）作为分组前缀。
+    汇总结果只与服务数量有关，与响应页数无关。
     
-    # 获取AWS账号列表
-    aws_accounts = get_aws_accounts()
-    if not aws_accounts:
-        print("错误: 未配置AWS账号，请设置AWS_ACCOUNTS环境变量或在config.py中配置")
-        sys.exit(1)
+    Args:
+        rows: (周期开始日期, 分组键元组, {指标名: 金额}) 迭代器
+        newer_period: 较新周期的开始日期（YYYY-MM-DD）
+        older_period: 较旧周期的开始日期（YYYY-MM-DD）
+        metrics: 汇总的指标名列表
     
-    print(f"找到 {len(aws_accounts)} 个AWS账号")
-    print(f"报表类型: {REPORT_TYPE}")
+    Returns:
+        {分组前缀元组: ({指标名: 较新周期的服务成本}, {指标名: 较旧周期的服务成本})}
+    """
+    aggregated = {}
+    for period, keys, amounts in rows:
+        if period == newer_period:
+            index = 0
+        elif period == older_period:
+            index = 1
+        else:
+            continue
+        prefix, service = keys[:-1], keys[-1]
+        entry = aggregated.get(prefix)
+        if entry is None:
+            entry = aggregated[prefix] = (
+                {metric: {} for metric in metrics}, {metric: {} for metric in metrics}
+            )
+        for metric, costs in entry[index].items():
+            costs[service] = costs.get(service, 0.0) + amounts.get(metric, 0.0)
+    return aggregated
+
+
+def fetch_comparison_costs(cost_explorer, is_monthly, yesterday, day_before, group_by=None):
+    """
+    通过一次范围查询（流式）获取两个周期的对比数据
     
-    # 根据报表类型计算日期
-    utc = tz.gettz('UTC')
-    now = datetime.now(utc)
+    Args:
+        cost_explorer: AWSCostExplorer 实例
+        is_monthly: 是否为月报表
+        yesterday: 较新的日期（月报表为上个月第一天）
+        day_before: 较旧的日期（月报表为上上个月第一天）
+        group_by: 分组列表，最后一项必须为 SERVICE，默认 ['SERVICE']
+    
+    Returns:
+        {分组前缀元组: ({指标名: 较新周期的服务成本}, {指标名: 较旧周期的服务成本})}
+    """
+    rows = cost_explorer.iter_period_rows(
+        min(yesterday, day_before),
+        max(yesterday, day_before) + timedelta(days=1),
+        'MONTHLY' if is_monthly else 'DAILY',
+        group_by
+    )
+    return aggregate_comparison_rows(
+        rows, yesterday.strftime('%Y-%m-%d'), day_before.strftime('%Y-%m-%d'), cost_explorer.metrics
+    )
+
+
+def select_drilldown_services(yesterday_costs, day_before_costs, count):
+    """
+    选出金额变化（绝对值）最大的服务用于下钻，没有变化的服务不下钻
+    
+    Args:
+        yesterday_costs: 较新周期的服务成本
+        day_before_costs: 较旧周期的服务成本
+        count: 最多选出的服务数
+    
+    Returns:
+        服务名列表（按变化的绝对值从大到小）
+    """
+    changes = {
+        service: abs(yesterday_costs.get(service, 0.0) - day_before_costs.get(service, 0.0))
+        for service in set(yesterday_costs) | set(day_before_costs)
+    }
+    ranked = sorted((service for service, change in changes.items() if change >= 0.005),
+                    key=lambda service: (-changes[service], service))
+    return ranked[:count]
+
+
+def fetch_drilldown(cost_explorer, is_monthly, yesterday, day_before, services, levels, linked_accounts=False):
+    """
+    获取服务下钻数据，逐行汇总为 服务 → levels 的 RollupTree（两个周期分别为 current 和 previous）
+    
+    Cost Explorer 每次最多按2个维度分组：逐账号查询且只下钻一级时，一次按 SERVICE 和该分组查询所有服务；
+    下钻两级或整合账单模式（需要按关联账号分组，只使用第一级）时，对每个服务分别按该服务过滤查询。
+    
+    Args:
+        cost_explorer: AWSCostExplorer 实例
+        is_monthly: 是否为月报表
+        yesterday: 较新的日期（月报表为上个月第一天）
+        day_before: 较旧的日期（月报表为上上个月第一天）
+        services: 下钻的服务名列表
+        levels: 服务之下的分组，例如 ['USAGE_TYPE'] 或 ['REGION', 'TAG:Team']
+        linked_accounts: 是否按关联账号拆分（整合账单模式）
+    
+    Returns:
+        {关联账号ID（逐账号查询时为None）: RollupTree}
+    """
+    from cost_rollup import RollupTree, group_label
+    
+    if linked_accounts:
+        levels = levels[:1]
+    newer_period, older_period = yesterday.strftime('%Y-%m-%d'), day_before.strftime('%Y-%m-%d')
+    if not linked_accounts and len(levels) == 1:
+        queries = [(['SERVICE'] + levels, None, None)]
+    else:
+        prefix = ['LINKED_ACCOUNT'] if linked_accounts else []
+        queries = [(prefix + levels, {'SERVICE': [service]}, service) for service in services]
+    wanted = set(services)
+    
+    trees = {}
+    for group_by, filters, service in queries:
+        rows = cost_explorer.iter_period_rows(
+            min(yesterday, day_before),
+            max(yesterday, day_before) + timedelta(days=1),
+            'MONTHLY' if is_monthly else 'DAILY',
+            group_by,
+            filters
+        )
+        for period, keys, amounts in rows:
+            if period not in (newer_period, older_period):
+                continue
+            row_service = service
+            if row_service is None:
+                row_service, keys = keys[0], keys[1:]
+                if row_service not in wanted:
+                    continue
+            account_id = None
+            if linked_accounts:
+                account_id, keys = keys[0], keys[1:]
+            tree = trees.get(account_id)
+            if tree is None:
+                tree = trees[account_id] = RollupTree(['SERVICE'] + levels)
+            amount = amounts.get(cost_explorer.metric, 0.0)
+            tree.add(
+                (row_service,) + tuple(group_label(level, key) for level, key in zip(levels, keys)),
+                amount if period == newer_period else 0.0,
+                amount if period == older_period else 0.0
+            )
+    for tree in trees.values():
+        tree.compact()
+    return trees
+
+
+def fetch_account_data(idx, account, account_count, is_monthly, yesterday, day_before, cost_cache=None,
+                       metrics=None, rate_limiter=None, run_metrics=None, client_cache=None, deadline=None):
+    """
+    获取单个账号的对比数据（在线程池中执行）
+    
+    Args:
+        idx: 账号序号（从1开始）
+        account: 账号配置字典
+        account_count: 账号总数
+        is_monthly: 是否为月报表
+        yesterday: 较新的日期（月报表为上个月第一天）
+        day_before: 较旧的日期（月报表为上上个月第一天）
+        cost_cache: 可选，共享的本地成本缓存
+        metrics: 可选，同时获取的指标列表，第一个为主指标
+        rate_limiter: 可选，所有账号共享的 Cost Explorer 限流器
+        run_metrics: 可选，记录该账号的API调用和重试次数
+        client_cache: 可选，共享会话和连接池的 Cost Explorer 客户端缓存
+        deadline: 可选，截止时间（time.monotonic()），超过后停止请求并抛出 TimeoutError
+    
+    Returns:
+        账号明细字典（yesterday_metrics / day_before_metrics 为所有指标的服务成本）
+    """
+    account_name = account.get('account_name', f'账号{idx}')
+    access_key_id = account.get('access_key_id')
+    secret_access_key = account.get('secret_access_key')
+    region = account.get('region', 'us-east-1')
+    
+    print_line(f"[{idx}/{account_count}] 正在处理账号: {account_name}")
     
-    is_monthly = REPORT_TYPE.lower() == 'monthly'
+    # 初始化AWS Cost Explorer（配置了 role_arn 时在本线程中扮演角色，与其他账号的查询并发进行）
+    from aws_cost_explorer import AWSCostExplorer
+    cost_explorer = AWSCostExplorer(
+        access_key_id=access_key_id,
+        secret_access_key=secret_access_key,
+        region=region,
+        role_arn=account.get('role_arn'),
+        external_id=account.get('external_id'),
+        cache=cost_cache,
+        cache_key=account_name,
+        metrics=metrics,
+        rate_limiter=rate_limiter,
+        max_retries=CE_MAX_RETRIES,
+        backoff_base=CE_BACKOFF_BASE,
+        backoff_max=CE_BACKOFF_MAX,
+        client_cache=client_cache,
+        monthly_from_daily=MONTHLY_FROM_DAILY,
+        reconcile_tolerance=MONTHLY_RECONCILE_TOLERANCE if MONTHLY_RECONCILE else None,
+        deadline=deadline
+    )
+    
+    # 逐行消费成本数据并按服务汇总（所有指标来自同一次请求）
+    drilldown = None
+    try:
+        acc_yesterday_metrics, acc_day_before_metrics = fetch_comparison_costs(
+            cost_explorer, is_monthly, yesterday, day_before
+        ).get((), ({}, {}))
+        
+        # 可选：为变化最大的服务获取下一级分组（失败时只跳过下钻，不影响该账号的数据）
+        drilldown_services = select_drilldown_services(
+            acc_yesterday_metrics.get(cost_explorer.metric, {}), acc_day_before_metrics.get(cost_explorer.metric, {}),
+            REPORT_DRILLDOWN_SERVICES
+        ) if REPORT_DRILLDOWN else []
+        if drilldown_services:
+            try:
+                drilldown = fetch_drilldown(
+                    cost_explorer, is_monthly, yesterday, day_before, drilldown_services, REPORT_DRILLDOWN
+                ).get(None)
+            except Exception as e:
+                print_line(f"  警告: 账号 {account_name} 获取下钻数据失败: {str(e)}")
+    finally:
+        if run_metrics is not None:
+            run_metrics.record_account(account_name, api_calls=cost_explorer.api_calls, retries=cost_explorer.retries)
+    acc_yesterday_costs = acc_yesterday_metrics.get(cost_explorer.metric, {})
+    acc_day_before_costs = acc_day_before_metrics.get(cost_explorer.metric, {})
+    acc_yesterday_total = sum(acc_yesterday_costs.values())
+    acc_day_before_total = sum(acc_day_before_costs.values())
     
     if is_monthly:
+        print_line(f"  {account_name} - {yesterday.year}年{yesterday.month}月: ${acc_yesterday_total:,.2f}, {day_before.year}年{day_before.month}月: ${acc_day_before_total:,.2f}")
+    else:
+        print_line(f"  {account_name} - 昨天: ${acc_yesterday_total:,.2f}, 前天: ${acc_day_before_total:,.2f}")
+    
+    return {
+        'account_name': account_name,
+        'yesterday_costs': acc_yesterday_costs,
+        'day_before_costs': acc_day_before_costs,
+        'yesterday_total': acc_yesterday_total,
+        'day_before_total': acc_day_before_total,
+        'yesterday_metrics': acc_yesterday_metrics,
+        'day_before_metrics': acc_day_before_metrics,
+        # 服务下钻的汇总树（cost_rollup.RollupTree），未启用下钻时为None
+        'drilldown': drilldown
+    }
+
+
+def fetch_consolidated_account_details(aws_accounts, is_monthly, yesterday, day_before, cost_cache=None,
+                                       metrics=None, rate_limiter=None, run_metrics=None, client_cache=None,
+                                       deadline=None):
+    """
+    整合账单模式：通过付款账号一次查询所有关联账号的对比数据
+    
+    Args:
+        aws_accounts: 账号配置列表（payer为付款账号，其余账号只用于映射名称和顺序）
+        is_monthly: 是否为月报表
+        yesterday: 较新的日期（月报表为上个月第一天）
+        day_before: 较旧的日期（月报表为上上个月第一天）
+        cost_cache: 可选，共享的本地成本缓存
+        metrics: 可选，同时获取的指标列表，第一个为主指标
+        rate_limiter: 可选，Cost Explorer 限流器
+        run_metrics: 可选，记录付款账号的查询耗时、API调用和重试次数
+        client_cache: 可选，共享会话和连接池的 Cost Explorer 客户端缓存
+        deadline: 可选，付款账号查询的截止时间（time.monotonic()），超过后停止请求并抛出 TimeoutError
+    
+    Returns:
+        账号明细列表，配置中的账号按配置顺序排在前面，其余按账号ID排序
+    """
+    payer = next((account for account in aws_accounts if account.get('payer')), aws_accounts[0] if aws_accounts else {})
+    payer_name = payer.get('account_name', '付款账号')
+    print(f"整合账单模式: 通过付款账号 {payer_name} 查询所有关联账号")
+    
+    from aws_cost_explorer import AWSCostExplorer
+    cost_explorer = AWSCostExplorer(
+        access_key_id=payer.get('access_key_id'),
+        secret_access_key=payer.get('secret_access_key'),
+        region=payer.get('region', 'us-east-1'),
+        role_arn=payer.get('role_arn'),
+        external_id=payer.get('external_id'),
+        cache=cost_cache,
+        cache_key=payer_name,
+        metrics=metrics,
+        rate_limiter=rate_limiter,
+        max_retries=CE_MAX_RETRIES,
+        backoff_base=CE_BACKOFF_BASE,
+        backoff_max=CE_BACKOFF_MAX,
+        client_cache=client_cache,
+        monthly_from_daily=MONTHLY_FROM_DAILY,
+        reconcile_tolerance=MONTHLY_RECONCILE_TOLERANCE if MONTHLY_RECONCILE else None,
+        deadline=deadline
+    )
+    start = time.perf_counter()
+    status = 'error'
+    drilldowns = {}
+    try:
+        comparison = {
+            prefix[0]: costs
+            for prefix, costs in fetch_comparison_costs(
+                cost_explorer, is_monthly, yesterday, day_before, ['LINKED_ACCOUNT', 'SERVICE']
+            ).items()
+        }
+        
+        # 可选：所有关联账号合计变化最大的服务，每个服务一次按关联账号和下一级分组的查询
+        drilldown_services = []
+        if REPORT_DRILLDOWN:
+            service_totals = ({}, {})
+            for acc_metrics in comparison.values():
+                for totals, costs in zip(service_totals, acc_metrics):
+                    for service, amount in costs[cost_explorer.metric].items():
+                        totals[service] = totals.get(service, 0.0) + amount
+            drilldown_services = select_drilldown_services(*service_totals, REPORT_DRILLDOWN_SERVICES)
+        if drilldown_services:
+            try:
+                drilldowns = fetch_drilldown(
+                    cost_explorer, is_monthly, yesterday, day_before, drilldown_services, REPORT_DRILLDOWN,
+                    linked_accounts=True
+                )
+            except Exception as e:
+                print(f"  警告: 获取下钻数据失败: {str(e)}")
+        status = 'ok'
+    except TimeoutError:
+        status = 'timeout'
+        raise
+    finally:
+        if run_metrics is not None:
+            run_metrics.record_account(
+                payer_name, seconds=time.perf_counter() - start, status=status,
+                api_calls=cost_explorer.api_calls, retries=cost_explorer.retries
+            )
+    cost_explorer.load_cached_account_names()
+    
+    # 配置中的账号ID -> 账号名称
+    configured_names = {
+        str(account['account_id']): account.get('account_name')
+        for account in aws_accounts if account.get('account_id')
+    }
+    ordered_ids = [account_id for account_id in configured_names if account_id in comparison]
+    ordered_ids += sorted(account_id for account_id in comparison if account_id not in configured_names)
+    
+    account_details = []
+    for account_id in ordered_ids:
+        account_name = (configured_names.get(account_id)
+                        or cost_explorer.linked_account_names.get(account_id)
+                        or account_id)
+        acc_yesterday_metrics, acc_day_before_metrics = comparison[account_id]
+        acc_yesterday_costs = acc_yesterday_metrics[cost_explorer.metric]
+        acc_day_before_costs = acc_day_before_metrics[cost_explorer.metric]
+        acc_yesterday_total = sum(acc_yesterday_costs.values())
+        acc_day_before_total = sum(acc_day_before_costs.values())
+        print(f"  {account_name} ({account_id}) - ${acc_yesterday_total:,.2f} / ${acc_day_before_total:,.2f}")
+        account_details.append({
+            'account_name': account_name,
+            'account_id': account_id,
+            # 本地缓存中该付款账号按关联账号和服务分组的数据（用于趋势）
+            'cache_account': cost_explorer.cache_account(['LINKED_ACCOUNT', 'SERVICE']),
+            'yesterday_costs': acc_yesterday_costs,
+            'day_before_costs': acc_day_before_costs,
+            'yesterday_total': acc_yesterday_total,
+            'day_before_total': acc_day_before_total,
+            'yesterday_metrics': acc_yesterday_metrics,
+            'day_before_metrics': acc_day_before_metrics,
+            'drilldown': drilldowns.get(account_id)
+        })
+    
+    return account_details
+
+
+def print_rate_limiter_stats(rate_limiter):
+    """打印 Cost Explorer 请求、限流和重试统计"""
+    stats = rate_limiter.stats()
+    print(f"Cost Explorer 请求: {stats['requests']} 次, 被限流: {stats['throttled']} 次, 重试: {stats['retries']} 次, "
+          f"限流等待: {stats['wait_seconds']:.1f} 秒, 退避等待: {stats['backoff_seconds']:.1f} 秒, "
+          f"当前速率: {stats['rate']:.2f} 次/秒")
+
+
+def print_credential_stats(credential_cache, since=None):
+    """
+    打印 STS AssumeRole 调用和临时凭证缓存命中次数（没有账号使用角色时不打印）
+    
+    Args:
+        credential_cache: aws_credentials.CredentialCache
+        since: 可选，之前的 stats()，只统计之后的增量
+    
+    Returns:
+        (AssumeRole 调用次数, 缓存命中次数)
+    """
+    stats = credential_cache.stats()
+    calls = stats['assume_role_calls'] - (since['assume_role_calls'] if since else 0)
+    hits = stats['hits'] - (since['hits'] if since else 0)
+    if calls or hits:
+        print(f"STS AssumeRole: {calls} 次, 临时凭证缓存命中: {hits} 次")
+    return calls, hits
+
+
+def resolve_route_rows(route, account_names):
+    """
+    计算报告路由包含的账号行索引
+    
+    Args:
+        route: 路由配置字典，accounts 为账号名称列表或 "*"
+        account_names: 成本矩阵的账号名称列表
+    
+    Returns:
+        账号行索引列表（按成本矩阵的账号顺序），包含所有账号时返回None
+    """
+    if route['accounts'] == '*':
+        return None
+    wanted = set(route['accounts'])
+    missing = wanted.difference(account_names)
+    if missing:
+        print(f"警告: 报告路由 {route['name']} 中的账号没有数据: {', '.join(sorted(missing))}")
+    return [row for row, name in enumerate(account_names) if name in wanted]
+
+
+def fetch_accounts_concurrently(aws_accounts, fetch_func, max_workers=8, timeout=None, run_metrics=None):
+    """
+    使用有界线程池并发获取所有账号的数据
+    
+    单个账号失败或超时只会打印警告，不影响其他账号。
+    超时从该账号真正开始执行时计时，排队等待的时间不计入。线程无法强制终止，
+    截止时间会传给获取函数，超时的账号在下一次请求或重试前停止（不再占用限流器和线程）。
+    
+    Args:
+        aws_accounts: 账号配置列表
+        fetch_func: 获取函数，签名为 fetch_func(idx, account, deadline)，idx从1开始，
+            deadline 为截止时间（time.monotonic()），未设置超时时为None
+        max_workers: 最大并发数
+        timeout: 单个账号的超时时间（秒），None或0表示不限制
+        run_metrics: 可选，记录每个账号的耗时和结果（ok/error/timeout）
+    
+    Returns:
+        与 aws_accounts 顺序一致的结果列表，失败或超时的账号为None
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    
+    results = [None] * len(aws_accounts)
+    started_at = {}
+    durations = {}
+    
+    def run(idx, account):
+        started_at[idx] = time.monotonic()
+        deadline = started_at[idx] + timeout if timeout else None
+        try:
+            return fetch_func(idx, account, deadline)
+        finally:
+            durations[idx] = time.monotonic() - started_at[idx]
+    
+    def record(idx, account_name, status):
+        if run_metrics is not None:
+            seconds = durations.get(idx, time.monotonic() - started_at.get(idx, time.monotonic()))
+            run_metrics.record_account(account_name, seconds=seconds, status=status)
+    
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='cost-fetch')
+    futures = {
+        executor.submit(run, idx, account): (idx, account)
+        for idx, account in enumerate(aws_accounts, 1)
+    }
+    pending = set(futures)
+    
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=0.5 if timeout else None, return_when=FIRST_COMPLETED)
+            
+            for future in done:
+                idx, account = futures[future]
+                account_name = account.get('account_name', f'账号{idx}')
+                try:
+                    results[idx - 1] = future.result()
+                    record(idx, account_name, 'ok')
+                except TimeoutError as e:
+                    # 获取函数在截止时间后停止了请求
+                    print_line(f"  警告: 账号 {account_name} 获取数据超时（超过 {timeout} 秒），已跳过: {str(e)}")
+                    record(idx, account_name, 'timeout')
+                except Exception as e:
+                    print_line(f"  警告: 账号 {account_name} 获取数据失败: {str(e)}")
+                    record(idx, account_name, 'error')
+            
+            if not timeout:
+                continue
+            
+            # 检查正在执行的账号是否超时（线程无法强制终止，超时后直接放弃其结果）
+            now = time.monotonic()
+            for future in list(pending):
+                idx, account = futures[future]
+                start = started_at.get(idx)
+                if start is not None and now - start > timeout:
+                    account_name = account.get('account_name', f'账号{idx}')
+                    print_line(f"  警告: 账号 {account_name} 获取数据超时（超过 {timeout} 秒），已跳过")
+                    record(idx, account_name, 'timeout')
+                    pending.discard(future)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    return results
+
+
+def report_dates(report_type, now=None):
+    """
+    根据报表类型计算对比的两个日期（UTC）
+    
+    Args:
+        report_type: 报表类型，'daily' 或 'monthly'
+        now: 可选，当前时间（带UTC时区），默认为实际当前时间
+    
+    Returns:
+        (较新的日期, 较旧的日期)，月报表为上个月和上上个月的第一天
+    """
+    from dateutil import tz
+    
+    utc = tz.gettz('UTC')
+    now = now or datetime.now(utc)
+    
+    if report_type.lower() == 'monthly':
         # 月报表：获取上个月和上上个月的月账单数据
         # 例如：今天是1月5号，获取12月（上个月）和11月（上上个月）的账单
         current_year = now.year
@@ -97,70 +649,344 @@ def main():
         
         print(f"获取 {yesterday.strftime('%Y-%m-%d')}（前4天）和 {day_before.strftime('%Y-%m-%d')}（前5天）的账单数据...")
     
+    return yesterday, day_before
+
+
+def select_extra_metrics(metrics):
+    """
+    报告中作为附加列显示的指标（REPORT_EXTRA_METRICS 中包含在 metrics 里且不是主指标的指标）
+    """
+    extra_metrics = [metric for metric in REPORT_EXTRA_METRICS if metric in metrics[1:]]
+    if len(extra_metrics) < len(REPORT_EXTRA_METRICS):
+        print("警告: REPORT_EXTRA_METRICS 中不在 COST_METRICS 里（或为主指标）的指标将被忽略")
+    return extra_metrics
+
+
+def build_size_budget():
+    """根据配置创建报告大小预算，未配置任何选项时返回None（不限制）"""
+    if not (REPORT_TOP_N or REPORT_DROP_ZERO_ROWS or REPORT_MAX_BYTES):
+        return None
+    from report_generator import ReportSizeBudget
+    return ReportSizeBudget(
+        top_n=REPORT_TOP_N or None,
+        collapse_tail=REPORT_COLLAPSE_TAIL,
+        drop_zero_rows=REPORT_DROP_ZERO_ROWS,
+        max_bytes=REPORT_MAX_BYTES or None
+    )
+
+
+def report_subject(is_monthly, yesterday):
+    """根据报表类型生成邮件主题"""
+    if is_monthly:
+        return f"AWS月度账单报告 - {yesterday.year}年{yesterday.month}月"
+    return f"{EMAIL_SUBJECT} - {yesterday.strftime('%Y-%m-%d')}"
+
+
+def export_report_data(account_details, is_monthly, yesterday, day_before, metric, route_name=None):
+    """
+    将账号明细逐行导出为 EXPORT_FORMATS 中的格式（未配置时不导出）
+    
+    Args:
+        account_details: 账号明细列表
+        is_monthly: 是否为月报表
+        yesterday: 报告周期的日期
+        day_before: 对比周期的日期
+        metric: 主指标名称
+        route_name: 可选，报告路由名称，追加到文件名中（路由只导出自己负责的账号）
+    
+    Returns:
+        (导出文件路径列表, 行数)
+    """
+    if not EXPORT_FORMATS:
+        return [], 0
+    from cost_export import export_rows, iter_export_rows
+    
+    period = yesterday.strftime('%Y-%m') if is_monthly else yesterday.strftime('%Y-%m-%d')
+    file_name = f"aws_costs_{'monthly' if is_monthly else 'daily'}_{period}"
+    if route_name is not None:
+        file_name += '_' + re.sub(r'[^\w.-]+', '_', route_name)
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    paths, count = export_rows(
+        iter_export_rows(account_details, yesterday, day_before, is_monthly, metric),
+        os.path.join(EXPORT_DIR, file_name), EXPORT_FORMATS, EXPORT_COMPRESS
+    )
+    print(f"已导出 {count} 行数据: {', '.join(paths)}")
+    return paths, count
+
+
+def load_trends(cost_cache, account_details, is_monthly, yesterday, metric):
+    """
+    从本地缓存的日数据构建截至报告日期的趋势（不调用API）
+    
+    Args:
+        cost_cache: 本地成本缓存，None 时不显示趋势
+        account_details: 账号明细列表
+        is_monthly: 是否为月报表（截至该月最后一天）
+        yesterday: 较新的日期（月报表为上个月第一天）
+        metric: 主指标
+    
+    Returns:
+        CostTrends 实例；未启用趋势或缓存中没有数据时返回None
+    """
+    if not REPORT_TREND_DAYS or cost_cache is None or not account_details:
+        return None
+    from cost_trends import CostTrends
+    
+    end_date = yesterday
+    if is_monthly:
+        end_date = (yesterday.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    trends = CostTrends.from_cache(cost_cache, account_details, end_date, REPORT_TREND_DAYS, metric)
+    if trends is None:
+        print(f"本地缓存中没有近 {REPORT_TREND_DAYS} 天的日数据，报告不显示趋势（可以先运行 backfill 回填）")
+    else:
+        observed_days = int(trends.observed.any(axis=0).sum())
+        print(f"趋势: {len(trends.account_names)} 个账号, {len(trends.service_names)} 个服务, "
+              f"{observed_days}/{REPORT_TREND_DAYS} 天有缓存数据")
+    return trends
+
+
+def detect_anomalies(cost_matrix, is_monthly, yesterday, persist=True):
+    """
+    用报告日期的成本更新每个 账号-服务 序列的异常检测状态，返回当天的异常（只检测日报表）
+    
+    Args:
+        cost_matrix: 所有账号的 CostMatrix（current 为报告日期的成本）
+        is_monthly: 是否为月报表（月报表不检测）
+        yesterday: 报告日期
+        persist: 是否保存更新后的状态；为 False 时只计算（例如 render 命令重新生成报告）
+    
+    Returns:
+        异常列表；未启用异常检测时返回None
+    """
+    if not ANOMALY_DETECTION_ENABLED or is_monthly or not cost_matrix.account_names:
+        return None
+    from cost_anomalies import AnomalyDetector
+    
+    detector = AnomalyDetector(
+        ANOMALY_STATE_PATH, ANOMALY_HALF_LIFE_DAYS, ANOMALY_Z_THRESHOLD, ANOMALY_MIN_AMOUNT, ANOMALY_MIN_HISTORY
+    )
+    anomalies = detector.observe(yesterday, cost_matrix)
+    if persist:
+        detector.save()
+    stats = detector.stats()
+    print(f"异常检测: {stats['series']} 个序列（{stats['ready']} 个已积累足够历史）, 发现 {len(anomalies)} 个异常")
+    return anomalies
+
+
+def project_month_end(cost_matrix, is_monthly, yesterday, persist=True):
+    """
+    用报告日期的成本累加月末预测状态，返回报告日期所在月份的月末预测（只用于日报表）
+    
+    Args:
+        cost_matrix: 所有账号的 CostMatrix（current 为报告日期的成本）
+        is_monthly: 是否为月报表（月报表不预测）
+        yesterday: 报告日期
+        persist: 是否保存更新后的状态；为 False 时只计算（例如 render 命令重新生成报告）
+    
+    Returns:
+        MonthEndForecast 实例；未启用预测时返回None
+    """
+    if not FORECAST_ENABLED or is_monthly or not cost_matrix.account_names:
+        return None
+    from cost_forecast import ForecastModel
+    
+    model = ForecastModel(FORECAST_STATE_PATH, FORECAST_TREND_DAYS)
+    model.observe(yesterday, cost_matrix)
+    if persist:
+        model.save()
+    forecast = model.project(yesterday, cost_matrix.account_names, FORECAST_CONFIDENCE)
+    if forecast is not None:
+        month_to_date, projected, low, high = forecast.total()
+        band = '' if low != low else f"（{FORECAST_CONFIDENCE:.0%} 置信区间 ${low:,.2f} ~ ${high:,.2f}）"
+        print(f"月末预测: {yesterday.year}年{yesterday.month}月本月至今 ${month_to_date:,.2f}, "
+              f"预测月末 ${projected:,.2f}{band}")
+    return forecast
+
+
+def fetch_report_details(aws_accounts, is_monthly, yesterday, day_before, cost_cache=None, rate_limiter=None,
+                         run_metrics=None, client_cache=None):
+    """
+    按账单模式获取所有账号的对比数据
+    
+    Args:
+        aws_accounts: 账号配置列表
+        is_monthly: 是否为月报表
+        yesterday: 较新的日期（月报表为上个月第一天）
+        day_before: 较旧的日期（月报表为上上个月第一天）
+        cost_cache: 可选，本地成本缓存
+        rate_limiter: 可选，所有账号共享的 Cost Explorer 限流器
+        run_metrics: 可选，记录每个账号的指标
+        client_cache: 可选，复用已创建的 Cost Explorer 客户端
+    
+    Returns:
+        账号明细列表（按账号配置顺序，失败或超时的账号不包含在内）
+    """
+    if BILLING_MODE.lower() == 'consolidated':
+        # 整合账单模式：付款账号一次查询，按关联账号拆分（付款账号的查询同样受单账号超时限制）
+        return fetch_consolidated_account_details(
+            aws_accounts, is_monthly, yesterday, day_before, cost_cache, COST_METRICS, rate_limiter,
+            run_metrics, client_cache,
+            deadline=time.monotonic() + FETCH_ACCOUNT_TIMEOUT if FETCH_ACCOUNT_TIMEOUT else None
+        )
+    # 并发获取每个账号的数据（结果按账号配置顺序返回，失败或超时的账号为None）
+    account_results = fetch_accounts_concurrently(
+        aws_accounts,
+        lambda idx, account, deadline: fetch_account_data(
+            idx, account, len(aws_accounts), is_monthly, yesterday, day_before, cost_cache,
+            COST_METRICS, rate_limiter, run_metrics, client_cache, deadline
+        ),
+        max_workers=FETCH_MAX_WORKERS,
+        timeout=FETCH_ACCOUNT_TIMEOUT,
+        run_metrics=run_metrics
+    )
+    return [acc_detail for acc_detail in account_results if acc_detail is not None]
+
+
+def main(report_type=REPORT_TYPE, now=None, warm=None):
+    """
+    主函数：生成并发送报告，运行结束时（包括失败）写入运行指标
+    
+    Args:
+        report_type: 报表类型，'daily' 或 'monthly'，默认使用 REPORT_TYPE 配置
+        now: 可选，计算报表日期使用的当前时间（UTC），默认为实际当前时间
+        warm: 可选，守护进程在多次运行之间保持的状态（daemon.WarmState）
+    """
+    from run_metrics import RunMetrics
+    
+    run_metrics = RunMetrics(
+        json_log_path=METRICS_JSON_LOG or None,
+        textfile_path=METRICS_TEXTFILE_PATH or None,
+        labels={'report_type': report_type}
+    )
+    success = False
     try:
-        # 汇总所有账号的数据
-        all_yesterday_costs = {}  # 所有账号昨天的服务成本汇总
-        all_day_before_costs = {}  # 所有账号前天的服务成本汇总
-        account_details = []  # 每个账号的明细数据
-        
-        yesterday_total = 0.0
-        day_before_total = 0.0
-        
-        # 遍历每个账号
-        for idx, account in enumerate(aws_accounts, 1):
-            account_name = account.get('account_name', f'账号{idx}')
-            access_key_id = account.get('access_key_id')
-            secret_access_key = account.get('secret_access_key')
-            region = account.get('region', 'us-east-1')
-            
-            print(f"\n[{idx}/{len(aws_accounts)}] 正在处理账号: {account_name}")
-            
-            try:
-                # 初始化AWS Cost Explorer
-                cost_explorer = AWSCostExplorer(
-                    access_key_id=access_key_id,
-                    secret_access_key=secret_access_key,
-                    region=region
-                )
-                
-                # 根据报表类型获取数据
-                if is_monthly:
-                    # 月报表：获取月度对比数据
-                    acc_yesterday_costs, acc_day_before_costs, acc_yesterday_total, acc_day_before_total = \
-                        cost_explorer.get_monthly_comparison_data(
-                            yesterday.year, yesterday.month,
-                            day_before.year, day_before.month
-                        )
-                    print(f"  {account_name} - {yesterday.year}年{yesterday.month}月: ${acc_yesterday_total:,.2f}, {day_before.year}年{day_before.month}月: ${acc_day_before_total:,.2f}")
-                else:
-                    # 日报表：获取日度对比数据
-                    acc_yesterday_costs, acc_day_before_costs, acc_yesterday_total, acc_day_before_total = \
-                        cost_explorer.get_comparison_data(yesterday, day_before)
-                    print(f"  {account_name} - 昨天: ${acc_yesterday_total:,.2f}, 前天: ${acc_day_before_total:,.2f}")
-                
-                # 汇总到总数据
-                for service, cost in acc_yesterday_costs.items():
-                    all_yesterday_costs[service] = all_yesterday_costs.get(service, 0.0) + cost
-                
-                for service, cost in acc_day_before_costs.items():
-                    all_day_before_costs[service] = all_day_before_costs.get(service, 0.0) + cost
-                
-                yesterday_total += acc_yesterday_total
-                day_before_total += acc_day_before_total
-                
-                # 保存账号明细
-                account_details.append({
-                    'account_name': account_name,
-                    'yesterday_costs': acc_yesterday_costs,
-                    'day_before_costs': acc_day_before_costs,
-                    'yesterday_total': acc_yesterday_total,
-                    'day_before_total': acc_day_before_total
-                })
-                
-            except Exception as e:
-                print(f"  警告: 账号 {account_name} 获取数据失败: {str(e)}")
-                # 继续处理其他账号
-                continue
+        run_report(run_metrics, report_type, now, warm)
+        success = True
+    finally:
+        run_metrics.finish(success)
+
+
+def run_report(run_metrics, report_type=REPORT_TYPE, now=None, warm=None):
+    """
+    检查配置、获取数据、生成报告并发送邮件，失败时退出码为1
+    
+    Args:
+        run_metrics: RunMetrics 实例，记录各阶段和每个账号的指标
+        report_type: 报表类型，'daily' 或 'monthly'
+        now: 可选，计算报表日期使用的当前时间（UTC）
+        warm: 可选，daemon.WarmState，提供已加载的账号和路由配置、本地缓存和客户端缓存
+    """
+    from aws_cost_explorer import ClientCache
+    from cost_cache import CostCache
+    from cost_matrix import CostMatrix
+    from email_sender import EmailSender
+    from rate_limiter import AdaptiveRateLimiter
+    from report_generator import ReportGenerator
+    
+    # 检查配置
+    if not EMAIL_FROM:
+        print("错误: 请配置EMAIL_FROM环境变量或在config.py中设置")
+        sys.exit(1)
+    
+    # 检查收件人配置（配置了报告路由时使用路由中的收件人，否则根据报表类型）
+    with run_metrics.stage('config_load'):
+        report_routes = warm.report_routes if warm is not None else get_report_routes()
+        recipients = get_email_recipients(report_type)
+    if not report_routes and not recipients:
+        print(f"错误: 请配置EMAIL_TO_{report_type.upper()}或EMAIL_TO环境变量或在config.py中设置")
+        sys.exit(1)
+    
+    if not SMTP_USERNAME or not SMTP_PASSWORD:
+        print("错误: 请配置SMTP_USERNAME和SMTP_PASSWORD环境变量或在config.py中设置")
+        sys.exit(1)
+    
+    is_consolidated = BILLING_MODE.lower() == 'consolidated'
+    
+    # 获取AWS账号列表（整合账单模式下可以不配置，使用默认凭证链作为付款账号）
+    with run_metrics.stage('config_load'):
+        aws_accounts = warm.aws_accounts if warm is not None else get_aws_accounts()
+    run_metrics.set_counter('accounts_configured', len(aws_accounts))
+    if not aws_accounts and not is_consolidated:
+        print("错误: 未配置AWS账号，请设置AWS_ACCOUNTS环境变量或在config.py中配置")
+        sys.exit(1)
+    
+    print(f"找到 {len(aws_accounts)} 个AWS账号")
+    print(f"报表类型: {report_type}")
+    print(f"账单模式: {'整合账单（付款账号）' if is_consolidated else '逐账号查询'}")
+    print(f"并发数: {FETCH_MAX_WORKERS}, 单账号超时: {FETCH_ACCOUNT_TIMEOUT}秒")
+    print(f"成本指标: {', '.join(COST_METRICS)}")
+    
+    extra_metrics = select_extra_metrics(COST_METRICS)
+    
+    # 根据报表类型计算日期
+    is_monthly = report_type.lower() == 'monthly'
+    yesterday, day_before = report_dates(report_type, now)
+    
+    # 本地成本缓存（已结算的周期直接从缓存读取）
+    if warm is not None:
+        cost_cache, client_cache = warm.cost_cache, warm.client_cache
+    else:
+        cost_cache = CostCache(COST_CACHE_PATH, COST_CACHE_FINAL_LAG_DAYS) if COST_CACHE_ENABLED else None
+        # 所有账号共享一个 boto3 会话和连接池，只缓存正在使用的客户端
+        client_cache = ClientCache(CE_MAX_POOL_CONNECTIONS, FETCH_MAX_WORKERS)
+    
+    # 所有账号共享一个限流器，遇到限流时整体降速并重试，而不是丢失账号数据
+    rate_limiter = AdaptiveRateLimiter(CE_RATE_LIMIT, CE_MIN_RATE)
+    
+    # 守护进程在多次运行之间复用临时凭证缓存，统计本次运行的增量
+    credential_stats = client_cache.credential_cache.stats()
+    
+    try:
+        with run_metrics.stage('fetch'):
+            account_details = fetch_report_details(
+                aws_accounts, is_monthly, yesterday, day_before, cost_cache, rate_limiter, run_metrics, client_cache
+            )
+        
+        # 按账号配置顺序构建 账号 × 服务 成本矩阵，批量汇总，保证结果与完成顺序无关
+        with run_metrics.stage('aggregate'):
+            cost_matrix = CostMatrix.from_account_details(account_details, extra_metrics)
+            all_yesterday_costs, all_day_before_costs = cost_matrix.service_cost_dicts()
+            yesterday_total = cost_matrix.current_total
+            day_before_total = cost_matrix.previous_total
+        
+        # 导出机器可读的数据（与邮件使用同一份账号明细，逐行写出）
+        with run_metrics.stage('export'):
+            export_paths, export_count = export_report_data(
+                account_details, is_monthly, yesterday, day_before, COST_METRICS[0]
+            )
+        if export_paths:
+            run_metrics.set_counter('export_rows', export_count)
+            run_metrics.set_counter('export_bytes', sum(os.path.getsize(path) for path in export_paths))
+        
+        # 趋势来自本地缓存的历史日数据，不额外调用API
+        with run_metrics.stage('trends'):
+            trends = load_trends(cost_cache, account_details, is_monthly, yesterday, COST_METRICS[0])
+        
+        # 异常检测逐日更新本地保存的统计状态，不重新扫描历史数据
+        with run_metrics.stage('anomalies'):
+            anomalies = detect_anomalies(cost_matrix, is_monthly, yesterday)
+        if anomalies is not None:
+            run_metrics.set_counter('anomalies', len(anomalies))
+        
+        # 月末预测只累加报告日期的数据，不重新拟合历史数据
+        with run_metrics.stage('forecast'):
+            forecast = project_month_end(cost_matrix, is_monthly, yesterday)
+        if forecast is not None:
+            run_metrics.set_counter('forecast_month_end_total', forecast.total()[1])
+        
+        print_rate_limiter_stats(rate_limiter)
+        assume_role_calls, credential_hits = print_credential_stats(client_cache.credential_cache, credential_stats)
+        if assume_role_calls or credential_hits:
+            run_metrics.set_counter('sts_assume_role_calls', assume_role_calls)
+            run_metrics.set_counter('sts_credential_cache_hits', credential_hits)
+        limiter_stats = rate_limiter.stats()
+        run_metrics.set_counter('accounts_reported', len(account_details))
+        run_metrics.set_counter('api_calls', limiter_stats['requests'])
+        run_metrics.set_counter('api_retries', limiter_stats['retries'])
+        run_metrics.set_counter('api_throttled', limiter_stats['throttled'])
+        run_metrics.set_counter('api_wait_seconds', limiter_stats['wait_seconds'] + limiter_stats['backoff_seconds'])
+        run_metrics.set_counter('cost_current_total', yesterday_total)
+        run_metrics.set_counter('cost_previous_total', day_before_total)
         
         print(f"\n汇总结果:")
         if is_monthly:
@@ -171,59 +997,567 @@ def main():
             print(f"  前天总成本: ${day_before_total:,.2f}")
         print(f"  服务数量: {len(set(all_yesterday_costs.keys()) | set(all_day_before_costs.keys()))}")
         
-        # 生成HTML报告
-        html_report = ReportGenerator.generate_html_report(
-            yesterday_costs=all_yesterday_costs,
-            day_before_costs=all_day_before_costs,
-            yesterday_total=yesterday_total,
-            day_before_total=day_before_total,
-            yesterday_date=yesterday,
-            day_before_date=day_before,
-            account_details=account_details,  # 传递账号明细
-            is_monthly=is_monthly  # 传递报表类型
-        )
+        # 报告大小预算（未配置任何选项时不限制）
+        size_budget = build_size_budget()
+        
+        # 可选：将完整报告逐段写入本地文件
+        if REPORT_OUTPUT_PATH:
+            with open(REPORT_OUTPUT_PATH, 'w', encoding='utf-8') as report_file:
+                ReportGenerator.write_html_report(
+                    report_file,
+                    yesterday_costs=all_yesterday_costs,
+                    day_before_costs=all_day_before_costs,
+                    yesterday_total=yesterday_total,
+                    day_before_total=day_before_total,
+                    yesterday_date=yesterday,
+                    day_before_date=day_before,
+                    account_details=account_details,
+                    is_monthly=is_monthly,
+                    cost_matrix=cost_matrix,
+                    size_budget=size_budget,
+                    extra_metrics=extra_metrics,
+                    trends=trends,
+                    trend_services=REPORT_TREND_SERVICES,
+                    anomalies=anomalies,
+                    anomaly_rows=ANOMALY_MAX_ROWS,
+                    forecast=forecast,
+                    forecast_services=FORECAST_SERVICES,
+                    drilldown_top_k=REPORT_DRILLDOWN_TOP_K
+                )
+            print(f"报告已保存到: {REPORT_OUTPUT_PATH}")
+        
+        # 根据报表类型生成邮件主题
+        subject = report_subject(is_monthly, yesterday)
+        
+        # 未配置报告路由时，所有收件人接收同一份完整报告
+        if not report_routes:
+            cc_recipients = get_email_cc_recipients(report_type)
+            report_routes = [{'name': None, 'accounts': '*', 'to': recipients, 'cc': cc_recipients, 'subject': None}]
+        
+        # 每个路由只渲染自己负责的账号，复用同一份数据和已计算的矩阵
+        messages = []
+        with run_metrics.stage('render'):
+            for route in report_routes:
+                rows = resolve_route_rows(route, cost_matrix.account_names)
+                if rows is None:
+                    route_matrix, route_details = cost_matrix, account_details
+                else:
+                    route_matrix = cost_matrix.subset(rows)
+                    route_details = [account_details[row] for row in rows]
+                if route['name'] is not None and not route_details:
+                    print(f"警告: 报告路由 {route['name']} 没有匹配到任何账号数据，已跳过")
+                    continue
+            
+                route_yesterday_costs, route_day_before_costs = route_matrix.service_cost_dicts()
+                html_report = ReportGenerator.generate_html_report(
+                    yesterday_costs=route_yesterday_costs,
+                    day_before_costs=route_day_before_costs,
+                    yesterday_total=route_matrix.current_total,
+                    day_before_total=route_matrix.previous_total,
+                    yesterday_date=yesterday,
+                    day_before_date=day_before,
+                    account_details=route_details,  # 传递账号明细
+                    is_monthly=is_monthly,  # 传递报表类型
+                    cost_matrix=route_matrix,
+                    size_budget=size_budget,
+                    extra_metrics=extra_metrics,
+                    trends=trends,
+                    trend_services=REPORT_TREND_SERVICES,
+                    anomalies=anomalies,
+                    anomaly_rows=ANOMALY_MAX_ROWS,
+                    forecast=forecast,
+                    forecast_services=FORECAST_SERVICES,
+                    drilldown_top_k=REPORT_DRILLDOWN_TOP_K
+                )
+                route_label = f" ({route['name']})" if route['name'] is not None else ''
+                report_bytes = len(html_report.encode('utf-8'))
+                run_metrics.increment('bytes_rendered', report_bytes)
+                print(f"报告{route_label}: {len(route_details)} 个账号, {report_bytes / 1024:,.1f} KB")
+                if size_budget and size_budget.max_bytes and report_bytes > size_budget.max_bytes:
+                    print(f"警告: 报告{route_label}超出 REPORT_MAX_BYTES（{size_budget.max_bytes} 字节），"
+                          f"报告头部、汇总和账号汇总表格始终完整输出")
+            
+                route_subject = route['subject'] or (f"{subject} - {route['name']}" if route['name'] is not None else subject)
+                
+                # 导出文件作为附件，按路由拆分的报告只附带该路由账号的数据
+                attachments = None
+                if EXPORT_ATTACH and export_paths:
+                    attachments = export_paths
+                    if rows is not None:
+                        attachments, _ = export_report_data(
+                            route_details, is_monthly, yesterday, day_before, COST_METRICS[0], route['name']
+                        )
+                messages.append({
+                    'from_addr': EMAIL_FROM,
+                    'to_addrs': route['to'],
+                    'subject': route_subject,
+                    'html_content': html_report,
+                    'from_name': EMAIL_FROM_NAME,
+                    'cc_addrs': route['cc'] or None,
+                    'attachments': attachments
+                })
         
-        # 发送邮件
+        # 通过同一个SMTP连接发送所有报告
         email_sender = EmailSender(
             smtp_server=SMTP_SERVER,
             smtp_port=SMTP_PORT,
             username=SMTP_USERNAME,
-            password=SMTP_PASSWORD
+            password=SMTP_PASSWORD,
+            starttls=SMTP_STARTTLS
         )
-        
-        # 根据报表类型获取收件人列表
-        recipients = get_email_recipients(REPORT_TYPE)
-        
-        if not recipients:
-            print(f"错误: 未配置 {REPORT_TYPE} 报表的收件人，请设置 EMAIL_TO_{REPORT_TYPE.upper()} 或 EMAIL_TO 环境变量")
+        with run_metrics.stage('send'):
+            results = email_sender.send_batch(messages)
+        delivered = [result for result in results if result.delivered]
+        run_metrics.set_counter('emails_sent', len(delivered))
+        run_metrics.set_counter('emails_failed', len(results) - len(delivered))
+        run_metrics.set_counter('bytes_sent', sum(result.size for result in delivered))
+        failed = [result for result in results if not result.delivered]
+        if failed:
+            print(f"错误: {len(failed)}/{len(results)} 封报告邮件发送失败: {', '.join(result.subject for result in failed)}")
             sys.exit(1)
         
-        # 根据报表类型获取抄送人列表
-        cc_recipients = get_email_cc_recipients(REPORT_TYPE)
-        
-        # 根据报表类型生成邮件主题
-        if is_monthly:
-            subject = f"AWS月度账单报告 - {yesterday.year}年{yesterday.month}月"
-        else:
-            subject = f"{EMAIL_SUBJECT} - {yesterday.strftime('%Y-%m-%d')}"
+        print("报告已成功生成并发送！")
         
+    except Exception as e:
+        print(f"错误: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        # 守护进程的缓存在多次运行之间复用，由守护进程关闭
+        if warm is None:
+            client_cache.close()
+            if cost_cache is not None:
+                cost_cache.close()
+
+
+def backfill(start_date, end_date):
+    """
+    回填历史账单数据到本地缓存
+    
+    每个账号只发起一次按天粒度的范围请求（自动分页），已缓存的日期不会重复请求。
+    
+    Args:
+        start_date: 开始日期（包含）
+        end_date: 结束日期（包含）
+    """
+    if not COST_CACHE_ENABLED:
+        print("错误: 回填需要启用本地缓存，请设置 COST_CACHE_ENABLED=true")
+        sys.exit(1)
+    
+    if start_date > end_date:
+        print("错误: --from 不能晚于 --to")
+        sys.exit(1)
+    
+    from aws_cost_explorer import AWSCostExplorer, ClientCache
+    from cost_cache import CostCache
+    from rate_limiter import AdaptiveRateLimiter
+    
+    aws_accounts = get_aws_accounts()
+    if not aws_accounts:
+        print("错误: 未配置AWS账号，请设置AWS_ACCOUNTS环境变量或在config.py中配置")
+        sys.exit(1)
+    
+    cost_cache = CostCache(COST_CACHE_PATH, COST_CACHE_FINAL_LAG_DAYS)
+    rate_limiter = AdaptiveRateLimiter(CE_RATE_LIMIT, CE_MIN_RATE)
+    client_cache = ClientCache(CE_MAX_POOL_CONNECTIONS, FETCH_MAX_WORKERS)
+    day_count = (end_date - start_date).days + 1
+    print(f"回填 {start_date.strftime('%Y-%m-%d')} 至 {end_date.strftime('%Y-%m-%d')} 共 {day_count} 天，{len(aws_accounts)} 个账号")
+    
+    def fetch_range(idx, account, deadline):
+        account_name = account.get('account_name', f'账号{idx}')
+        cost_explorer = AWSCostExplorer(
+            access_key_id=account.get('access_key_id'),
+            secret_access_key=account.get('secret_access_key'),
+            region=account.get('region', 'us-east-1'),
+            role_arn=account.get('role_arn'),
+            external_id=account.get('external_id'),
+            cache=cost_cache,
+            cache_key=account_name,
+            metrics=COST_METRICS,
+            rate_limiter=rate_limiter,
+            max_retries=CE_MAX_RETRIES,
+            backoff_base=CE_BACKOFF_BASE,
+            backoff_max=CE_BACKOFF_MAX,
+            client_cache=client_cache,
+            deadline=deadline
+        )
+        days = cost_explorer.get_daily_range_costs(start_date, end_date)
+        range_total = sum(sum(costs.values()) for costs in days.values())
+        print_line(f"  {account_name} - {len(days)} 天, 合计: ${range_total:,.2f}")
+        return days
+    
+    results = fetch_accounts_concurrently(
+        aws_accounts,
+        fetch_range,
+        max_workers=FETCH_MAX_WORKERS,
+        timeout=FETCH_ACCOUNT_TIMEOUT
+    )
+    
+    succeeded = sum(1 for result in results if result is not None)
+    print(f"\n回填完成: {succeeded}/{len(aws_accounts)} 个账号成功")
+    print_rate_limiter_stats(rate_limiter)
+    print_credential_stats(client_cache.credential_cache)
+    print(f"注: 最近 {COST_CACHE_FINAL_LAG_DAYS} 天内的数据尚未结算，不会写入缓存")
+    client_cache.close()
+    cost_cache.close()
+    
+    if succeeded < len(aws_accounts):
+        sys.exit(1)
+
+
+def fetch(report_type, output_path):
+    """
+    获取数据并保存为JSON（不生成报告、不发送邮件），供 render 命令使用
+    
+    Args:
+        report_type: 报表类型，'daily' 或 'monthly'
+        output_path: 输出的JSON文件路径
+    """
+    from aws_cost_explorer import ClientCache
+    from cost_cache import CostCache
+    from rate_limiter import AdaptiveRateLimiter
+    
+    aws_accounts = get_aws_accounts()
+    if not aws_accounts and BILLING_MODE.lower() != 'consolidated':
+        print("错误: 未配置AWS账号，请设置AWS_ACCOUNTS环境变量或在config.py中配置")
+        sys.exit(1)
+    
+    is_monthly = report_type.lower() == 'monthly'
+    yesterday, day_before = report_dates(report_type)
+    cost_cache = CostCache(COST_CACHE_PATH, COST_CACHE_FINAL_LAG_DAYS) if COST_CACHE_ENABLED else None
+    rate_limiter = AdaptiveRateLimiter(CE_RATE_LIMIT, CE_MIN_RATE)
+    client_cache = ClientCache(CE_MAX_POOL_CONNECTIONS, FETCH_MAX_WORKERS)
+    try:
+        account_details = fetch_report_details(
+            aws_accounts, is_monthly, yesterday, day_before, cost_cache, rate_limiter, client_cache=client_cache
+        )
+    finally:
+        client_cache.close()
+        if cost_cache is not None:
+            cost_cache.close()
+    print_rate_limiter_stats(rate_limiter)
+    print_credential_stats(client_cache.credential_cache)
+    
+    # 服务下钻的汇总树按列保存
+    for acc_detail in account_details:
+        if acc_detail.get('drilldown') is not None:
+            acc_detail['drilldown'] = acc_detail['drilldown'].to_dict()
+    
+    data = {
+        'report_type': report_type,
+        'yesterday': yesterday.isoformat(),
+        'day_before': day_before.isoformat(),
+        'metrics': COST_METRICS,
+        'account_details': account_details
+    }
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    print(f"已保存 {len(account_details)} 个账号的数据到: {output_path}")
+
+
+def render(input_path, output_path, route_name=None):
+    """
+    从 fetch 命令保存的JSON生成HTML报告（不访问AWS）
+    
+    Args:
+        input_path: fetch 命令输出的JSON文件路径
+        output_path: 输出的HTML文件路径
+        route_name: 可选，只包含该报告路由负责的账号
+    """
+    from cost_matrix import CostMatrix
+    from report_generator import ReportGenerator
+    
+    with open(input_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    is_monthly = data['report_type'].lower() == 'monthly'
+    yesterday = datetime.fromisoformat(data['yesterday'])
+    day_before = datetime.fromisoformat(data['day_before'])
+    account_details = data['account_details']
+    extra_metrics = select_extra_metrics(data['metrics'])
+    if any(acc_detail.get('drilldown') for acc_detail in account_details):
+        from cost_rollup import RollupTree
+        for acc_detail in account_details:
+            if acc_detail.get('drilldown'):
+                acc_detail['drilldown'] = RollupTree.from_dict(acc_detail['drilldown'])
+    cost_matrix = CostMatrix.from_account_details(account_details, extra_metrics)
+    
+    if route_name is not None:
+        route = next((route for route in get_report_routes() if route['name'] == route_name), None)
+        if route is None:
+            print(f"错误: 未找到报告路由 {route_name}")
+            sys.exit(1)
+        rows = resolve_route_rows(route, cost_matrix.account_names)
+        if rows is not None:
+            cost_matrix = cost_matrix.subset(rows)
+            account_details = [account_details[row] for row in rows]
+    
+    # 与 run 命令相同，配置了 EXPORT_FORMATS 时同时导出数据
+    export_report_data(account_details, is_monthly, yesterday, day_before, data['metrics'][0], route_name)
+    
+    # 本地缓存存在时从中读取趋势（不创建新的缓存文件）
+    trends = None
+    if COST_CACHE_ENABLED and REPORT_TREND_DAYS and os.path.exists(COST_CACHE_PATH):
+        from cost_cache import CostCache
+        cost_cache = CostCache(COST_CACHE_PATH, COST_CACHE_FINAL_LAG_DAYS)
+        try:
+            trends = load_trends(cost_cache, account_details, is_monthly, yesterday, data['metrics'][0])
+        finally:
+            cost_cache.close()
+    
+    # 重新生成报告不更新异常检测和月末预测状态（状态已包含该天时按重新统计该天计算）
+    anomalies = None
+    if os.path.exists(ANOMALY_STATE_PATH):
+        anomalies = detect_anomalies(cost_matrix, is_monthly, yesterday, persist=False)
+    forecast = None
+    if os.path.exists(FORECAST_STATE_PATH):
+        forecast = project_month_end(cost_matrix, is_monthly, yesterday, persist=False)
+    
+    yesterday_costs, day_before_costs = cost_matrix.service_cost_dicts()
+    with open(output_path, 'w', encoding='utf-8') as report_file:
+        ReportGenerator.write_html_report(
+            report_file,
+            yesterday_costs=yesterday_costs,
+            day_before_costs=day_before_costs,
+            yesterday_total=cost_matrix.current_total,
+            day_before_total=cost_matrix.previous_total,
+            yesterday_date=yesterday,
+            day_before_date=day_before,
+            account_details=account_details,
+            is_monthly=is_monthly,
+            cost_matrix=cost_matrix,
+            size_budget=build_size_budget(),
+            extra_metrics=extra_metrics,
+            trends=trends,
+            trend_services=REPORT_TREND_SERVICES,
+            anomalies=anomalies,
+            anomaly_rows=ANOMALY_MAX_ROWS,
+            forecast=forecast,
+            forecast_services=FORECAST_SERVICES,
+            drilldown_top_k=REPORT_DRILLDOWN_TOP_K
+        )
+    print(f"报告已保存到: {output_path}（{len(account_details)} 个账号）")
+    print(f"邮件主题: {report_subject(is_monthly, yesterday)}")
+
+
+def send(html_path, subject, report_type=REPORT_TYPE, to_addrs=None, cc_addrs=None):
+    """
+    发送已生成的HTML报告
+    
+    Args:
+        html_path: HTML报告文件路径
+        subject: 邮件主题
+        report_type: 报表类型，未指定收件人时用于选择收件人配置
+        to_addrs: 可选，收件人列表，默认根据报表类型
+        cc_addrs: 可选，抄送人列表，默认根据报表类型
+    """
+    from email_sender import EmailSender
+    
+    recipients = to_addrs or get_email_recipients(report_type)
+    if not EMAIL_FROM or not recipients:
+        print("错误: 请配置EMAIL_FROM和收件人")
+        sys.exit(1)
+    if not SMTP_USERNAME or not SMTP_PASSWORD:
+        print("错误: 请配置SMTP_USERNAME和SMTP_PASSWORD环境变量或在config.py中设置")
+        sys.exit(1)
+    
+    with open(html_path, 'r', encoding='utf-8') as f:
+        html_report = f.read()
+    
+    email_sender = EmailSender(
+        smtp_server=SMTP_SERVER,
+        smtp_port=SMTP_PORT,
+        username=SMTP_USERNAME,
+        password=SMTP_PASSWORD,
+        starttls=SMTP_STARTTLS
+    )
+    try:
         email_sender.send_email(
             from_addr=EMAIL_FROM,
             to_addrs=recipients,
             subject=subject,
             html_content=html_report,
             from_name=EMAIL_FROM_NAME,
-            cc_addrs=cc_recipients if cc_recipients else None
+            cc_addrs=cc_addrs if cc_addrs is not None else get_email_cc_recipients(report_type) or None
         )
-        
-        print("报告已成功生成并发送！")
-        
-    except Exception as e:
-        print(f"错误: {str(e)}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
         sys.exit(1)
 
 
+def validate_config():
+    """
+    检查配置（只读取配置和账号文件，不访问AWS和邮件服务器），有错误时退出码为1
+    """
+    errors = []
+    warnings = []
+    
+    if REPORT_TYPE.lower() not in ('daily', 'monthly'):
+        errors.append(f"REPORT_TYPE 应为 daily 或 monthly，当前为 {REPORT_TYPE}")
+    if BILLING_MODE.lower() not in ('per_account', 'consolidated'):
+        errors.append(f"BILLING_MODE 应为 per_account 或 consolidated，当前为 {BILLING_MODE}")
+    is_consolidated = BILLING_MODE.lower() == 'consolidated'
+    
+    aws_accounts = get_aws_accounts()
+    if not aws_accounts and not is_consolidated:
+        errors.append("未配置AWS账号，请设置AWS_ACCOUNTS环境变量或创建账号配置文件")
+    account_names = set()
+    for idx, account in enumerate(aws_accounts, 1):
+        if not isinstance(account, dict):
+            errors.append(f"账号配置第 {idx} 项应为对象")
+            continue
+        name = account.get('account_name', f'账号{idx}')
+        if name in account_names:
+            warnings.append(f"账号名称重复: {name}（本地缓存和报告路由按名称区分账号）")
+        account_names.add(name)
+        has_key = bool(account.get('access_key_id'))
+        role_arn = account.get('role_arn')
+        if role_arn:
+            if not re.fullmatch(r'arn:aws[\w-]*:iam::\d{12}:role/.+', str(role_arn)):
+                errors.append(f"账号 {name} 的 role_arn 格式错误: {role_arn}")
+            if has_key or account.get('secret_access_key'):
+                errors.append(f"账号 {name} 不能同时配置 role_arn 和访问密钥")
+        elif has_key != bool(account.get('secret_access_key')):
+            errors.append(f"账号 {name} 的 access_key_id 和 secret_access_key 需要同时配置")
+        elif not has_key and not is_consolidated:
+            warnings.append(f"账号 {name} 未配置访问密钥或 role_arn，将使用默认凭证链")
+    if any(isinstance(account, dict) and account.get('role_arn') for account in aws_accounts):
+        if not 900 <= ASSUME_ROLE_DURATION <= 43200:
+            errors.append("ASSUME_ROLE_DURATION 应在900和43200秒之间")
+        elif ASSUME_ROLE_REFRESH_MARGIN >= ASSUME_ROLE_DURATION:
+            warnings.append("ASSUME_ROLE_REFRESH_MARGIN 不小于 ASSUME_ROLE_DURATION，每次都会重新扮演角色")
+    if is_consolidated and sum(1 for account in aws_accounts if isinstance(account, dict) and account.get('payer')) > 1:
+        warnings.append("配置了多个付款账号（payer），只使用第一个")
+    
+    unsupported = [metric for metric in COST_METRICS if metric not in SUPPORTED_COST_METRICS]
+    if unsupported:
+        errors.append(f"COST_METRICS 中有不支持的指标: {', '.join(unsupported)}")
+    if not COST_METRICS:
+        errors.append("COST_METRICS 不能为空")
+    ignored = [metric for metric in REPORT_EXTRA_METRICS if metric not in COST_METRICS[1:]]
+    if ignored:
+        warnings.append(f"REPORT_EXTRA_METRICS 中不在 COST_METRICS 里（或为主指标）的指标将被忽略: {', '.join(ignored)}")
+    
+    if MONTHLY_FROM_DAILY and not COST_CACHE_ENABLED:
+        warnings.append("MONTHLY_FROM_DAILY 需要启用本地缓存（COST_CACHE_ENABLED=true），月报表将从API获取")
+    if MONTHLY_RECONCILE_TOLERANCE < 0:
+        errors.append("MONTHLY_RECONCILE_TOLERANCE 不能为负数")
+    if ANOMALY_DETECTION_ENABLED:
+        if ANOMALY_HALF_LIFE_DAYS <= 0:
+            errors.append("ANOMALY_HALF_LIFE_DAYS 必须大于0")
+        if ANOMALY_Z_THRESHOLD <= 0:
+            errors.append("ANOMALY_Z_THRESHOLD 必须大于0")
+        if ANOMALY_MIN_HISTORY < 2:
+            warnings.append("ANOMALY_MIN_HISTORY 小于2时，序列的方差尚未建立就会参与检测")
+    if FORECAST_ENABLED and not 0 < FORECAST_CONFIDENCE < 1:
+        errors.append("FORECAST_CONFIDENCE 应在0和1之间")
+    if REPORT_DRILLDOWN:
+        if len(REPORT_DRILLDOWN) > 2:
+            errors.append("REPORT_DRILLDOWN 最多2级（Cost Explorer 每次查询最多按2个维度分组）")
+        invalid = [
+            level for level in REPORT_DRILLDOWN
+            if level not in ('USAGE_TYPE', 'REGION', 'AZ', 'INSTANCE_TYPE', 'OPERATION', 'PURCHASE_TYPE')
+            and not (level.startswith('TAG:') and len(level) > 4)
+        ]
+        if invalid:
+            errors.append(f"REPORT_DRILLDOWN 中有不支持的分组: {', '.join(invalid)}")
+        if len(set(REPORT_DRILLDOWN)) < len(REPORT_DRILLDOWN):
+            errors.append("REPORT_DRILLDOWN 中的分组不能重复")
+        if is_consolidated and len(REPORT_DRILLDOWN) > 1:
+            warnings.append("整合账单模式下只使用 REPORT_DRILLDOWN 的第一级（需要按关联账号分组）")
+        if REPORT_DRILLDOWN_SERVICES <= 0:
+            warnings.append("REPORT_DRILLDOWN_SERVICES 不大于0，不会下钻任何服务")
+    invalid = [export_format for export_format in EXPORT_FORMATS if export_format not in ('jsonl', 'csv', 'columnar')]
+    if invalid:
+        errors.append(f"EXPORT_FORMATS 中有不支持的格式: {', '.join(invalid)}")
+    if EXPORT_ATTACH and not EXPORT_FORMATS:
+        warnings.append("EXPORT_ATTACH 需要配置 EXPORT_FORMATS，邮件不会附带导出文件")
+    
+    report_routes = get_report_routes()
+    for route in report_routes:
+        # 整合账单模式下账号名称也可能来自API返回的关联账号名称
+        if route['accounts'] != '*' and not is_consolidated:
+            unknown = [name for name in route['accounts'] if name not in account_names]
+            if unknown:
+                warnings.append(f"报告路由 {route['name']} 中的账号未配置: {', '.join(unknown)}")
+    
+    if not EMAIL_FROM:
+        errors.append("未配置EMAIL_FROM")
+    if not report_routes and not get_email_recipients(REPORT_TYPE):
+        errors.append(f"未配置收件人，请设置EMAIL_TO_{REPORT_TYPE.upper()}或EMAIL_TO")
+    if not SMTP_USERNAME or not SMTP_PASSWORD:
+        errors.append("未配置SMTP_USERNAME或SMTP_PASSWORD")
+    
+    print(f"账号: {len(aws_accounts)} 个, 报告路由: {len(report_routes)} 个, "
+          f"报表类型: {REPORT_TYPE}, 账单模式: {BILLING_MODE}, 成本指标: {', '.join(COST_METRICS)}")
+    for warning in warnings:
+        print(f"警告: {warning}")
+    for error in errors:
+        print(f"错误: {error}")
+    if errors:
+        print(f"配置检查失败: {len(errors)} 个错误")
+        sys.exit(1)
+    print("配置检查通过")
+
+
+def parse_date(value):
+    """解析 YYYY-MM-DD 格式的日期参数"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"日期格式错误: {value}，应为 YYYY-MM-DD")
+
+
+def parse_addresses(value):
+    """解析逗号分隔的邮箱地址参数"""
+    return [email.strip() for email in value.split(',') if email.strip()]
+
+
+def parse_args(argv=None):
+    """解析命令行参数，不带子命令时生成并发送报告"""
+    parser = argparse.ArgumentParser(description='AWS账单报告')
+    parser.set_defaults(report_type=REPORT_TYPE)
+    subparsers = parser.add_subparsers(dest='command')
+    report_types = ['daily', 'monthly']
+    
+    run_parser = subparsers.add_parser('run', help='获取数据、生成报告并发送邮件（默认）')
+    run_parser.add_argument('--report-type', choices=report_types, default=REPORT_TYPE, help='报表类型，默认 REPORT_TYPE')
+    
+    fetch_parser = subparsers.add_parser('fetch', help='获取数据并保存为JSON')
+    fetch_parser.add_argument('--report-type', choices=report_types, default=REPORT_TYPE, help='报表类型，默认 REPORT_TYPE')
+    fetch_parser.add_argument('--output', required=True, help='输出的JSON文件路径')
+    
+    render_parser = subparsers.add_parser('render', help='从 fetch 保存的JSON生成HTML报告（不访问AWS）')
+    render_parser.add_argument('--input', required=True, help='fetch 输出的JSON文件路径')
+    render_parser.add_argument('--output', required=True, help='输出的HTML文件路径')
+    render_parser.add_argument('--route', help='只包含该报告路由负责的账号')
+    
+    send_parser = subparsers.add_parser('send', help='发送已生成的HTML报告')
+    send_parser.add_argument('--html', required=True, help='HTML报告文件路径')
+    send_parser.add_argument('--subject', required=True, help='邮件主题（render 命令会输出默认主题）')
+    send_parser.add_argument('--report-type', choices=report_types, default=REPORT_TYPE, help='未指定收件人时按报表类型选择收件人')
+    send_parser.add_argument('--to', type=parse_addresses, help='收件人，逗号分隔')
+    send_parser.add_argument('--cc', type=parse_addresses, help='抄送人，逗号分隔')
+    
+    subparsers.add_parser('validate-config', help='检查配置（不访问AWS和邮件服务器）')
+    
+    backfill_parser = subparsers.add_parser('backfill', help='回填历史账单数据到本地缓存')
+    backfill_parser.add_argument('--from', dest='start_date', type=parse_date, required=True, help='开始日期 YYYY-MM-DD（包含）')
+    backfill_parser.add_argument('--to', dest='end_date', type=parse_date, required=True, help='结束日期 YYYY-MM-DD（包含）')
+    
+    return parser.parse_args(argv)
+
+
 if __name__ == '__main__':
-    main()
+    args = parse_args()
+    if args.command == 'backfill':
+        backfill(args.start_date, args.end_date)
+    elif args.command == 'fetch':
+        fetch(args.report_type, args.output)
+    elif args.command == 'render':
+        render(args.input, args.output, args.route)
+    elif args.command == 'send':
+        send(args.html, args.subject, args.report_type, args.to, args.cc)
+    elif args.command == 'validate-config':
+        validate_config()
+    else:
+        main(args.report_type)
@@ -0,0 +1,114 @@
+"""
+API限流模块
+所有线程共享的令牌桶限流器，遇到限流时降低请求速率，连续成功后逐步恢复
+"""
+import random
+import threading
+import time
+from typing import Dict
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, rate: float = 5.0, min_rate: float = 0.5, increase_step: float = 0.1,
+                 decrease_factor: float = 0.5, cooldown: float = 1.0):
+        """
+        初始化自适应令牌桶限流器（线程安全）
+
+        Args:
+            rate: 初始及最大请求速率（次/秒）
+            min_rate: 遇到限流时速率的下限（次/秒）
+            increase_step: 每次请求成功后速率的增加量（次/秒），不超过初始速率
+            decrease_factor: 遇到限流时速率乘以的系数
+            cooldown: 两次降速之间的最小间隔（秒），避免并发请求同时被限流时连续降速
+        """
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+
+        self._lock = threading.Lock()
+        # 令牌数可以为负数，表示已经预约、需要等待的请求
+        self._tokens = 1.0
+        self._updated_at = time.monotonic()
+        self._decreased_at = 0.0
+
+        # 统计计数
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self.wait_seconds = 0.0
+        self.backoff_seconds = 0.0
+
+    def _refill(self, now: float):
+        """按经过的时间补充令牌（容量为1秒的请求量，至少1个）"""
+        capacity = max(1.0, self.rate)
+        self._tokens = min(capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self):
+        """
+        获取一个令牌，必要时阻塞等待（在锁外等待，不阻塞其他线程预约）
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1.0
+            self.requests += 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.wait_seconds += wait
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_success(self):
+        """请求成功：速率逐步恢复到初始速率"""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_throttle(self):
+        """请求被限流：降低速率，并清空已积累的令牌"""
+        with self._lock:
+            now = time.monotonic()
+            self.throttled += 1
+            if now - self._decreased_at < self.cooldown:
+                return
+            self._decreased_at = now
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self._tokens = min(self._tokens, 0.0)
+
+    def backoff(self, attempt: int, base_delay: float = 1.0, max_delay: float = 30.0) -> float:
+        """
+        重试前按指数退避等待（带随机抖动）
+
+        Args:
+            attempt: 第几次重试（从0开始）
+            base_delay: 第一次重试的最大等待时间（秒）
+            max_delay: 单次等待时间上限（秒）
+
+        Returns:
+            实际等待的秒数
+        """
+        delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+        with self._lock:
+            self.retries += 1
+            self.backoff_seconds += delay
+        time.sleep(delay)
+        return delay
+
+    def stats(self) -> Dict[str, float]:
+        """
+        返回统计信息
+        """
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'throttled': self.throttled,
+                'retries': self.retries,
+                'wait_seconds': round(self.wait_seconds, 3),
+                'backoff_seconds': round(self.backoff_seconds, 3),
+                'rate': round(self.rate, 3),
+            }
@@ -1,11 +1,64 @@
 """
 报告生成模块
 """
-from typing import Dict, Tuple
+import itertools
+from html import escape
+from typing import Dict, Iterator, List, TextIO, Tuple
 from datetime import datetime
 
+import report_templates
+from cost_matrix import CostMatrix
+from cost_forecast import MonthEndForecast
+from cost_rollup import RollupTree
+from cost_trends import CostTrends, WINDOW
+
+
+class ReportSizeBudget:
+    def __init__(self, top_n: int = None, collapse_tail: bool = True, drop_zero_rows: bool = False, max_bytes: int = None):
+        """
+        报告大小预算（例如 Gmail 会截断超过约102KB的HTML邮件）
+        
+        总计行始终使用完整数据计算，不受以下选项影响。
+        
+        Args:
+            top_n: 每个账号只显示费用最高的前N个服务，None表示全部显示
+            collapse_tail: 超出前N个的服务是否合并为一行"其他 (k 个服务)"，False则直接省略
+            drop_zero_rows: 是否去掉两个周期金额都为 $0.00 的服务行
+            max_bytes: HTML的最大字节数（UTF-8），生成时按顺序省略放不下的总览可选章节（异常、月末预测、趋势）
+                和账号服务明细表格（没有账号明细时为服务行）；文档头部、汇总和账号汇总表格始终完整输出，
+                这部分本身超出预算时报告会超过 max_bytes
+        """
+        self.top_n = top_n
+        self.collapse_tail = collapse_tail
+        self.drop_zero_rows = drop_zero_rows
+        self.max_bytes = max_bytes
+
 
 class ReportGenerator:
+    # 附加指标列的显示名称
+    METRIC_LABELS = {
+        'UnblendedCost': '未混合成本',
+        'AmortizedCost': '摊销成本',
+        'BlendedCost': '混合成本',
+        'NetUnblendedCost': '净未混合成本',
+        'NetAmortizedCost': '净摊销成本',
+        'NormalizedUsageAmount': '标准化使用量',
+        'UsageQuantity': '使用量',
+    }
+    
+    # 使用量类指标不是金额，不显示货币符号
+    USAGE_METRICS = ('NormalizedUsageAmount', 'UsageQuantity')
+    
+    # 服务下钻分组的显示名称（标签分组显示为 "标签 <标签键>"）
+    GROUP_LABELS = {
+        'USAGE_TYPE': '使用类型',
+        'REGION': '区域',
+        'AZ': '可用区',
+        'INSTANCE_TYPE': '实例类型',
+        'OPERATION': '操作',
+        'PURCHASE_TYPE': '购买类型',
+    }
+    
     @staticmethod
     def calculate_change(current: float, previous: float) -> Tuple[float, float, str]:
         """
@@ -49,6 +102,42 @@ class ReportGenerator:
         """
         return f"${amount:,.2f}"
     
+    @staticmethod
+    def format_metric(metric: str, amount: float) -> str:
+        """
+        格式化附加指标的显示（金额类指标显示为货币，使用量类指标显示为数字）
+        """
+        if metric in ReportGenerator.USAGE_METRICS:
+            return f"{amount:,.2f}"
+        return ReportGenerator.format_currency(amount)
+    
+    @staticmethod
+    def _extra_cells(metrics: List[str], values: Tuple[float, ...]) -> Dict[str, str]:
+        """
+        附加指标列的模板字段 {extra0: 格式化值, ...}
+        """
+        format_metric = ReportGenerator.format_metric
+        return {f"extra{n}": format_metric(metric, value) for n, (metric, value) in enumerate(zip(metrics, values))}
+    
+    @staticmethod
+    def _trend_cells(trends: CostTrends, column: int, trend: Tuple = None) -> Dict[str, str]:
+        """
+        服务明细表格中走势列的模板字段 {extra<column>: 走势图和周环比}，没有趋势数据时为空字典（表格没有走势列）
+        
+        Args:
+            trends: 报告使用的 CostTrends，None 表示没有走势列
+            column: 走势列的附加列序号（附加指标列之后）
+            trend: 该行的趋势元组，None 表示本地缓存中没有该行的数据
+        """
+        if trends is None:
+            return {}
+        if trend is None:
+            return {f"extra{column}": '-'}
+        spark, _, _, _, change_percent, color = trend
+        return {f"extra{column}": report_templates.get_template('trend_cell').render(
+            spark=spark, color=color, change_percent=change_percent
+        )}
+    
     @staticmethod
     def generate_html_report(
         yesterday_costs: Dict[str, float],
@@ -58,7 +147,17 @@ class ReportGenerator:
         yesterday_date: datetime,
         day_before_date: datetime,
         account_details: list = None,
-        is_monthly: bool = False
+        is_monthly: bool = False,
+        cost_matrix: CostMatrix = None,
+        size_budget: ReportSizeBudget = None,
+        extra_metrics: List[str] = None,
+        trends: CostTrends = None,
+        trend_services: int = 10,
+        anomalies: List[dict] = None,
+        anomaly_rows: int = 20,
+        forecast: MonthEndForecast = None,
+        forecast_services: int = 10,
+        drilldown_top_k: int = 5
     ) -> str:
         """
         生成HTML格式的报告
@@ -72,49 +171,118 @@ class ReportGenerator:
             day_before_date: 前天的日期
             account_details: 可选，每个账号的明细数据列表
             is_monthly: 是否为月报表
+            cost_matrix: 可选，由 account_details 构建的 CostMatrix（未提供时自动构建）
+            size_budget: 可选，报告大小预算（前N个服务、长尾合并、去掉零费用行、最大字节数）
+            extra_metrics: 可选，作为附加列显示的指标（如 ['AmortizedCost']），数据来自账号明细的
+                yesterday_metrics，与主指标在同一次请求中获取；没有账号明细时不显示
+            trends: 可选，由本地缓存的日数据构建的 CostTrends，显示趋势章节并在服务明细中增加走势列；
+                没有账号明细时不显示
+            trend_services: 趋势章节中显示的费用最高的服务数
+            anomalies: 可选，cost_anomalies.AnomalyDetector.observe 返回的异常列表（按偏离金额排序），
+                在报告开头显示高亮的异常章节；只显示报告中的账号，没有异常时不显示
+            anomaly_rows: 异常章节最多显示的行数，0 表示全部显示
+            forecast: 可选，cost_forecast.ForecastModel.project 返回的月末预测，显示预测月末总成本和置信区间；
+                没有账号明细时不显示
+            forecast_services: 月末预测章节中显示的预测费用最高的服务数
+            drilldown_top_k: 账号明细中有 drilldown（cost_rollup.RollupTree）的服务展开下一级分组，
+                每一级显示金额变化最大的子项数，其余合并为一行，0 表示全部显示
             
         Returns:
             HTML字符串
         """
-        # 获取所有服务名称（合并两天的服务）
-        all_services = set(yesterday_costs.keys()) | set(day_before_costs.keys())
+        return ''.join(ReportGenerator.iter_html_report(
+            yesterday_costs, day_before_costs, yesterday_total, day_before_total,
+            yesterday_date, day_before_date, account_details, is_monthly, cost_matrix, size_budget,
+            extra_metrics, trends, trend_services, anomalies, anomaly_rows, forecast, forecast_services,
+            drilldown_top_k
+        ))
+    
+    @staticmethod
+    def write_html_report(sink: TextIO, *args, **kwargs) -> int:
+        """
+        将HTML报告逐段写入文件类对象（参数同 generate_html_report）
+        
+        Args:
+            sink: 任何带 write(str) 方法的对象，例如打开的文件或 io.StringIO
+            
+        Returns:
+            写入的字符数
+        """
+        written = 0
+        for chunk in ReportGenerator.iter_html_report(*args, **kwargs):
+            sink.write(chunk)
+            written += len(chunk)
+        return written
+    
+    @staticmethod
+    def iter_html_report(
+        yesterday_costs: Dict[str, float],
+        day_before_costs: Dict[str, float],
+        yesterday_total: float,
+        day_before_total: float,
+        yesterday_date: datetime,
+        day_before_date: datetime,
+        account_details: list = None,
+        is_monthly: bool = False,
+        cost_matrix: CostMatrix = None,
+        size_budget: ReportSizeBudget = None,
+        extra_metrics: List[str] = None,
+        trends: CostTrends = None,
+        trend_services: int = 10,
+        anomalies: List[dict] = None,
+        anomaly_rows: int = 20,
+        forecast: MonthEndForecast = None,
+        forecast_services: int = 10,
+        drilldown_top_k: int = 5
+    ) -> Iterator[str]:
+        """
+        逐段生成HTML报告（参数同 generate_html_report）
         
-        # 按昨天的费用从高到低排序
-        # 创建一个包含服务名和费用的列表，然后按费用降序排序
-        services_with_costs = [
-            (service, yesterday_costs.get(service, 0.0))
-            for service in all_services
-        ]
-        services_with_costs.sort(key=lambda x: x[1], reverse=True)  # 按费用降序排序
-        sorted_services = [service for service, _ in services_with_costs]
+        按章节和表格行依次产出字符串片段，不在内存中拼接整份文档，
+        可以直接写入文件或邮件正文；所有片段拼接后与 generate_html_report 的结果完全一致。
+        静态骨架和行模板来自 report_templates 中预编译并缓存的模板，
+        每一行的金额、变化和排序直接读取 CostMatrix 中批量计算好的结果。
+        
+        Yields:
+            HTML字符串片段
+        """
+        format_currency = ReportGenerator.format_currency
+        
+        extra_metrics = list(extra_metrics or ()) if account_details else []
+        if account_details and (cost_matrix is None or cost_matrix.extra_metrics != extra_metrics):
+            cost_matrix = CostMatrix.from_account_details(account_details, extra_metrics)
+        extra_count = len(extra_metrics)
+        
+        # 趋势只保留报告中的账号（例如报告路由负责的账号），合计按这些账号重新计算
+        if not account_details:
+            trends = None
+        elif trends is not None and set(trends.account_names) - set(cost_matrix.account_names):
+            trends = trends.subset(cost_matrix.account_names)
+        
+        # 异常同样只保留报告中的账号
+        if anomalies and account_details:
+            reported = set(cost_matrix.account_names)
+            anomalies = [anomaly for anomaly in anomalies if anomaly['account'] in reported]
+        
+        # 月末预测同样只保留报告中的账号，合计按这些账号重新计算
+        if not account_details:
+            forecast = None
+        elif forecast is not None and set(forecast.account_names) - set(cost_matrix.account_names):
+            forecast = forecast.subset(cost_matrix.account_names)
+            if not forecast.account_names:
+                forecast = None
         
         # 计算总成本变化
         total_change, total_change_percent, total_color = ReportGenerator.calculate_change(
             yesterday_total, day_before_total
         )
-        
-        # 生成服务表格行
-        service_rows = []
-        for service in sorted_services:
-            yesterday_cost = yesterday_costs.get(service, 0.0)
-            day_before_cost = day_before_costs.get(service, 0.0)
-            change, change_percent, color = ReportGenerator.calculate_change(
-                yesterday_cost, day_before_cost
-            )
-            
-            # 格式化显示
-            change_str = ReportGenerator.format_currency(change)
-            change_percent_str = f"{change_percent:+.2f}%"
-            
-            service_rows.append(f"""
-            <tr>
-                <td>{service}</td>
-                <td>{ReportGenerator.format_currency(yesterday_cost)}</td>
-                <td>{ReportGenerator.format_currency(day_before_cost)}</td>
-                <td style="color: {color}; font-weight: bold;">{change_str}</td>
-                <td style="color: {color}; font-weight: bold;">{change_percent_str}</td>
-            </tr>
-            """)
+        total_cells = {
+            'current': format_currency(yesterday_total),
+            'previous': format_currency(day_before_total),
+            'color': total_color,
+            'change': format_currency(total_change),
+            'change_percent': total_change_percent
+        }
         
         # 根据报表类型格式化日期
         if is_monthly:
@@ -124,278 +292,555 @@ class ReportGenerator:
             yesterday_str = yesterday_date.strftime('%Y年%m月%d日')
             day_before_str = day_before_date.strftime('%Y年%m月%d日')
         
-        # 生成账号汇总表格（如果有多账号）
-        account_summary_rows = ""
-        if account_details and len(account_details) > 1:
-            for acc_detail in account_details:
-                acc_name = acc_detail['account_name']
-                acc_yesterday_total = acc_detail['yesterday_total']
-                acc_day_before_total = acc_detail['day_before_total']
-                acc_change, acc_change_percent, acc_color = ReportGenerator.calculate_change(
-                    acc_yesterday_total, acc_day_before_total
+        # 附加指标列的表头（显示较新周期的值）
+        extra_labels = {
+            f"extra_label{n}": f"{yesterday_str} {ReportGenerator.METRIC_LABELS.get(metric, metric)}"
+            for n, metric in enumerate(extra_metrics)
+        }
+        
+        max_bytes = size_budget.max_bytes if size_budget else None
+        written = 0
+        
+        if not account_details:
+            # 没有账号明细时，显示所有账号汇总的服务明细
+            table_start = (
+                report_templates.get_template('details_open', ' ' * 8).render(
+                    title='按服务分组的账单明细（所有账号汇总）'
+                ),
+                report_templates.get_template('table_head', ' ' * 12).render(
+                    name_header='服务名称',
+                    current_label=yesterday_str if is_monthly else yesterday_str + ' 成本',
+                    previous_label=day_before_str if is_monthly else day_before_str + ' 成本'
                 )
-                account_summary_rows += f"""
-                <tr>
-                    <td>{acc_name}</td>
-                    <td>{ReportGenerator.format_currency(acc_yesterday_total)}</td>
-                    <td>{ReportGenerator.format_currency(acc_day_before_total)}</td>
-                    <td style="color: {acc_color}; font-weight: bold;">{ReportGenerator.format_currency(acc_change)}</td>
-                    <td style="color: {acc_color}; font-weight: bold;">{acc_change_percent:+.2f}%</td>
-                </tr>
-                """
-        
-        # 为每个账号生成独立的服务明细表格
-        account_service_tables = ""
-        if account_details:
-            for acc_detail in account_details:
-                acc_name = acc_detail['account_name']
-                acc_yesterday_costs = acc_detail['yesterday_costs']
-                acc_day_before_costs = acc_detail['day_before_costs']
-                acc_yesterday_total = acc_detail['yesterday_total']
-                acc_day_before_total = acc_detail['day_before_total']
-                
-                # 获取该账号的所有服务
-                acc_all_services = set(acc_yesterday_costs.keys()) | set(acc_day_before_costs.keys())
-                
-                # 按昨天的费用从高到低排序
-                acc_services_with_costs = [
-                    (service, acc_yesterday_costs.get(service, 0.0))
-                    for service in acc_all_services
-                ]
-                acc_services_with_costs.sort(key=lambda x: x[1], reverse=True)
-                acc_sorted_services = [service for service, _ in acc_services_with_costs]
-                
-                # 计算该账号的总成本变化
-                acc_change, acc_change_percent, acc_color = ReportGenerator.calculate_change(
-                    acc_yesterday_total, acc_day_before_total
+            )
+            table_end = (
+                report_templates.get_template('total_row', ' ' * 20).render(**total_cells),
+                report_templates.table_close(' ' * 12, ' ' * 8, True)
+            )
+            service_matrix = CostMatrix.from_costs(yesterday_costs, day_before_costs)
+        
+        # 文档头部、汇总和账号汇总表格始终完整输出（保证总计金额完整），并统计已输出的字节数；
+        # 有字节预算时，总览中的可选章节按 异常、月末预测、趋势 的顺序只输出放得下的部分，
+        # 需要为明细部分至少保留省略提示和文档结尾（没有账号明细时还有表头和总计行）
+        drill_rows = bool(account_details) and ReportGenerator._has_drill_rows(cost_matrix, account_details, size_budget)
+        
+        def render_overview(sections: dict, omitted_sections: List[str]) -> Iterator[str]:
+            return ReportGenerator._iter_overview(
+                cost_matrix, account_details, is_monthly, yesterday_str, day_before_str, total_cells, extra_labels,
+                sections.get('趋势'), trend_services, sections.get('成本异常'), anomaly_rows,
+                sections.get('月末预测'), forecast_services, drill_rows, omitted_sections
+            )
+        
+        sections = {'成本异常': anomalies or None, '月末预测': forecast, '趋势': trends}
+        omitted_sections = []
+        if max_bytes:
+            if account_details:
+                detail_reserved = report_templates.get_template('omitted_notice', ' ' * 8).render(
+                    count=len(account_details)
                 )
-                
-                # 生成该账号的服务表格行
-                acc_service_rows = []
-                for service in acc_sorted_services:
-                    acc_yesterday_cost = acc_yesterday_costs.get(service, 0.0)
-                    acc_day_before_cost = acc_day_before_costs.get(service, 0.0)
-                    service_change, service_change_percent, service_color = ReportGenerator.calculate_change(
-                        acc_yesterday_cost, acc_day_before_cost
+            else:
+                detail_reserved = ''.join(table_start + table_end) + report_templates.get_template(
+                    'omitted_rows_notice', ' ' * 8
+                ).render(count=len(service_matrix.service_names))
+            detail_reserved = len((detail_reserved + report_templates.DOCUMENT_END).encode('utf-8'))
+            sections, omitted_sections = ReportGenerator._fit_sections(
+                render_overview, sections, max_bytes - detail_reserved
+            )
+        
+        for chunk in render_overview(sections, omitted_sections):
+            if max_bytes:
+                written += len(chunk.encode('utf-8'))
+            yield chunk
+        
+        if account_details:
+            # 有趋势数据时在附加指标列之后增加走势列
+            detail_columns = extra_count + (trends is not None)
+            detail_labels = dict(extra_labels)
+            if trends is not None:
+                detail_labels[f"extra_label{extra_count}"] = f"近{len(trends.dates)}天走势"
+            
+            # 为每个账号生成独立的服务明细表格，表头对所有账号相同，只渲染一次
+            account_table_head = report_templates.get_template('table_head', ' ' * 20, detail_columns).render(
+                name_header='服务名称',
+                current_label=f"{yesterday_str}" if is_monthly else f"{yesterday_str} 成本",
+                previous_label=f"{day_before_str}" if is_monthly else f"{day_before_str} 成本",
+                **detail_labels
+            )
+            details_template = report_templates.get_template('details_open', ' ' * 16)
+            total_template = report_templates.get_template('total_row', ' ' * 28, detail_columns)
+            account_table_close = report_templates.table_close(' ' * 20, ' ' * 16, True)
+            
+            # 为省略提示和文档结尾预留字节
+            omitted_template = report_templates.get_template('omitted_notice', ' ' * 8)
+            reserved = 0
+            if max_bytes:
+                reserved = len(omitted_template.render(count=len(account_details)).encode('utf-8')) + \
+                    len(report_templates.DOCUMENT_END.encode('utf-8'))
+            omitted = 0
+            
+            for row, acc_name in enumerate(cost_matrix.account_names):
+                acc_current, acc_previous, acc_change, acc_change_percent, acc_color = cost_matrix.account_total_row(row)
+                table = itertools.chain(
+                    (
+                        details_template.render(
+                            title=f"{acc_name} - 服务明细 (总成本: {format_currency(acc_current)})"
+                        ),
+                        account_table_head
+                    ),
+                    ReportGenerator._iter_service_rows(
+                        cost_matrix, row, ' ' * 20, size_budget, trends, account_details[row].get('drilldown'),
+                        drilldown_top_k
+                    ),
+                    (
+                        total_template.render(
+                            current=format_currency(acc_current),
+                            previous=format_currency(acc_previous),
+                            color=acc_color,
+                            change=format_currency(acc_change),
+                            change_percent=acc_change_percent,
+                            **ReportGenerator._extra_cells(extra_metrics, cost_matrix.extra_account_totals(row)),
+                            **ReportGenerator._trend_cells(trends, extra_count, trends and trends.account(acc_name))
+                        ),
+                        account_table_close
                     )
-                    
-                    change_str = ReportGenerator.format_currency(service_change)
-                    change_percent_str = f"{service_change_percent:+.2f}%"
-                    
-                    acc_service_rows.append(f"""
-                    <tr>
-                        <td>{service}</td>
-                        <td>{ReportGenerator.format_currency(acc_yesterday_cost)}</td>
-                        <td>{ReportGenerator.format_currency(acc_day_before_cost)}</td>
-                        <td style="color: {service_color}; font-weight: bold;">{change_str}</td>
-                        <td style="color: {service_color}; font-weight: bold;">{change_percent_str}</td>
-                    </tr>
-                    """)
+                )
                 
-                # 生成该账号的折叠表格
-                period_label = f"{yesterday_str}" if is_monthly else f"{yesterday_str} 成本"
-                previous_period_label = f"{day_before_str}" if is_monthly else f"{day_before_str} 成本"
+                if not max_bytes:
+                    yield from table
+                    continue
                 
-                account_service_tables += f"""
-                <details>
-                    <summary>{acc_name} - 服务明细 (总成本: {ReportGenerator.format_currency(acc_yesterday_total)})</summary>
-                    <table>
-                        <thead>
-                            <tr>
-                                <th>服务名称</th>
-                                <th>{period_label}</th>
-                                <th>{previous_period_label}</th>
-                                <th>变化量</th>
-                                <th>变化百分比</th>
-                            </tr>
-                        </thead>
-                        <tbody>
-                            {''.join(acc_service_rows)}
-                            <tr class="total-row">
-                                <td><strong>总计</strong></td>
-                                <td><strong>{ReportGenerator.format_currency(acc_yesterday_total)}</strong></td>
-                                <td><strong>{ReportGenerator.format_currency(acc_day_before_total)}</strong></td>
-                                <td style="color: {acc_color};"><strong>{ReportGenerator.format_currency(acc_change)}</strong></td>
-                                <td style="color: {acc_color};"><strong>{acc_change_percent:+.2f}%</strong></td>
-                            </tr>
-                        </tbody>
-                    </table>
-                </details>
-                """
-        
-        # 生成HTML
-        html = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <style>
-        body {{
-            font-family: Arial, sans-serif;
-            margin: 20px;
-            background-color: #f5f5f5;
-        }}
-        .container {{
-            background-color: white;
-            padding: 20px;
-            border-radius: 8px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-        }}
-        h1 {{
-            color: #333;
-            border-bottom: 2px solid #4CAF50;
-            padding-bottom: 10px;
-        }}
-        .summary {{
-            background-color: #f9f9f9;
-            padding: 15px;
-            border-radius: 5px;
-            margin-bottom: 20px;
-        }}
-        .summary-item {{
-            margin: 10px 0;
-            font-size: 16px;
-        }}
-        table {{
-            width: 100%;
-            border-collapse: collapse;
-            margin-top: 20px;
-        }}
-        th {{
-            background-color: #4CAF50;
-            color: white;
-            padding: 12px;
-            text-align: left;
-            font-weight: bold;
-        }}
-        td {{
-            padding: 10px;
-            border-bottom: 1px solid #ddd;
-        }}
-        tr:hover {{
-            background-color: #f5f5f5;
-        }}
-        .total-row {{
-            font-weight: bold;
-            background-color: #e8f5e9;
-        }}
-        .footer {{
-            margin-top: 20px;
-            padding-top: 20px;
-            border-top: 1px solid #ddd;
-            color: #666;
-            font-size: 12px;
-        }}
-        details {{
-            margin-top: 20px;
-        }}
-        summary {{
-            cursor: pointer;
-            font-size: 18px;
-            font-weight: bold;
-            color: #333;
-            padding: 10px;
-            background-color: #f0f0f0;
-            border-radius: 5px;
-            user-select: none;
-        }}
-        summary:hover {{
-            background-color: #e0e0e0;
-        }}
-        summary::-webkit-details-marker {{
-            display: inline-block;
-            margin-right: 8px;
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>{'AWS月度账单报告' if is_monthly else 'AWS每日账单报告'}</h1>
-        
-        <div class="summary">
-            <div class="summary-item">
-                <strong>{'报告月份' if is_monthly else '报告日期'}:</strong> {yesterday_str}
-            </div>
-            <div class="summary-item">
-                <strong>统计账号数:</strong> {len(account_details) if account_details else 1} 个
-            </div>
-            <div class="summary-item">
-                <strong>{yesterday_str}总账单:</strong> {ReportGenerator.format_currency(yesterday_total)}
-            </div>
-            <div class="summary-item">
-                <strong>{day_before_str}总账单:</strong> {ReportGenerator.format_currency(day_before_total)}
-            </div>
-            <div class="summary-item">
-                <strong>总账单变化:</strong> 
-                <span style="color: {total_color}; font-weight: bold;">
-                    {ReportGenerator.format_currency(total_change)} 
-                    ({total_change_percent:+.2f}%)
-                </span>
-            </div>
-        </div>
-        
-        {f'''
-        <h2>按账号汇总</h2>
-        <table>
-            <thead>
-                <tr>
-                    <th>账号名称</th>
-                    <th>{yesterday_str} 总成本</th>
-                    <th>{day_before_str} 总成本</th>
-                    <th>变化量</th>
-                    <th>变化百分比</th>
-                </tr>
-            </thead>
-            <tbody>
-                {account_summary_rows}
-                <tr class="total-row">
-                    <td><strong>总计</strong></td>
-                    <td><strong>{ReportGenerator.format_currency(yesterday_total)}</strong></td>
-                    <td><strong>{ReportGenerator.format_currency(day_before_total)}</strong></td>
-                    <td style="color: {total_color};"><strong>{ReportGenerator.format_currency(total_change)}</strong></td>
-                    <td style="color: {total_color};"><strong>{total_change_percent:+.2f}%</strong></td>
-                </tr>
-            </tbody>
-        </table>
-        ''' if account_details and len(account_details) > 1 else ''}
-        
-        <h2>按账号分组的服务明细</h2>
-        {account_service_tables if account_service_tables else f'''
-        <details>
-            <summary>按服务分组的账单明细（所有账号汇总）</summary>
-            <table>
-                <thead>
-                    <tr>
-                        <th>服务名称</th>
-                        <th>{yesterday_str if is_monthly else yesterday_str + ' 成本'}</th>
-                        <th>{day_before_str if is_monthly else day_before_str + ' 成本'}</th>
-                        <th>变化量</th>
-                        <th>变化百分比</th>
-                    </tr>
-                </thead>
-                <tbody>
-                    {''.join(service_rows)}
-                    <tr class="total-row">
-                        <td><strong>总计</strong></td>
-                        <td><strong>{ReportGenerator.format_currency(yesterday_total)}</strong></td>
-                        <td><strong>{ReportGenerator.format_currency(day_before_total)}</strong></td>
-                        <td style="color: {total_color};"><strong>{ReportGenerator.format_currency(total_change)}</strong></td>
-                        <td style="color: {total_color};"><strong>{total_change_percent:+.2f}%</strong></td>
-                    </tr>
-                </tbody>
-            </table>
-        </details>
-        '''}
-        
-        <div class="footer">
-            <p>注: 红色表示增长，绿色表示下降</p>
-            <p>因成本数据存在滞后问题, 一般4天前的数据是完全更新</p>
-            <p>旨在帮助团队了解AWS资源使用情况, 优化资源利用, 降低成本</p>
-        </div>
-    </div>
-</body>
-</html>
-        """
-        
-        return html
-
+                # 有字节预算时先渲染整张表格，放不下则省略该账号及之后所有账号的明细
+                table = list(table)
+                table_bytes = sum(len(chunk.encode('utf-8')) for chunk in table)
+                if written + table_bytes + reserved > max_bytes:
+                    omitted = len(account_details) - row
+                    break
+                written += table_bytes
+                yield from table
+            
+            if omitted:
+                yield omitted_template.render(count=omitted)
+        else:
+            rows = ReportGenerator._iter_service_rows(service_matrix, 0, ' ' * 12, size_budget)
+            
+            omitted = 0
+            if max_bytes:
+                # 表头、总计行、省略提示和文档结尾始终输出，其余字节按顺序放入服务行，放不下的服务行省略
+                rows = list(rows)
+                omitted_template = report_templates.get_template('omitted_rows_notice', ' ' * 8)
+                written += sum(len(chunk.encode('utf-8')) for chunk in table_start + table_end) + \
+                    len(omitted_template.render(count=len(rows)).encode('utf-8')) + \
+                    len(report_templates.DOCUMENT_END.encode('utf-8'))
+                for shown, chunk in enumerate(rows):
+                    written += len(chunk.encode('utf-8'))
+                    if written > max_bytes:
+                        omitted = len(rows) - shown
+                        rows = rows[:shown]
+                        break
+            
+            yield from table_start
+            yield from rows
+            yield from table_end
+            if omitted:
+                yield omitted_template.render(count=omitted)
+        
+        yield report_templates.DOCUMENT_END
+    
+    @staticmethod
+    def _iter_overview(
+        cost_matrix: CostMatrix,
+        account_details: list,
+        is_monthly: bool,
+        yesterday_str: str,
+        day_before_str: str,
+        total_cells: dict,
+        extra_labels: Dict[str, str] = None,
+        trends: CostTrends = None,
+        trend_services: int = 10,
+        anomalies: List[dict] = None,
+        anomaly_rows: int = 20,
+        forecast: MonthEndForecast = None,
+        forecast_services: int = 10,
+        drill_rows: bool = False,
+        omitted_sections: List[str] = None
+    ) -> Iterator[str]:
+        """
+        生成文档头部、总览、异常章节、账号汇总表格、月末预测章节和趋势章节
+        
+        Args:
+            extra_labels: 可选，附加指标列的表头字段 {extra_label0: 表头, ...}
+            trends: 可选，成本趋势（已按报告中的账号筛选）
+            trend_services: 趋势章节中显示的费用最高的服务数
+            anomalies: 可选，异常列表（已按报告中的账号筛选）
+            anomaly_rows: 异常章节最多显示的行数，0 表示全部显示
+            forecast: 可选，月末预测（已按报告中的账号筛选）
+            forecast_services: 月末预测章节中显示的服务数
+            drill_rows: 服务明细中是否包含下钻行（决定是否输出下钻行的样式）
+            omitted_sections: 可选，因字节预算省略的章节名称，在明细章节之前提示
+        
+        Yields:
+            HTML字符串片段
+        """
+        format_currency = ReportGenerator.format_currency
+        extra_labels = extra_labels or {}
+        extra_count = len(extra_labels)
+        extra_metrics = cost_matrix.extra_metrics if extra_count else []
+        
+        yield report_templates.DOCUMENT_START
+        # 可选章节的样式只在报告包含该章节时输出，未启用时文档头部保持不变
+        if anomalies:
+            yield report_templates.ANOMALY_STYLE
+        if drill_rows:
+            yield report_templates.DRILL_ROW_STYLE
+        yield report_templates.DOCUMENT_HEAD_END
+        yield report_templates.get_template('summary').render(
+            title='AWS月度账单报告' if is_monthly else 'AWS每日账单报告',
+            date_label='报告月份' if is_monthly else '报告日期',
+            current_label=yesterday_str,
+            previous_label=day_before_str,
+            account_count=len(account_details) if account_details else 1,
+            **total_cells
+        )
+        
+        if anomalies:
+            yield from ReportGenerator._iter_anomalies(anomalies, anomaly_rows)
+        
+        # 账号汇总表格（如果有多账号）
+        if account_details and len(account_details) > 1:
+            yield "\n        <h2>按账号汇总</h2>\n"
+            yield report_templates.get_template('table_head', ' ' * 8, extra_count).render(
+                name_header='账号名称',
+                current_label=f"{yesterday_str} 总成本",
+                previous_label=f"{day_before_str} 总成本",
+                **extra_labels
+            )
+            render_row = report_templates.get_template('row', ' ' * 16, extra_count).render
+            for row, acc_name in enumerate(cost_matrix.account_names):
+                acc_current, acc_previous, acc_change, acc_change_percent, acc_color = cost_matrix.account_total_row(row)
+                yield render_row(
+                    name=acc_name,
+                    current=format_currency(acc_current),
+                    previous=format_currency(acc_previous),
+                    color=acc_color,
+                    change=format_currency(acc_change),
+                    change_percent=acc_change_percent,
+                    **ReportGenerator._extra_cells(extra_metrics, cost_matrix.extra_account_totals(row))
+                )
+            yield report_templates.get_template('total_row', ' ' * 16, extra_count).render(
+                **total_cells,
+                **ReportGenerator._extra_cells(extra_metrics, cost_matrix.extra_grand_totals())
+            )
+            yield report_templates.table_close(' ' * 8, ' ' * 8, False)
+        
+        if forecast is not None:
+            yield from ReportGenerator._iter_forecast(forecast, len(account_details) > 1, forecast_services)
+        
+        if trends is not None:
+            yield from ReportGenerator._iter_trends(trends, len(account_details) > 1, trend_services)
+        
+        if omitted_sections:
+            yield report_templates.get_template('omitted_sections_notice', ' ' * 8).render(
+                sections='、'.join(omitted_sections)
+            )
+        
+        yield report_templates.DETAILS_SECTION_START
+    
+    @staticmethod
+    def _fit_sections(render, sections: Dict[str, object], budget: int) -> Tuple[Dict[str, object], List[str]]:
+        """
+        在字节预算内选择总览中输出的可选章节
+        
+        所有章节都放得下时全部输出；否则按顺序逐个加入放得下的章节（包括省略提示的字节），其余章节省略
+        
+        Args:
+            render: render(章节, 省略的章节名称列表)，生成总览HTML片段
+            sections: {章节名称: 章节数据}，按优先顺序排列，数据为None的章节本来就不输出
+            budget: 总览可用的字节数
+        
+        Returns:
+            (输出的章节 {章节名称: 章节数据}, 省略的章节名称列表)
+        """
+        def size(kept: Dict[str, object], omitted: List[str]) -> int:
+            return sum(len(chunk.encode('utf-8')) for chunk in render(kept, omitted))
+        
+        present = {name: data for name, data in sections.items() if data is not None}
+        if size(present, []) <= budget:
+            return present, []
+        
+        kept = {}
+        for name, data in present.items():
+            trial = dict(kept)
+            trial[name] = data
+            if size(trial, [other for other in present if other not in trial]) <= budget:
+                kept = trial
+        return kept, [name for name in present if name not in kept]
+    
+    @staticmethod
+    def _iter_anomalies(anomalies: List[dict], max_rows: int = 20) -> Iterator[str]:
+        """
+        生成高亮的异常章节：每个异常的当天成本、预期成本、偏离金额和偏离程度（增长为红色，下降为绿色）
+        
+        Args:
+            anomalies: 异常列表（按偏离金额的绝对值从大到小排序）
+            max_rows: 最多显示的行数，0 表示全部显示
+        
+        Yields:
+            HTML字符串片段
+        """
+        format_currency = ReportGenerator.format_currency
+        shown = anomalies[:max_rows] if max_rows else anomalies
+        
+        yield report_templates.get_template('anomaly_head', ' ' * 8).render(count=len(anomalies))
+        render_row = report_templates.get_template('anomaly_row', ' ' * 20).render
+        for anomaly in shown:
+            yield render_row(
+                account=anomaly['account'],
+                service=anomaly['service'],
+                amount=format_currency(anomaly['amount']),
+                expected=format_currency(anomaly['expected']),
+                color='red' if anomaly['deviation'] > 0 else 'green',
+                deviation=format_currency(anomaly['deviation']),
+                z_score=anomaly['z_score']
+            )
+        omitted = ''
+        if len(shown) < len(anomalies):
+            omitted = f"\n{' ' * 12}<p style=\"color: #666;\">另有 {len(anomalies) - len(shown)} 个偏离金额较小的异常未显示</p>"
+        yield report_templates.get_template('anomaly_tail', ' ' * 8).render(omitted=omitted)
+    
+    @staticmethod
+    def _iter_forecast(forecast: MonthEndForecast, by_account: bool, service_count: int) -> Iterator[str]:
+        """
+        生成月末预测章节：每个账号和总计的本月至今成本、预测月末总成本和置信区间，以及预测费用最高的服务
+        
+        Args:
+            forecast: 月末预测
+            by_account: 是否逐个账号显示（单账号时只显示总计）
+            service_count: 显示的服务数
+        
+        Yields:
+            HTML字符串片段
+        """
+        format_currency = ReportGenerator.format_currency
+        
+        def band(low: float, high: float) -> str:
+            if low != low:
+                return '-'
+            return f"{format_currency(low)} ~ {format_currency(high)}"
+        
+        yield f"\n        <h2>{forecast.month.year}年{forecast.month.month}月 月末成本预测</h2>\n"
+        yield (f"        <p style=\"color: #666;\">本月至今为已统计日期（共 {forecast.days_in_month} 天）的成本，"
+               f"其余日期按本月的日均成本（统计满一周后按线性趋势）估算；已统计天数少于3天时不显示置信区间</p>\n")
+        yield report_templates.get_template('forecast_head', ' ' * 8).render(
+            name_header='账号名称', confidence=f"{forecast.confidence:.0%} "
+        )
+        if by_account:
+            render_row = report_templates.get_template('forecast_row', ' ' * 16).render
+            for acc_name in forecast.account_names:
+                days, month_to_date, projected, low, high = forecast.account(acc_name)
+                yield render_row(
+                    name=acc_name,
+                    days=f"{days}/{forecast.days_in_month}",
+                    month_to_date=format_currency(month_to_date),
+                    projected=format_currency(projected),
+                    band=band(low, high)
+                )
+        month_to_date, projected, low, high = forecast.total()
+        yield report_templates.get_template('forecast_total_row', ' ' * 16).render(
+            month_to_date=format_currency(month_to_date),
+            projected=format_currency(projected),
+            band=band(low, high)
+        )
+        yield report_templates.table_close(' ' * 8, ' ' * 8, False)
+        
+        services = forecast.top_services(service_count)
+        if services:
+            yield f"\n        <h3>预测费用最高的 {len(services)} 个服务</h3>\n"
+            yield report_templates.get_template('forecast_service_head', ' ' * 8).render()
+            render_row = report_templates.get_template('forecast_service_row', ' ' * 16).render
+            for service, month_to_date, projected in services:
+                yield render_row(
+                    name=service,
+                    month_to_date=format_currency(month_to_date),
+                    projected=format_currency(projected)
+                )
+            yield report_templates.table_close(' ' * 8, ' ' * 8, False)
+    
+    @staticmethod
+    def _iter_trends(trends: CostTrends, by_account: bool, service_count: int) -> Iterator[str]:
+        """
+        生成趋势章节：每个账号和费用最高的服务的走势图、最近一天成本、7日平均和周环比
+        
+        Args:
+            trends: 成本趋势
+            by_account: 是否逐个账号显示（单账号时只显示总计）
+            service_count: 显示的服务数
+        
+        Yields:
+            HTML字符串片段
+        """
+        format_currency = ReportGenerator.format_currency
+        days = len(trends.dates)
+        render_row = report_templates.get_template('trend_row', ' ' * 16).render
+        
+        def cells(trend: Tuple) -> dict:
+            spark, latest, average, change, change_percent, color = trend
+            return {
+                'spark': spark,
+                'latest': '-' if latest != latest else format_currency(latest),
+                'average': format_currency(average),
+                'change': format_currency(change),
+                'change_percent': change_percent,
+                'color': color,
+            }
+        
+        yield f"\n        <h2>近{days}天趋势</h2>\n"
+        yield (f"        <p style=\"color: #666;\">{trends.dates[0].strftime('%Y-%m-%d')} 至 "
+               f"{trends.dates[-1].strftime('%Y-%m-%d')} 每天的成本（来自本地缓存，空白表示该天没有数据），"
+               f"周环比为最近{WINDOW}天与之前{WINDOW}天的日均成本比较</p>\n")
+        yield report_templates.get_template('trend_head', ' ' * 8).render(name_header='账号名称', days=days)
+        if by_account:
+            for acc_name in trends.account_names:
+                yield render_row(name=acc_name, **cells(trends.account(acc_name)))
+        yield report_templates.get_template('trend_total_row', ' ' * 16).render(**cells(trends.grand_total()))
+        yield report_templates.table_close(' ' * 8, ' ' * 8, False)
+        
+        services = trends.top_services(service_count)
+        if services:
+            yield f"\n        <h3>费用最高的 {len(services)} 个服务</h3>\n"
+            yield report_templates.get_template('trend_head', ' ' * 8).render(name_header='服务名称', days=days)
+            for service in services:
+                yield render_row(name=service, **cells(trends.service(service)))
+            yield report_templates.table_close(' ' * 8, ' ' * 8, False)
+    
+    @staticmethod
+    def _iter_service_rows(cost_matrix: CostMatrix, row: int, indent: str,
+                           size_budget: ReportSizeBudget = None, trends: CostTrends = None,
+                           drilldown: RollupTree = None, drilldown_top_k: int = 5) -> Iterator[str]:
+        """
+        按当前周期费用从高到低逐行生成某个账号的服务表格行
+        
+        Args:
+            cost_matrix: 成本矩阵
+            row: 账号行索引
+            indent: 行的缩进（与所在表格对齐）
+            size_budget: 可选，报告大小预算（前N个服务、长尾合并、去掉零费用行）
+            trends: 可选，成本趋势，在附加指标列之后增加走势列
+            drilldown: 可选，该账号的服务下钻汇总树，下钻的服务行之后展开每一级变化最大的子项
+            drilldown_top_k: 每一级显示的子项数
+            
+        Yields:
+            服务表格行HTML
+        """
+        format_currency = ReportGenerator.format_currency
+        extra_metrics = cost_matrix.extra_metrics
+        extra_cells = ReportGenerator._extra_cells
+        trend_cells = ReportGenerator._trend_cells
+        trend_column = len(extra_metrics)
+        acc_name = cost_matrix.account_names[row]
+        render_row = report_templates.get_template('row', indent, trend_column + (trends is not None)).render
+        render_drill_row = report_templates.get_template(
+            'drill_row', indent, trend_column + (trends is not None)
+        ).render
+        
+        if size_budget:
+            columns, tail_columns = cost_matrix.select_account_columns(
+                row, size_budget.top_n, size_budget.drop_zero_rows
+            )
+        else:
+            columns, tail_columns = cost_matrix.select_account_columns(row)
+        
+        rows = zip(cost_matrix.iter_account_rows(row, columns), cost_matrix.extra_values(row, columns))
+        for (service, current_cost, previous_cost, change, change_percent, color), extra_values in rows:
+            yield render_row(
+                name=service,
+                current=format_currency(current_cost),
+                previous=format_currency(previous_cost),
+                color=color,
+                change=format_currency(change),
+                change_percent=change_percent,
+                **extra_cells(extra_metrics, extra_values),
+                **trend_cells(trends, trend_column, trends and trends.cell(acc_name, service))
+            )
+            node = drilldown.find([service]) if drilldown is not None else None
+            if node is not None:
+                yield from ReportGenerator._iter_drilldown_rows(drilldown, node, render_drill_row, drilldown_top_k)
+        
+        # 长尾服务合并为一行
+        if len(tail_columns) and size_budget.collapse_tail:
+            tail_current, tail_previous = cost_matrix.columns_total(row, tail_columns)
+            change, change_percent, color = ReportGenerator.calculate_change(tail_current, tail_previous)
+            yield render_row(
+                name=f"其他 ({len(tail_columns)} 个服务)",
+                current=format_currency(tail_current),
+                previous=format_currency(tail_previous),
+                color=color,
+                change=format_currency(change),
+                change_percent=change_percent,
+                **extra_cells(extra_metrics, cost_matrix.extra_columns_total(row, tail_columns)),
+                **trend_cells(trends, trend_column, trends and trends.combined(
+                    acc_name, [cost_matrix.service_names[column] for column in tail_columns.tolist()]
+                ))
+            )
+    
+    @staticmethod
+    def _has_drill_rows(cost_matrix: CostMatrix, account_details: list, size_budget: ReportSizeBudget = None) -> bool:
+        """服务明细中是否有下钻行：某个账号显示的服务在该账号的下钻汇总树中"""
+        for row, acc_detail in enumerate(account_details):
+            drilldown = acc_detail.get('drilldown')
+            if drilldown is None:
+                continue
+            if size_budget:
+                columns, _ = cost_matrix.select_account_columns(row, size_budget.top_n, size_budget.drop_zero_rows)
+            else:
+                columns, _ = cost_matrix.select_account_columns(row)
+            if any(drilldown.find([cost_matrix.service_names[column]]) is not None for column in columns.tolist()):
+                return True
+        return False
+    
+    @staticmethod
+    def _iter_drilldown_rows(drilldown: RollupTree, node: int, render_row, top_k: int,
+                             depth: int = 1) -> Iterator[str]:
+        """
+        逐级生成某个服务的下钻行：每一级只显示金额变化最大的前K个子项，其余子项合并为一行
+        
+        Args:
+            drilldown: 服务下钻汇总树
+            node: 服务（或上一级分组）的节点编号
+            render_row: 下钻行模板的渲染函数
+            top_k: 每一级显示的子项数
+            depth: 子项所在的级别（服务为第0级）
+            
+        Yields:
+            下钻行HTML
+        """
+        format_currency = ReportGenerator.format_currency
+        level = drilldown.levels[depth]
+        label = ReportGenerator.GROUP_LABELS.get(level) or (f"标签 {level[4:]}" if level.startswith('TAG:') else level)
+        padding = 10 + 20 * depth
+        
+        children, (other_count, other_current, other_previous) = drilldown.top_children(node, top_k)
+        for name, current, previous, child in children:
+            change, change_percent, color = ReportGenerator.calculate_change(current, previous)
+            # 标签值等分组名称来自用户数据，需要转义
+            yield render_row(
+                padding=padding,
+                name=f"{label}: {escape(name)}",
+                current=format_currency(current),
+                previous=format_currency(previous),
+                color=color,
+                change=format_currency(change),
+                change_percent=change_percent
+            )
+            if child is not None:
+                yield from ReportGenerator._iter_drilldown_rows(drilldown, child, render_row, top_k, depth + 1)
+        if other_count:
+            change, change_percent, color = ReportGenerator.calculate_change(other_current, other_previous)
+            yield render_row(
+                padding=padding,
+                name=f"其他 ({other_count} 个{label})",
+                current=format_currency(other_current),
+                previous=format_currency(other_previous),
+                color=color,
+                change=format_currency(change),
+                change_percent=change_percent
+            )
@@ -0,0 +1,435 @@
+"""
+报告模板模块
+HTML报告的静态骨架和每行模板在进程内只解析一次并缓存，渲染时只填充动态单元格
+"""
+from functools import lru_cache
+from string import Formatter
+from typing import List
+
+
+class CompiledTemplate:
+    def __init__(self, source: str):
+        """
+        编译模板（str.format 语法）
+
+        模板被解析一次并生成等价的 f-string 函数，渲染时与手写 f-string 一样快。
+
+        Args:
+            source: 模板文本，{字段名} 或 {字段名:格式} 表示动态单元格，{{ 和 }} 表示花括号
+        """
+        self.source = source
+        self.fields: List[str] = []
+        pieces = []
+        for literal, field, spec, conversion in Formatter().parse(source):
+            if literal:
+                escaped = literal.replace('{', '{{').replace('}', '}}')
+                pieces.append('f' + repr(escaped))
+            if field is not None:
+                if not field.isidentifier() or conversion or '{' in (spec or ''):
+                    raise ValueError(f"不支持的模板字段: {field}")
+                if field not in self.fields:
+                    self.fields.append(field)
+                pieces.append(f"f'{{{field}:{spec}}}'" if spec else f"f'{{{field}}}'")
+
+        arguments = f"*, {', '.join(self.fields)}" if self.fields else ''
+        code = f"def render({arguments}):\n    return {' '.join(pieces) or repr('')}\n"
+        namespace = {}
+        exec(compile(code, '<report_template>', 'exec'), namespace)
+        # render(**字段) -> str，直接使用生成的函数，避免额外的调用开销
+        self.render = namespace['render']
+
+
+# 文档开头：完全静态，包括样式表（不含可选章节的样式）
+DOCUMENT_START = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <style>
+        body {
+            font-family: Arial, sans-serif;
+            margin: 20px;
+            background-color: #f5f5f5;
+        }
+        .container {
+            background-color: white;
+            padding: 20px;
+            border-radius: 8px;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+        }
+        h1 {
+            color: #333;
+            border-bottom: 2px solid #4CAF50;
+            padding-bottom: 10px;
+        }
+        .summary {
+            background-color: #f9f9f9;
+            padding: 15px;
+            border-radius: 5px;
+            margin-bottom: 20px;
+        }
+        .summary-item {
+            margin: 10px 0;
+            font-size: 16px;
+        }
+        table {
+            width: 100%;
+            border-collapse: collapse;
+            margin-top: 20px;
+        }
+        th {
+            background-color: #4CAF50;
+            color: white;
+            padding: 12px;
+            text-align: left;
+            font-weight: bold;
+        }
+        td {
+            padding: 10px;
+            border-bottom: 1px solid #ddd;
+        }
+        tr:hover {
+            background-color: #f5f5f5;
+        }
+        .total-row {
+            font-weight: bold;
+            background-color: #e8f5e9;
+        }
+        .footer {
+            margin-top: 20px;
+            padding-top: 20px;
+            border-top: 1px solid #ddd;
+            color: #666;
+            font-size: 12px;
+        }
+        details {
+            margin-top: 20px;
+        }
+        summary {
+            cursor: pointer;
+            font-size: 18px;
+            font-weight: bold;
+            color: #333;
+            padding: 10px;
+            background-color: #f0f0f0;
+            border-radius: 5px;
+            user-select: none;
+        }
+        summary:hover {
+            background-color: #e0e0e0;
+        }
+        summary::-webkit-details-marker {
+            display: inline-block;
+            margin-right: 8px;
+        }
+"""
+
+# 异常章节的样式，只在报告包含异常章节时插入样式表
+ANOMALY_STYLE = """        .anomalies {
+            background-color: #fff8e1;
+            border-left: 4px solid #ff9800;
+            padding: 5px 15px 15px 15px;
+            border-radius: 5px;
+            margin-bottom: 20px;
+        }
+        .anomalies h2 {
+            color: #e65100;
+        }
+"""
+
+# 下钻行的样式，只在报告包含下钻行时插入样式表
+DRILL_ROW_STYLE = """        .drill-row td {
+            padding-top: 6px;
+            padding-bottom: 6px;
+            color: #555;
+            font-size: 13px;
+        }
+"""
+
+# 样式表和文档头部的结尾
+DOCUMENT_HEAD_END = """    </style>
+</head>
+<body>
+    <div class="container">
+"""
+
+# 服务明细章节标题：完全静态
+DETAILS_SECTION_START = """
+        
+        <h2>按账号分组的服务明细</h2>
+        """
+
+# 文档结尾：完全静态
+DOCUMENT_END = """
+        
+        <div class="footer">
+            <p>注: 红色表示增长，绿色表示下降</p>
+            <p>因成本数据存在滞后问题, 一般4天前的数据是完全更新</p>
+            <p>旨在帮助团队了解AWS资源使用情况, 优化资源利用, 降低成本</p>
+        </div>
+    </div>
+</body>
+</html>
+        """
+
+# 动态模板，{I} 为缩进占位符（编译时替换），其余为 str.format 字段
+TEMPLATE_SOURCES = {
+    # 标题和总览
+    'summary': """        <h1>{title}</h1>
+        
+        <div class="summary">
+            <div class="summary-item">
+                <strong>{date_label}:</strong> {current_label}
+            </div>
+            <div class="summary-item">
+                <strong>统计账号数:</strong> {account_count} 个
+            </div>
+            <div class="summary-item">
+                <strong>{current_label}总账单:</strong> {current}
+            </div>
+            <div class="summary-item">
+                <strong>{previous_label}总账单:</strong> {previous}
+            </div>
+            <div class="summary-item">
+                <strong>总账单变化:</strong> 
+                <span style="color: {color}; font-weight: bold;">
+                    {change} 
+                    ({change_percent:+.2f}%)
+                </span>
+            </div>
+        </div>
+        
+        """,
+    # 可折叠区块的标题
+    'details_open': """
+{I}<details>
+{I}    <summary>{title}</summary>
+""",
+    # 表头
+    'table_head': """{I}<table>
+{I}    <thead>
+{I}        <tr>
+{I}            <th>{name_header}</th>
+{I}            <th>{current_label}</th>
+{I}            <th>{previous_label}</th>
+{I}            <th>变化量</th>
+{I}            <th>变化百分比</th>
+{I}        </tr>
+{I}    </thead>
+{I}    <tbody>
+{I}        """,
+    # 明细行（服务或账号）
+    'row': """
+{I}<tr>
+{I}    <td>{name}</td>
+{I}    <td>{current}</td>
+{I}    <td>{previous}</td>
+{I}    <td style="color: {color}; font-weight: bold;">{change}</td>
+{I}    <td style="color: {color}; font-weight: bold;">{change_percent:+.2f}%</td>
+{I}</tr>
+{I}""",
+    # 下钻行（服务之下的分组），padding 为名称单元格的左缩进（像素）
+    'drill_row': """
+{I}<tr class="drill-row">
+{I}    <td style="padding-left: {padding}px;">{name}</td>
+{I}    <td>{current}</td>
+{I}    <td>{previous}</td>
+{I}    <td style="color: {color};">{change}</td>
+{I}    <td style="color: {color};">{change_percent:+.2f}%</td>
+{I}</tr>
+{I}""",
+    # 总计行
+    'total_row': """
+{I}<tr class="total-row">
+{I}    <td><strong>总计</strong></td>
+{I}    <td><strong>{current}</strong></td>
+{I}    <td><strong>{previous}</strong></td>
+{I}    <td style="color: {color};"><strong>{change}</strong></td>
+{I}    <td style="color: {color};"><strong>{change_percent:+.2f}%</strong></td>
+{I}</tr>""",
+    # 趋势表格的表头
+    'trend_head': """{I}<table>
+{I}    <thead>
+{I}        <tr>
+{I}            <th>{name_header}</th>
+{I}            <th>近{days}天走势</th>
+{I}            <th>最近一天</th>
+{I}            <th>7日平均</th>
+{I}            <th>周环比</th>
+{I}            <th>周环比百分比</th>
+{I}        </tr>
+{I}    </thead>
+{I}    <tbody>
+{I}        """,
+    # 趋势行（账号或服务）
+    'trend_row': """
+{I}<tr>
+{I}    <td>{name}</td>
+{I}    <td style="font-family: monospace; white-space: pre;">{spark}</td>
+{I}    <td>{latest}</td>
+{I}    <td>{average}</td>
+{I}    <td style="color: {color}; font-weight: bold;">{change}</td>
+{I}    <td style="color: {color}; font-weight: bold;">{change_percent:+.2f}%</td>
+{I}</tr>
+{I}""",
+    # 趋势总计行
+    'trend_total_row': """
+{I}<tr class="total-row">
+{I}    <td><strong>总计</strong></td>
+{I}    <td style="font-family: monospace; white-space: pre;">{spark}</td>
+{I}    <td><strong>{latest}</strong></td>
+{I}    <td><strong>{average}</strong></td>
+{I}    <td style="color: {color};"><strong>{change}</strong></td>
+{I}    <td style="color: {color};"><strong>{change_percent:+.2f}%</strong></td>
+{I}</tr>""",
+    # 服务明细表格中的趋势单元格内容（走势图和周环比百分比）
+    'trend_cell': """<span style="font-family: monospace; white-space: pre;">{spark}</span> """
+                  """<span style="color: {color};">{change_percent:+.1f}%</span>""",
+    # 异常章节的开头（高亮区块、说明和表头）
+    'anomaly_head': """
+{I}<div class="anomalies">
+{I}    <h2>成本异常 ({count})</h2>
+{I}    <p style="color: #666;">当天成本明显偏离该服务近期日均成本（指数加权平均）的账号服务，偏离程度为偏离金额相当于平时波动（标准差）的倍数</p>
+{I}    <table>
+{I}        <thead>
+{I}            <tr>
+{I}                <th>账号名称</th>
+{I}                <th>服务名称</th>
+{I}                <th>当天成本</th>
+{I}                <th>预期成本</th>
+{I}                <th>偏离金额</th>
+{I}                <th>偏离程度</th>
+{I}            </tr>
+{I}        </thead>
+{I}        <tbody>
+{I}            """,
+    # 异常行
+    'anomaly_row': """
+{I}<tr>
+{I}    <td>{account}</td>
+{I}    <td>{service}</td>
+{I}    <td>{amount}</td>
+{I}    <td>{expected}</td>
+{I}    <td style="color: {color}; font-weight: bold;">{deviation}</td>
+{I}    <td style="color: {color}; font-weight: bold;">{z_score:+.1f}σ</td>
+{I}</tr>
+{I}""",
+    # 异常章节的结尾，omitted 为未显示的异常数量的提示（可以为空）
+    'anomaly_tail': """
+{I}        </tbody>
+{I}    </table>{omitted}
+{I}</div>
+{I}""",
+    # 月末预测表格的表头
+    'forecast_head': """{I}<table>
+{I}    <thead>
+{I}        <tr>
+{I}            <th>{name_header}</th>
+{I}            <th>已统计天数</th>
+{I}            <th>本月至今</th>
+{I}            <th>预测月末</th>
+{I}            <th>{confidence}置信区间</th>
+{I}        </tr>
+{I}    </thead>
+{I}    <tbody>
+{I}        """,
+    # 月末预测行（账号）
+    'forecast_row': """
+{I}<tr>
+{I}    <td>{name}</td>
+{I}    <td>{days}</td>
+{I}    <td>{month_to_date}</td>
+{I}    <td><strong>{projected}</strong></td>
+{I}    <td>{band}</td>
+{I}</tr>
+{I}""",
+    # 月末预测总计行
+    'forecast_total_row': """
+{I}<tr class="total-row">
+{I}    <td><strong>总计</strong></td>
+{I}    <td></td>
+{I}    <td><strong>{month_to_date}</strong></td>
+{I}    <td><strong>{projected}</strong></td>
+{I}    <td><strong>{band}</strong></td>
+{I}</tr>""",
+    # 服务月末预测表格的表头
+    'forecast_service_head': """{I}<table>
+{I}    <thead>
+{I}        <tr>
+{I}            <th>服务名称</th>
+{I}            <th>本月至今</th>
+{I}            <th>预测月末</th>
+{I}        </tr>
+{I}    </thead>
+{I}    <tbody>
+{I}        """,
+    # 服务月末预测行
+    'forecast_service_row': """
+{I}<tr>
+{I}    <td>{name}</td>
+{I}    <td>{month_to_date}</td>
+{I}    <td>{projected}</td>
+{I}</tr>
+{I}""",
+    # 因大小限制省略明细的提示
+    'omitted_notice': """
+{I}<p style="color: #666;">因邮件大小限制，其余 {count} 个账号的服务明细已省略（总计金额不受影响）</p>
+{I}""",
+    # 没有账号明细时，因字节预算省略的服务行数的提示
+    'omitted_rows_notice': """
+{I}<p style="color: #666;">因邮件大小限制，其余 {count} 行服务明细已省略（总计金额不受影响）</p>
+{I}""",
+    # 因字节预算省略的总览章节（异常、月末预测、趋势）的提示
+    'omitted_sections_notice': """
+{I}<p style="color: #666;">因邮件大小限制，已省略{sections}章节（总计金额不受影响）</p>
+{I}""",
+}
+
+
+# 附加指标列：(插入位置之前的文本, 单元格模板)，{n} 为列序号，字段名为 extra_label{n} / extra{n}
+EXTRA_COLUMN_SOURCES = {
+    'table_head': ("\n{I}        </tr>", "\n{I}            <th>{extra_label{n}}</th>"),
+    'row': ("\n{I}</tr>", "\n{I}    <td>{extra{n}}</td>"),
+    'drill_row': ("\n{I}</tr>", "\n{I}    <td></td>"),
+    'total_row': ("\n{I}</tr>", "\n{I}    <td><strong>{extra{n}}</strong></td>"),
+}
+
+
+@lru_cache(maxsize=None)
+def get_template(name: str, indent: str = '', extra_columns: int = 0) -> CompiledTemplate:
+    """
+    获取编译后的模板（每个模板、缩进和附加列数的组合在进程内只编译一次）
+
+    Args:
+        name: 模板名称，见 TEMPLATE_SOURCES
+        indent: 缩进字符串
+        extra_columns: 附加指标列的数量（只对 table_head、row、drill_row、total_row 有效，下钻行的附加列为空）
+
+    Returns:
+        CompiledTemplate 实例
+    """
+    source = TEMPLATE_SOURCES[name]
+    if extra_columns and name in EXTRA_COLUMN_SOURCES:
+        anchor, cell = EXTRA_COLUMN_SOURCES[name]
+        cells = ''.join(cell.replace('{n}', str(n)) for n in range(extra_columns))
+        source = source.replace(anchor, cells + anchor, 1)
+    return CompiledTemplate(source.replace('{I}', indent))
+
+
+@lru_cache(maxsize=None)
+def table_close(indent: str, closing_indent: str, details: bool) -> str:
+    """
+    获取表格结尾的静态文本（已缓存）
+
+    Args:
+        indent: 表格的缩进
+        closing_indent: 结尾之后下一段内容的缩进
+        details: 表格是否位于可折叠区块中
+
+    Returns:
+        </tbody></table>（以及 </details>）的静态文本
+    """
+    text = f"\n{indent}    </tbody>\n{indent}</table>\n"
+    if details:
+        text += f"{indent[:-4]}</details>\n"
+    return text + closing_indent
@@ -0,0 +1,194 @@
+"""
+运行指标模块
+记录每次运行各阶段和每个账号的耗时、API调用次数、重试次数、报告和邮件大小，
+输出为结构化JSON日志（每行一个事件）和 Prometheus textfile 格式（node exporter 的 textfile collector 可直接采集）
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List
+
+
+def _escape_label(value: str) -> str:
+    """转义 Prometheus 标签值"""
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class RunMetrics:
+    def __init__(self, json_log_path: str = None, textfile_path: str = None, prefix: str = 'aws_billing_report',
+                 labels: Dict[str, str] = None):
+        """
+        初始化运行指标
+
+        Args:
+            json_log_path: 可选，JSON日志文件路径（追加写入，每行一个事件），'-' 表示输出到标准错误
+            textfile_path: 可选，Prometheus textfile 路径，运行结束时原子写入
+            prefix: 指标名称前缀
+            labels: 所有指标共有的标签，例如 {'report_type': 'daily'}
+        """
+        self.json_log_path = json_log_path
+        self.textfile_path = textfile_path
+        self.prefix = prefix
+        self.labels = labels or {}
+
+        self._lock = threading.Lock()
+        self._log_file = None
+        if json_log_path == '-':
+            self._log_file = sys.stderr
+        elif json_log_path:
+            self._log_file = open(json_log_path, 'a', encoding='utf-8')
+
+        self.started_at = time.time()
+        self.stages: Dict[str, dict] = {}
+        self.accounts: Dict[str, dict] = {}
+        self.counters: Dict[str, float] = {}
+
+    def log(self, event: str, **fields):
+        """
+        写入一条JSON日志事件
+        """
+        if self._log_file is None:
+            return
+        record = {'ts': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ'), 'event': event}
+        record.update(self.labels)
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._log_file.write(line + '\n')
+            self._log_file.flush()
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        测量一个阶段的耗时，阶段内抛出异常时状态记为 error（异常继续向外抛出）；
+        同名阶段多次进入时耗时累加
+        """
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            yield
+            status = 'ok'
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                previous = self.stages.get(name)
+                if previous is not None:
+                    seconds += previous['seconds']
+                    if previous['status'] != 'ok':
+                        status = previous['status']
+                self.stages[name] = {'seconds': seconds, 'status': status}
+            self.log('stage', stage=name, seconds=round(seconds, 6), status=status)
+
+    def increment(self, name: str, value: float = 1):
+        """累加计数器（例如 bytes_rendered、emails_sent）"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_counter(self, name: str, value: float):
+        """设置计数器的值（例如来自限流器的统计）"""
+        with self._lock:
+            self.counters[name] = value
+
+    def record_account(self, account: str, **fields):
+        """
+        记录或更新单个账号的获取指标（线程安全）
+
+        Args:
+            account: 账号名称
+            fields: seconds（耗时）、status（ok/error/timeout）、api_calls、retries 等
+        """
+        with self._lock:
+            record = self.accounts.setdefault(account, {})
+            record.update(fields)
+        if 'status' in fields:
+            self.log('account_fetch', account=account, **{
+                key: round(value, 6) if isinstance(value, float) else value
+                for key, value in self.accounts[account].items()
+            })
+
+    def finish(self, success: bool):
+        """
+        结束本次运行：写入汇总日志和 Prometheus textfile
+        """
+        duration = time.time() - self.started_at
+        self.log(
+            'run_summary',
+            success=success,
+            seconds=round(duration, 6),
+            stages={name: round(stage['seconds'], 6) for name, stage in self.stages.items()},
+            accounts_ok=sum(1 for record in self.accounts.values() if record.get('status') == 'ok'),
+            accounts_failed=sum(1 for record in self.accounts.values() if record.get('status') not in (None, 'ok')),
+            **self.counters
+        )
+        if self.textfile_path:
+            try:
+                self.write_textfile(self.textfile_path, success, duration)
+            except OSError as e:
+                print(f"警告: 写入指标文件 {self.textfile_path} 失败: {str(e)}")
+        if self._log_file is not None and self._log_file is not sys.stderr:
+            self._log_file.close()
+        self._log_file = None
+
+    def _format_labels(self, extra: Dict[str, str] = None) -> str:
+        """格式化标签 {name="value",...}"""
+        labels = dict(self.labels)
+        if extra:
+            labels.update(extra)
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + '}'
+
+    def render_textfile(self, success: bool, duration: float) -> str:
+        """
+        生成 Prometheus 文本格式（也可以直接推送到 Pushgateway）
+
+        Returns:
+            指标文本
+        """
+        prefix = self.prefix
+        lines: List[str] = []
+
+        def metric(name: str, help_text: str, samples: List[tuple]):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            for extra, value in samples:
+                lines.append(f"{prefix}_{name}{self._format_labels(extra)} {float(value)!r}")
+
+        metric('last_run_timestamp_seconds', 'Unix time the last run finished.', [(None, time.time())])
+        metric('last_run_success', 'Whether the last run generated and sent all reports (1/0).', [(None, int(success))])
+        metric('run_duration_seconds', 'Wall time of the last run.', [(None, duration)])
+        metric('stage_duration_seconds', 'Wall time of each pipeline stage in the last run.', [
+            ({'stage': name}, stage['seconds']) for name, stage in self.stages.items()
+        ])
+        metric('stage_success', 'Whether each pipeline stage completed (1/0).', [
+            ({'stage': name}, int(stage['status'] == 'ok')) for name, stage in self.stages.items()
+        ])
+        metric('account_fetch_duration_seconds', 'Wall time to fetch each account.', [
+            ({'account': account}, record['seconds']) for account, record in self.accounts.items() if 'seconds' in record
+        ])
+        metric('account_fetch_success', 'Whether each account was fetched (1/0).', [
+            ({'account': account}, int(record.get('status') == 'ok')) for account, record in self.accounts.items()
+        ])
+        metric('account_api_calls', 'Cost Explorer requests made for each account.', [
+            ({'account': account}, record['api_calls']) for account, record in self.accounts.items() if 'api_calls' in record
+        ])
+        metric('account_retries', 'Cost Explorer retries for each account.', [
+            ({'account': account}, record['retries']) for account, record in self.accounts.items() if 'retries' in record
+        ])
+        for name, value in sorted(self.counters.items()):
+            metric(name, f"Last run value of {name}.", [(None, value)])
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path: str, success: bool, duration: float):
+        """
+        原子写入 Prometheus textfile（先写临时文件再重命名，避免采集到写了一半的文件）
+        """
+        text = self.render_textfile(success, duration)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)